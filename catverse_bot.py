@@ -1,10 +1,18 @@
 # ================= BASIC =================
 import os
+import sys
 import random
+import re
 import asyncio
+import logging
+import math
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
-from collections import deque
+from collections import OrderedDict, deque
+from functools import lru_cache
+from itertools import groupby
+from contextlib import aclosing
 
 # ================= TIMEZONE =================
 import pytz
@@ -13,13 +21,17 @@ import pytz
 from groq import AsyncGroq
 
 # ================= DATABASE =================
+import pymongo
 from pymongo import MongoClient
+import bson
+from bson import ObjectId
 
 # ================= TELEGRAM =================
 from telegram import (
     Update, InlineKeyboardMarkup, InlineKeyboardButton, Chat, ChatPermissions
 )
-from telegram.constants import ParseMode, ChatMemberStatus
+from telegram.constants import ParseMode, ChatMemberStatus, ChatType
+from telegram.error import BadRequest, Forbidden, RetryAfter, TelegramError
 
 from telegram.ext import (
     ApplicationBuilder,
@@ -39,19 +51,419 @@ OWNER_ID = 7789325573
 LOGGER_GROUP_ID = -1002024032988
 BOT_NAME = "Meowstric 😺"
 
+logger = logging.getLogger("catverse")
+
 if not BOT_TOKEN:
     raise RuntimeError("Missing BOT_TOKEN environment variable")
 
 if not MONGO_URI:
     raise RuntimeError("Missing MONGO_URI environment variable")
 
-client = MongoClient(MONGO_URI)
-db = client["catverse"]
-cats = db["cats"]
-global_state = db["global"]
-leaderboard_history = db["leaderboard_history"]
-users = db["users"]
-groups = db["groups"]
+# Mongo pool + per-operation timeout (seconds)
+MONGO_POOL_SIZE = int(os.getenv("MONGO_POOL_SIZE", "32"))
+DB_TIMEOUT = float(os.getenv("DB_TIMEOUT", "5"))
+
+mongo_client = MongoClient(
+    MONGO_URI,
+    maxPoolSize=MONGO_POOL_SIZE,
+    serverSelectionTimeoutMS=int(DB_TIMEOUT * 1000),
+)
+db = mongo_client["catverse"]
+
+# pymongo is blocking, so every call runs on this bounded pool instead of the event loop
+db_executor = ThreadPoolExecutor(max_workers=MONGO_POOL_SIZE, thread_name_prefix="mongo")
+
+
+class AsyncCollection:
+    """Awaitable wrapper around a pymongo collection.
+
+    Each call runs on ``db_executor`` under ``pymongo.timeout`` so a slow
+    query only blocks its own handler, never the whole bot.
+    """
+
+    def __init__(self, collection, timeout: float = DB_TIMEOUT):
+        self.collection = collection
+        self.timeout = timeout
+
+    async def _run(self, fn, *args, **kwargs):
+        timeout = self.timeout
+
+        def call():
+            with pymongo.timeout(timeout):
+                return fn(*args, **kwargs)
+
+        loop = asyncio.get_running_loop()
+        # small grace period so pymongo's own timeout fires first
+        return await asyncio.wait_for(loop.run_in_executor(db_executor, call), timeout + 1)
+
+    async def find_one(self, filter, *args, **kwargs):
+        return await self._run(self.collection.find_one, filter, *args, **kwargs)
+
+    async def find(self, filter=None, projection=None, sort=None, limit=0):
+        def fetch():
+            cursor = self.collection.find(filter or {}, projection)
+            if sort:
+                cursor = cursor.sort(sort)
+            if limit:
+                cursor = cursor.limit(limit)
+            return list(cursor)
+        return await self._run(fetch)
+
+    async def iterate_batches(self, filter=None, projection=None, batch_size=500, after=None):
+        """Walk a collection in ``_id`` order, one bounded batch per round trip."""
+        last_id = after
+        while True:
+            query = dict(filter or {})
+            if last_id is not None:
+                query["_id"] = {**query.get("_id", {}), "$gt": last_id}
+            batch = await self.find(query, projection, sort=[("_id", 1)], limit=batch_size)
+            if not batch:
+                return
+            yield batch
+            last_id = batch[-1]["_id"]
+
+    async def insert_one(self, doc, **kwargs):
+        return await self._run(self.collection.insert_one, doc, **kwargs)
+
+    async def insert_many(self, docs, **kwargs):
+        return await self._run(self.collection.insert_many, docs, **kwargs)
+
+    async def update_one(self, filter, update, **kwargs):
+        return await self._run(self.collection.update_one, filter, update, **kwargs)
+
+    async def update_many(self, filter, update, **kwargs):
+        return await self._run(self.collection.update_many, filter, update, **kwargs)
+
+    async def delete_one(self, filter, **kwargs):
+        return await self._run(self.collection.delete_one, filter, **kwargs)
+
+    async def delete_many(self, filter, **kwargs):
+        return await self._run(self.collection.delete_many, filter, **kwargs)
+
+    async def count_documents(self, filter, **kwargs):
+        return await self._run(self.collection.count_documents, filter, **kwargs)
+
+    async def aggregate(self, pipeline, **kwargs):
+        return await self._run(lambda: list(self.collection.aggregate(pipeline, **kwargs)))
+
+    async def find_one_and_update(self, filter, update, **kwargs):
+        return await self._run(self.collection.find_one_and_update, filter, update, **kwargs)
+
+    async def bulk_write(self, requests, **kwargs):
+        return await self._run(self.collection.bulk_write, requests, **kwargs)
+
+    async def run_atomic(self, fn):
+        """Run ``fn(session)`` inside a transaction when the server supports one.
+
+        A standalone mongod has no transactions, so there ``fn`` gets
+        ``session=None`` and must stay safe on its own (conditional updates).
+        """
+        client = self.collection.database.client
+
+        def call():
+            topology = client.topology_description.topology_type_name
+            if topology not in ("ReplicaSetWithPrimary", "Sharded", "LoadBalanced"):
+                return fn(None)
+            with client.start_session() as session:
+                return session.with_transaction(fn)
+
+        return await self._run(call)
+
+    async def create_index(self, keys, **kwargs):
+        return await self._run(self.collection.create_index, keys, **kwargs)
+
+    async def explain(self, command: dict):
+        """queryPlanner explain of a raw ``find``/``count`` command on this collection."""
+        command = {**command, next(iter(command)): self.collection.name}
+        return await self._run(
+            self.collection.database.command, "explain", command, verbosity="queryPlanner"
+        )
+
+
+cats = AsyncCollection(db["cats"])
+global_state = AsyncCollection(db["global"])
+leaderboard_history = AsyncCollection(db["leaderboard_history"])
+users = AsyncCollection(db["users"])
+groups = AsyncCollection(db["groups"])
+economy_ledger = AsyncCollection(db["economy_ledger"])
+ledger_balances = AsyncCollection(db["ledger_balances"])
+ledger_daily = AsyncCollection(db["ledger_daily"])
+group_members = AsyncCollection(db["group_members"])
+window_scores = AsyncCollection(db["window_scores"])
+
+# ================= CAT CODEC =================
+
+# short field names save ~100 bytes per cat; switching layouts is handled by
+# migrate_cats (and a $rename when a cat in the old layout is loaded)
+CAT_SHORT_KEYS = os.getenv("CAT_SHORT_KEYS", "0") == "1"
+COIN_CAP = 2 ** 62  # int64 with room for $inc; stands in for the owner's float("inf")
+COIN_INF_FLOOR = COIN_CAP // 2  # anything above still reads as inf, so debits can't make it finite
+
+SHORT_KEYS = {
+    "name": "nm",
+    "coins": "c",
+    "fish": "f",
+    "xp": "x",
+    "kills": "k",
+    "deaths": "d",
+    "premium": "p",
+    "inventory": "i",
+    "dna": "g",
+    "level": "lv",
+    "last_msg": "lm",
+    "protected_until": "pu",
+    "shield_until": "su",  # pre-v3, folded into protected_until
+    "jail_until": "ju",
+    "health_at": "ha",
+    "last_daily": "ld",
+    "last_claim": "lc",
+    "last_rob": "lr",
+    "fish_streak": "fs",
+    "last_fish_date": "lf",
+    "fish_total_earned": "ft",
+    "wanted": "w",
+    "created": "cr",
+}
+LONG_KEYS = {short: long for long, short in SHORT_KEYS.items()}
+
+# stored as int epoch seconds; the value says what handlers get back
+TIMESTAMP_FIELDS = {
+    "created": "aware",
+    "protected_until": "aware",
+    "shield_until": "aware",
+    "jail_until": "aware",
+    "health_at": "aware",
+    "last_daily": "naive",  # compared with datetime.utcnow()
+    "last_claim": "naive",
+    "last_fish_date": "date",  # ISO "YYYY-MM-DD"
+    "last_msg": "epoch",
+}
+
+
+def cat_field(path, short=None):
+    """Stored name of a (dotted) cat field under the active (or given) key layout."""
+    if not (CAT_SHORT_KEYS if short is None else short):
+        return path
+    top, dot, rest = path.partition(".")
+    return SHORT_KEYS.get(top, top) + dot + rest
+
+
+def stale_field(name):
+    """Name of a top-level field in the layout that is *not* active."""
+    return name if CAT_SHORT_KEYS else SHORT_KEYS[name]
+
+
+def _to_epoch(value):
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return int(value.timestamp())
+    if isinstance(value, str):
+        return int(datetime.fromisoformat(value).replace(tzinfo=timezone.utc).timestamp())
+    return int(value)
+
+
+def _from_epoch(value, kind):
+    if kind == "epoch":
+        return int(value)
+    if isinstance(value, str):
+        return value  # legacy ISO date
+    if isinstance(value, datetime):
+        stamp = value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+    else:
+        stamp = datetime.fromtimestamp(value, timezone.utc)
+    if kind == "naive":
+        return stamp.replace(tzinfo=None)
+    if kind == "date":
+        return stamp.date().isoformat()
+    return stamp
+
+
+def encode_value(path, value):
+    """Storage form of one cat field (the Python form is left untouched)."""
+    if value is None:
+        return None
+    if hasattr(value, "to_bson"):  # Dna / Inventory
+        value = value.to_bson()
+    if path in TIMESTAMP_FIELDS:
+        return _to_epoch(value)
+    if path == "coins":
+        return COIN_CAP if value >= COIN_INF_FLOOR else int(value)
+    if path == "inventory" and isinstance(value, dict):
+        return {item: count for item, count in value.items() if count}
+    return value
+
+
+def decode_value(name, value):
+    if value is None:
+        return None
+    if name in TIMESTAMP_FIELDS:
+        return _from_epoch(value, TIMESTAMP_FIELDS[name])
+    if name == "coins" and value >= COIN_INF_FLOOR:
+        return float("inf")
+    return value
+
+
+def encode_cat(cat, short=None):
+    return {cat_field(k, short): encode_value(k, v) for k, v in cat.items()}
+
+
+def decode_cat(raw):
+    """Python form of a stored cat; reads both key layouts and legacy values."""
+    cat = {}
+    for key, value in raw.items():
+        name = LONG_KEYS.get(key, key)
+        cat[name] = decode_value(name, value)
+    return cat
+
+
+def synthetic_cat(i):
+    """A plausible mid-game cat in the legacy (pre-codec) format."""
+    now = datetime.now(timezone.utc)
+    return {
+        "_id": 10 ** 9 + i,
+        "name": f"Cat {i}",
+        "coins": random.randint(0, 50000),
+        "fish": random.randint(0, 40),
+        "xp": random.randint(0, 30000),
+        "kills": random.randint(0, 200),
+        "deaths": random.randint(0, 200),
+        "premium": True,
+        "inventory": {
+            **{item: 0 for item in SHOP_ITEMS},
+            **{gift: 0 for gift in GIFT_ITEMS},
+            random.choice(list(SHOP_ITEMS)): random.randint(1, 5),
+        },
+        "dna": {"aggression": random.randint(1, 9), "intelligence": 1, "luck": random.randint(1, 9), "charm": 1},
+        "level": "😼 Rogue Cat",
+        "last_msg": time.time(),
+        "protected_until": None,
+        "last_daily": now.replace(tzinfo=None),
+        "last_claim": now.replace(tzinfo=None),
+        "last_rob": {},
+        "fish_streak": random.randint(0, 9),
+        "last_fish_date": now.date().isoformat(),
+        "fish_total_earned": random.randint(0, 90000),
+        "wanted": 0,
+        "created": now,
+        "schema_version": 1,
+    }
+
+
+def codec_report(docs, scale=1_000_000):
+    """Average BSON bytes per cat before/after encoding, and totals scaled to ``scale`` cats."""
+    sizes = {"legacy": 0, "compact": 0, "compact_short": 0}
+    for doc in docs:
+        cat = decode_cat(doc)
+        sizes["legacy"] += len(bson.encode(doc))
+        sizes["compact"] += len(bson.encode(encode_cat(cat, short=False)))
+        sizes["compact_short"] += len(bson.encode(encode_cat(cat, short=True)))
+
+    count = max(1, len(docs))
+    per_doc = {k: v / count for k, v in sizes.items()}
+    return {
+        "docs": len(docs),
+        "per_doc": per_doc,
+        "saved_per_doc": {k: per_doc["legacy"] - v for k, v in per_doc.items() if k != "legacy"},
+        "scaled_mb": {k: v * scale / 2 ** 20 for k, v in per_doc.items()},
+    }
+
+# ================= INDEXES =================
+
+STRICT_INDEXES = os.getenv("STRICT_INDEXES", "0") == "1"
+
+# users, groups and leaderboard_history are only read by _id, which Mongo
+# always indexes; cats are also sorted and range-counted by these fields.
+# An entry is a key list, or (key list, create_index options).
+REQUIRED_INDEXES = {
+    cats: [
+        [(cat_field("coins"), -1), ("_id", -1)],  # (score, _id): board pages are keyset on both
+        [(cat_field("kills"), -1), ("_id", -1)],
+        [(cat_field("fish_total_earned"), -1)],
+        [(cat_field("protected_until"), 1)],
+    ],
+    users: [],
+    groups: [],
+    leaderboard_history: [],
+    # events and daily totals are read by _id ranges only
+    economy_ledger: [],
+    ledger_daily: [],
+    ledger_balances: [
+        [("drift", 1)],
+    ],
+    # one record per (group, cat); boards sort inside a group, score updates go by user
+    group_members: [
+        [("g", 1), ("c", -1), ("u", -1)],
+        [("g", 1), ("k", -1), ("u", -1)],
+        [("g", 1), ("f", -1)],
+        [("u", 1)],
+    ],
+    # day/week counters; the TTL index on x deletes finished windows
+    window_scores: [
+        [("w", 1), ("k", -1)],
+        [("w", 1), ("f", -1)],
+        ([("x", 1)], {"expireAfterSeconds": 0}),
+    ],
+}
+
+# (collection, name, explain command) for every query on a hot path;
+# filter values are placeholders, only the shape matters to the planner
+HOT_QUERIES = [
+    (cats, "toprich", {"find": None, "filter": {"_id": {"$ne": OWNER_ID}}, "sort": {cat_field("coins"): -1, "_id": -1}, "limit": 11}),
+    (cats, "topkill", {"find": None, "filter": {"_id": {"$ne": OWNER_ID}}, "sort": {cat_field("kills"): -1, "_id": -1}, "limit": 11}),
+    (cats, "toprich:page", {"find": None, "filter": {"$and": [{"_id": {"$ne": OWNER_ID}}, {"$or": [
+        {cat_field("coins"): {"$lt": 0}}, {cat_field("coins"): 0, "_id": {"$lt": 0}},
+    ]}]}, "sort": {cat_field("coins"): -1, "_id": -1}, "limit": 11}),
+    (cats, "toprich:position", {"count": None, "query": {"$and": [{"_id": {"$ne": OWNER_ID}}, {"$or": [
+        {cat_field("coins"): {"$gt": 0}}, {cat_field("coins"): 0, "_id": {"$gt": 0}},
+    ]}]}}),
+    (cats, "fishlb", {"find": None, "filter": {}, "sort": {cat_field("fish_total_earned"): -1}, "limit": 5}),
+    (cats, "rank:coins", {"count": None, "query": {"_id": {"$ne": 0}, cat_field("coins"): {"$gt": 0}}}),
+    (cats, "rank:kills", {"count": None, "query": {"_id": {"$ne": 0}, cat_field("kills"): {"$gt": 0}}}),
+    (cats, "rank:fish", {"count": None, "query": {"_id": {"$ne": 0}, cat_field("fish_total_earned"): {"$gt": 0}}}),
+    (cats, "protected", {"count": None, "query": {cat_field("protected_until"): {"$gt": 0}}}),
+    (group_members, "group:toprich", {"find": None, "filter": {"g": 0, "u": {"$ne": OWNER_ID}}, "sort": {"c": -1, "u": -1}, "limit": 11}),
+    (group_members, "group:topkill", {"find": None, "filter": {"g": 0, "u": {"$ne": OWNER_ID}}, "sort": {"k": -1, "u": -1}, "limit": 11}),
+    (group_members, "group:fishlb", {"find": None, "filter": {"g": 0}, "sort": {"f": -1}, "limit": 5}),
+    (window_scores, "window:topkill", {"find": None, "filter": {"w": "", "k": {"$gt": 0}, "u": {"$ne": OWNER_ID}}, "sort": {"k": -1}, "limit": 10}),
+    (window_scores, "window:fishlb", {"find": None, "filter": {"w": "", "f": {"$gt": 0}}, "sort": {"f": -1}, "limit": 5}),
+    (group_members, "group:scores", {"count": None, "query": {"u": 0}}),
+    (leaderboard_history, "rank_arrows", {"find": None, "filter": {"_id": {"$in": ["rich_0", "kill_0"]}}}),
+]
+
+
+def _plan_stages(plan):
+    """Yield every stage name in an explain plan tree (classic and SBE layouts)."""
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            yield plan["stage"]
+        for value in plan.values():
+            yield from _plan_stages(value)
+    elif isinstance(plan, list):
+        for value in plan:
+            yield from _plan_stages(value)
+
+
+async def ensure_indexes():
+    for collection, indexes in REQUIRED_INDEXES.items():
+        for index in indexes:
+            keys, options = index if isinstance(index, tuple) else (index, {})
+            await collection.create_index(keys, **options)
+
+    scans = []
+    for collection, name, command in HOT_QUERIES:
+        explain = await collection.explain(command)
+        winning = explain.get("queryPlanner", {}).get("winningPlan", {})
+        if "COLLSCAN" in set(_plan_stages(winning)):
+            scans.append(name)
+
+    if scans:
+        message = f"hot queries fall back to a collection scan: {', '.join(scans)}"
+        if STRICT_INDEXES:
+            raise RuntimeError(message)
+        logger.warning(message)
+    else:
+        logger.info("indexes verified for %d hot queries", len(HOT_QUERIES))
 
 # ================= LEVELS =================
 
@@ -68,12 +480,800 @@ LEVELS = [
 def is_owner_user(user_id: int) -> bool:
     return user_id == OWNER_ID
     
+# ================= OUTBOX =================
+
+# lanes, lowest number is sent first
+PRIORITY_REPLY = 0   # command replies and button edits
+PRIORITY_NOTIFY = 1  # DMs, level-ups, welcomes
+PRIORITY_LOG = 2     # logger group posts
+PRIORITY_BULK = 3    # broadcasts
+
+OUTBOX_GLOBAL_RATE = float(os.getenv("OUTBOX_GLOBAL_RATE", "28"))  # Telegram: ~30 msg/s per bot
+OUTBOX_CONCURRENCY = int(os.getenv("OUTBOX_CONCURRENCY", "32"))
+OUTBOX_DROP_DEPTH = int(os.getenv("OUTBOX_DROP_DEPTH", "500"))  # droppable messages beyond this are skipped
+OUTBOX_MAX_BUCKETS = 10000
+MAX_MESSAGE_LENGTH = 4096
+
+
+class TokenBucket:
+    """Classic token bucket; ``pause`` drains it so RetryAfter stops every sender."""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self) -> bool:
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def delay(self) -> float:
+        """Seconds until the next token is available."""
+        self._refill()
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+    def is_full(self) -> bool:
+        self._refill()
+        return self.tokens >= self.capacity
+
+    async def acquire(self):
+        while not self.try_acquire():
+            await asyncio.sleep(self.delay())
+
+    def pause(self, seconds: float):
+        self._refill()
+        self.tokens = min(self.tokens, -seconds * self.rate)
+
+
+def chat_bucket(chat_id: int) -> TokenBucket:
+    # private chats: ~1 msg/s; groups: 20 msg/min
+    if chat_id > 0:
+        return TokenBucket(1, capacity=3)
+    return TokenBucket(20 / 60, capacity=5)
+
+
+class OutboxItem:
+    __slots__ = ("chat_id", "text", "call", "priority", "merge_key", "future", "enqueued", "attempts")
+
+    def __init__(self, chat_id, text, call, priority, merge_key):
+        self.chat_id = chat_id
+        self.text = text
+        self.call = call
+        self.priority = priority
+        self.merge_key = merge_key
+        self.future = asyncio.get_running_loop().create_future()
+        self.enqueued = time.monotonic()
+        self.attempts = 0
+
+
+class Outbox:
+    """Central scheduler every outgoing message goes through.
+
+    Messages wait in priority lanes and go out when both their chat's bucket
+    and the global bucket have a token, so a burst in one chat never delays
+    replies elsewhere. RetryAfter pauses only the affected chat and requeues
+    the message. Under pressure droppable notifications are skipped and
+    queued log posts for the same chat are merged into one message.
+    """
+
+    def __init__(self, global_rate: float, concurrency: int, drop_depth: int):
+        self.global_bucket = TokenBucket(global_rate)
+        self.concurrency = concurrency
+        self.drop_depth = drop_depth
+        self._lanes = {p: deque() for p in (PRIORITY_REPLY, PRIORITY_NOTIFY, PRIORITY_LOG, PRIORITY_BULK)}
+        self._buckets = OrderedDict()  # chat_id -> TokenBucket, least recently used first
+        self._wakeup = None
+        self._slots = None
+        self._task = None
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        self.merged = 0
+        self.retries = 0
+        self.avg_wait = 0.0
+        self.max_wait = 0.0
+
+    def depth(self) -> int:
+        return sum(len(lane) for lane in self._lanes.values())
+
+    def submit(self, chat_id, text, call, priority=PRIORITY_REPLY, merge_key=None, droppable=False):
+        """Queue ``call(text)`` for ``chat_id``; returns a future with its result."""
+        self._ensure_started()
+        lane = self._lanes[priority]
+
+        if merge_key:
+            for queued in lane:
+                if (queued.chat_id == chat_id and queued.merge_key == merge_key
+                        and len(queued.text) + len(text) + 2 <= MAX_MESSAGE_LENGTH):
+                    queued.text += "\n\n" + text
+                    self.merged += 1
+                    return queued.future
+
+        if droppable and self.depth() >= self.drop_depth:
+            self.dropped += 1
+            future = asyncio.get_running_loop().create_future()
+            future.set_result(None)
+            return future
+
+        item = OutboxItem(chat_id, text, call, priority, merge_key)
+        lane.append(item)
+        self._wakeup.set()
+        return item.future
+
+    def _ensure_started(self):
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._slots = asyncio.Semaphore(self.concurrency)
+            self._task = asyncio.create_task(self._run())
+
+    def _bucket(self, chat_id) -> TokenBucket:
+        bucket = self._buckets.get(chat_id)
+        if bucket is not None:
+            self._buckets.move_to_end(chat_id)
+            return bucket
+        if len(self._buckets) >= OUTBOX_MAX_BUCKETS:
+            # idle chats have refilled completely, forgetting them changes nothing
+            for key in [k for k, b in self._buckets.items() if b.is_full()]:
+                del self._buckets[key]
+            # still over the cap: everyone is busy, drop the chats quiet the longest
+            while len(self._buckets) >= OUTBOX_MAX_BUCKETS:
+                self._buckets.popitem(last=False)
+        bucket = self._buckets[chat_id] = chat_bucket(chat_id)
+        return bucket
+
+    def _pick(self):
+        """Highest-priority item whose chat can send now, else the shortest wait."""
+        wait = None
+        for lane in self._lanes.values():
+            blocked = set()
+            for item in lane:
+                if item.chat_id in blocked:
+                    continue  # keep per-chat order inside a lane
+                bucket = self._bucket(item.chat_id)
+                if bucket.try_acquire():
+                    lane.remove(item)
+                    return item, None
+                blocked.add(item.chat_id)
+                delay = bucket.delay()
+                wait = delay if wait is None else min(wait, delay)
+        return None, wait
+
+    async def _run(self):
+        while True:
+            item, wait = self._pick()
+            if item is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            await self.global_bucket.acquire()
+            await self._slots.acquire()
+            asyncio.create_task(self._deliver(item))
+
+    async def _deliver(self, item):
+        waited = time.monotonic() - item.enqueued
+        try:
+            result = await item.call(item.text)
+        except RetryAfter as e:
+            self.retries += 1
+            item.attempts += 1
+            self._bucket(item.chat_id).pause(e.retry_after)
+            if item.attempts < 3 and not item.future.done():
+                self._lanes[item.priority].appendleft(item)
+                self._wakeup.set()
+            else:
+                self.failed += 1
+                if not item.future.done():
+                    item.future.set_exception(e)
+        except Exception as e:
+            self.failed += 1
+            # the caller may have given up (cancelled) while this was in flight
+            if not item.future.done():
+                item.future.set_exception(e)
+        else:
+            self.sent += 1
+            self.avg_wait = waited if self.sent == 1 else 0.9 * self.avg_wait + 0.1 * waited
+            self.max_wait = max(self.max_wait, waited)
+            if not item.future.done():
+                item.future.set_result(result)
+        finally:
+            self._slots.release()
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def stats(self):
+        return {
+            "depth": {p: len(lane) for p, lane in self._lanes.items()},
+            "sent": self.sent,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "merged": self.merged,
+            "retries": self.retries,
+            "avg_wait": self.avg_wait,
+            "max_wait": self.max_wait,
+        }
+
+
+outbox = Outbox(OUTBOX_GLOBAL_RATE, OUTBOX_CONCURRENCY, OUTBOX_DROP_DEPTH)
+
+
+async def reply(message, text, priority=PRIORITY_REPLY, **kwargs):
+    return await outbox.submit(message.chat_id, text, lambda t: message.reply_text(t, **kwargs), priority)
+
+
+async def edit(message, text, **kwargs):
+    return await outbox.submit(message.chat_id, text, lambda t: message.edit_text(t, **kwargs), PRIORITY_REPLY)
+
+
+async def send(bot, chat_id, text, priority=PRIORITY_NOTIFY, merge_key=None, droppable=False, **kwargs):
+    return await outbox.submit(
+        chat_id, text, lambda t: bot.send_message(chat_id, t, **kwargs),
+        priority, merge_key, droppable,
+    )
+    
+# ================= CAT MODEL =================
+
+_MISSING = object()
+
+
+class SlotMapping:
+    """Dict-style access to a slotted object's ``FIELDS``.
+
+    Hot handlers read attributes (``cat.coins``); the dotted-path helpers and
+    the rest of the handlers keep using ``cat["coins"]`` / ``cat.get(...)``.
+    """
+
+    __slots__ = ()
+    FIELDS = ()
+
+    def __getitem__(self, key):
+        if key in self.FIELDS:
+            value = getattr(self, key, _MISSING)
+            if value is not _MISSING:
+                return value
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key not in self.FIELDS:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return key in self.FIELDS and hasattr(self, key)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def keys(self):
+        return [k for k in self.FIELDS if hasattr(self, k)]
+
+    def items(self):
+        return [(k, self[k]) for k in self.keys()]
+
+
+class Dna(SlotMapping):
+    FIELDS = ("aggression", "intelligence", "luck", "charm")
+    __slots__ = FIELDS
+
+    def __init__(self, **stats):
+        for stat in self.FIELDS:
+            setattr(self, stat, stats.get(stat, 1))
+
+    @classmethod
+    def from_bson(cls, doc):
+        return cls(**(doc or {}))
+
+    def to_bson(self):
+        return dict(self.items())
+
+
+class Inventory:
+    """Item counts. Only non-zero counts are kept; a missing item reads as 0."""
+
+    __slots__ = ("counts",)
+
+    def __init__(self, counts=None):
+        self.counts = {item: n for item, n in (counts or {}).items() if n}
+
+    def __getitem__(self, item):
+        return self.counts.get(item, 0)
+
+    def __setitem__(self, item, count):
+        if count:
+            self.counts[item] = count
+        else:
+            self.counts.pop(item, None)
+
+    def __contains__(self, item):
+        return item in self.counts
+
+    def __iter__(self):
+        return iter(self.counts)
+
+    def __len__(self):
+        return len(self.counts)
+
+    def get(self, item, default=0):
+        return self.counts.get(item, default)
+
+    def keys(self):
+        return self.counts.keys()
+
+    def items(self):
+        return self.counts.items()
+
+    def to_bson(self):
+        return dict(self.counts)
+
+
+class PartialCatError(RuntimeError):
+    """A cat read through a projection touched a field it never loaded."""
+
+
+class CatState(SlotMapping):
+    """One cat in memory, plus the changes not yet written back.
+
+    Fields the model doesn't know about are kept in ``extra`` so nothing
+    stored is lost. ``track`` merges every change into one ``$inc``/``$set``
+    per path; ``delta`` turns them into the update the cache flushes.
+
+    A cat read through a projection is partial: ``loaded`` names its
+    fields, reading any other field raises PartialCatError, and it is
+    read-only, so it can never write back a field it didn't load.
+    """
+
+    FIELDS = (
+        "_id", "name", "coins", "fish", "xp", "kills", "deaths", "health", "premium",
+        "inventory", "dna", "level", "last_msg", "protected_until", "jail_until",
+        "health_at", "last_daily", "last_claim", "last_rob", "fish_streak",
+        "last_fish_date", "fish_total_earned", "wanted", "created", "schema_version",
+    )
+    __slots__ = FIELDS + ("extra", "changes", "loaded")
+
+    def __init__(self):
+        self.extra = None
+        self.changes = None  # {"$inc": {path: amount}, "$set": {paths}}
+        self.loaded = None   # frozenset of field names when partial
+
+    @property
+    def id(self):
+        return self._id
+
+    @property
+    def partial(self):
+        return self.loaded is not None
+
+    def _check_loaded(self, path):
+        field = path.partition(".")[0]
+        if self.loaded is not None and field != "_id" and field not in self.loaded:
+            raise PartialCatError(
+                f"cat {self._id} was loaded with {sorted(self.loaded)}, not {field!r}"
+            )
+
+    # ---- dict-style access, with unknown fields in ``extra`` ----
+
+    def __getitem__(self, key):
+        self._check_loaded(key)
+        if key in self.FIELDS:
+            return super().__getitem__(key)
+        if self.extra and key in self.extra:
+            return self.extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key == "inventory" and not isinstance(value, Inventory):
+            value = Inventory(value)
+        elif key == "dna" and not isinstance(value, Dna):
+            value = Dna.from_bson(value)
+        if key in self.FIELDS:
+            setattr(self, key, value)
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+
+    def __contains__(self, key):
+        return super().__contains__(key) or bool(self.extra and key in self.extra)
+
+    def keys(self):
+        return super().keys() + list(self.extra or ())
+
+    # ---- BSON ----
+
+    @classmethod
+    def from_dict(cls, doc):
+        cat = cls()
+        for key, value in doc.items():
+            cat[key] = value
+        return cat
+
+    @classmethod
+    def from_bson(cls, raw, fields=None):
+        cat = cls.from_dict(decode_cat(raw))
+        if fields is not None:
+            cat.loaded = frozenset(fields)
+        return cat
+
+    def to_dict(self):
+        return {k: v.to_bson() if hasattr(v, "to_bson") else v for k, v in self.items()}
+
+    def to_bson(self, short=None):
+        return encode_cat(self.to_dict(), short)
+
+    # ---- change tracking ----
+
+    def check_writable(self, path):
+        if self.loaded is not None:
+            raise PartialCatError(
+                f"cat {self._id} was loaded with {sorted(self.loaded)} and is read-only, can't write {path!r}"
+            )
+
+    def track(self, path, amount=None):
+        """Queue a ``$inc`` of ``amount`` on ``path``, or a ``$set`` of it when ``amount`` is None."""
+        self.check_writable(path)
+        if self.changes is None:
+            self.changes = {"$inc": {}, "$set": set()}
+        incs, sets = self.changes["$inc"], self.changes["$set"]
+        if any(path == p or path.startswith(p + ".") for p in sets):
+            return  # already covered by a $set of this path or a parent
+
+        if amount is None:
+            # a $set replaces anything queued underneath it
+            for p in [p for p in incs if p == path or p.startswith(path + ".")]:
+                del incs[p]
+            sets.difference_update([p for p in sets if p.startswith(path + ".")])
+            sets.add(path)
+        else:
+            incs[path] = incs.get(path, 0) + amount
+
+    def take_changes(self):
+        changes, self.changes = self.changes, None
+        return changes
+
+    def restore_changes(self, changes):
+        """Put back changes whose write failed, merged with anything tracked since."""
+        if not changes:
+            return
+        for path in changes["$set"]:
+            self.track(path)
+        for path, amount in changes["$inc"].items():
+            self.track(path, amount)
+
+    def delta(self, changes):
+        """Mongo update for ``changes``, with values read from the object right now."""
+        if not changes:
+            return None
+        update = {}
+        if changes["$set"]:
+            update["$set"] = {cat_field(p): encode_value(p, get_path(self, p)) for p in changes["$set"]}
+        for p, amount in changes["$inc"].items():
+            if p.startswith("inventory.") and not _get_number(self, p):
+                # inventory is stored sparse, drop items that ran out
+                update.setdefault("$unset", {})[cat_field(p)] = ""
+            else:
+                update.setdefault("$inc", {})[cat_field(p)] = amount
+        return update or None
+
+
+def deep_size(obj, seen=None):
+    """Rough bytes held by ``obj``: containers and slotted objects are followed."""
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_size(k, seen) + deep_size(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, deque)):
+        size += sum(deep_size(v, seen) for v in obj)
+    else:
+        for cls in type(obj).__mro__:
+            for slot in getattr(cls, "__slots__", ()):
+                size += deep_size(getattr(obj, slot, None), seen)
+    return size
+
+
+def memory_report(docs):
+    """Average in-memory bytes per cat as a plain dict vs a ``CatState``.
+
+    One ``seen`` set per representation, so shared keys and small ints
+    count once for the whole sample, like they do in a real cache.
+    """
+    plain = [decode_cat(doc) for doc in docs]
+    models = [CatState.from_dict(doc) for doc in plain]
+    count = max(1, len(docs))
+    return {
+        "dict": deep_size(plain) / count,
+        "model": deep_size(models) / count,
+    }
+
+# ================= CAT CACHE =================
+
+CAT_CACHE_SIZE = int(os.getenv("CAT_CACHE_SIZE", "5000"))
+CAT_FLUSH_INTERVAL = float(os.getenv("CAT_FLUSH_INTERVAL", "5"))
+
+
+def get_path(doc, path):
+    for key in path.split("."):
+        doc = doc[key]
+    return doc
+
+
+def _get_number(doc, path):
+    try:
+        return get_path(doc, path) or 0
+    except (KeyError, TypeError):
+        return 0
+
+
+def set_path(doc, path, value):
+    *parents, last = path.split(".")
+    for key in parents:
+        doc = doc.setdefault(key, {})
+    doc[last] = value
+
+
+class CatCache:
+    """Write-behind LRU cache of ``CatState`` objects.
+
+    Handlers never write cats directly: ``inc`` and ``set`` apply a change to
+    the cached object, which tracks it as an atomic ``$inc`` or a ``$set`` on
+    just that path. Dirty cats are sent in one unordered ``bulk_write`` every
+    ``flush_interval`` seconds and at shutdown, so two commands touching the
+    same cat never overwrite each other's fields. Dirty cats that fall out of
+    the LRU stay in memory until flushed, and until that write has landed.
+    """
+
+    def __init__(self, collection, loader, max_size: int, flush_interval: float, partial_loader=None):
+        self.collection = collection
+        self.loader = loader
+        self.partial_loader = partial_loader
+        self.max_size = max_size
+        self.flush_interval = flush_interval
+        self._docs = OrderedDict()  # user_id -> CatState, oldest first
+        self._dirty = {}            # user_id -> CatState with unsaved changes (cached or evicted)
+        self._inflight = {}         # user_id -> CatState whose bulk_write hasn't returned yet
+        self._loading = {}          # user_id -> in-flight load task
+        self._stale = set()         # user_ids to reload once their pending changes are written
+        self._task = None
+        self.hits = 0
+        self.misses = 0
+        self.partial_reads = 0
+        self.evictions = 0
+        self.flushes = 0
+        self.writes = 0
+        self.reloads = 0
+
+    async def get(self, user, fields=None):
+        """The cached cat, or on a miss a fresh load (only ``fields`` of it, if given).
+
+        Partial cats are never cached, so later full reads can't see them.
+        """
+        cat = self._docs.get(user.id)
+        if cat is not None:
+            self._docs.move_to_end(user.id)
+            self.hits += 1
+            return cat
+
+        # evicted but not written yet: reading Mongo now would miss those changes
+        cat = self._dirty.get(user.id) or self._inflight.get(user.id)
+        if cat is not None:
+            self.hits += 1
+            self._admit(user.id, cat)
+            return cat
+
+        if fields is not None and self.partial_loader is not None:
+            cat = await self.partial_loader(user, fields)
+            if cat is not None:
+                self.partial_reads += 1
+                return cat
+
+        self.misses += 1
+        # concurrent misses for the same cat share one load so they share one object
+        task = self._loading.get(user.id)
+        if task is None:
+            task = asyncio.ensure_future(self._load(user))
+            self._loading[user.id] = task
+            task.add_done_callback(lambda _: self._loading.pop(user.id, None))
+        return await asyncio.shield(task)
+
+    async def _load(self, user):
+        cat, backfilled = await self.loader(user)
+        self._admit(user.id, cat)
+        for field in backfilled:
+            self._record(cat, field)
+        return cat
+
+    def _admit(self, user_id, cat):
+        self._docs[user_id] = cat
+        while len(self._docs) > self.max_size:
+            self._docs.popitem(last=False)  # dirty ones are still held by _dirty
+            self.evictions += 1
+
+    def _current(self, user_id):
+        return self._docs.get(user_id) or self._dirty.get(user_id) or self._inflight.get(user_id)
+
+    def peek(self, user_id):
+        """The cat held in memory, if any, without loading it or touching LRU order."""
+        return self._current(user_id)
+
+    def _record(self, cat, path, amount=None):
+        target = self._current(cat["_id"]) or cat
+        target.track(path, amount)
+        self._dirty[target["_id"]] = target
+
+    def _apply(self, cat, path, fn):
+        set_path(cat, path, fn(cat, path))
+        current = self._current(cat["_id"])
+        if current is not None and current is not cat:
+            set_path(current, path, fn(current, path))
+
+    def apply_committed(self, user_id, inc=None, set=None):
+        """Mirror a write that already reached Mongo into the cached copy."""
+        cat = self._current(user_id)
+        if cat is None:
+            return
+        for path, value in (set or {}).items():
+            set_path(cat, path, value)
+        for path, amount in (inc or {}).items():
+            set_path(cat, path, _get_number(cat, path) + amount)
+
+    def inc(self, cat, path, amount=1):
+        cat.check_writable(path)
+        self._apply(cat, path, lambda doc, p: _get_number(doc, p) + amount)
+        self._record(cat, path, amount)
+
+    def set(self, cat, path, value):
+        cat.check_writable(path)
+        self._apply(cat, path, lambda doc, p: value)
+        self._record(cat, path)
+
+    async def flush(self, user_ids=None):
+        """Write pending changes to Mongo; only for ``user_ids`` if given."""
+        if user_ids is None:
+            dirty, self._dirty = self._dirty, {}
+        else:
+            dirty = {u: self._dirty.pop(u) for u in user_ids if u in self._dirty}
+
+        taken = []  # (cat, changes) per request, same order
+        requests = []
+        for cat in dirty.values():
+            changes = cat.take_changes()
+            update = cat.delta(changes)
+            if update:
+                taken.append((cat, changes))
+                requests.append(pymongo.UpdateOne({"_id": cat["_id"]}, update))
+
+        if not requests:
+            self._drop_stale()
+            return 0
+
+        inflight = {cat["_id"]: cat for cat, _ in taken}
+        self._inflight.update(inflight)
+        try:
+            await self.collection.bulk_write(requests, ordered=False)
+        except pymongo.errors.BulkWriteError as e:
+            # the server applied everything but the listed ops: only those are retried
+            failed = {err["index"] for err in e.details.get("writeErrors", [])}
+            for i in failed:
+                self._retry(*taken[i])
+            if e.details.get("writeConcernErrors"):
+                self._mark_stale(cat for i, (cat, _) in enumerate(taken) if i not in failed)
+            self.writes += len(requests) - len(failed)
+            raise
+        except Exception:
+            # unknown outcome: replaying a $inc could apply it twice, reload these cats instead
+            self._mark_stale(cat for cat, _ in taken)
+            raise
+        finally:
+            for user_id, cat in inflight.items():
+                if self._inflight.get(user_id) is cat:
+                    del self._inflight[user_id]
+
+        self.flushes += 1
+        self.writes += len(requests)
+        self._drop_stale()
+        return len(requests)
+
+    def _retry(self, cat, changes):
+        target = self._current(cat["_id"]) or cat
+        target.restore_changes(changes)
+        if target.changes:
+            self._dirty[target["_id"]] = target
+
+    def _mark_stale(self, stale_cats):
+        """Forget cats whose last write may or may not have landed; the next ``get`` reloads them.
+
+        One with newer changes stays until those are written (they're relative, so safe).
+        """
+        for cat in stale_cats:
+            user_id = cat["_id"]
+            if user_id in self._dirty:
+                self._stale.add(user_id)
+            else:
+                self._docs.pop(user_id, None)
+                self.reloads += 1
+
+    def _drop_stale(self):
+        for user_id in [u for u in self._stale if u not in self._dirty]:
+            self._stale.discard(user_id)
+            self._docs.pop(user_id, None)
+            self.reloads += 1
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("cat cache flush failed")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._docs),
+            "dirty": len(self._dirty),
+            "inflight": len(self._inflight),
+            "hits": self.hits,
+            "misses": self.misses,
+            "partial_reads": self.partial_reads,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "flushes": self.flushes,
+            "writes": self.writes,
+            "reloads": self.reloads,
+        }
+
+
 # ================= DATABASE =================
 
-def get_cat(user):
-    cat = cats.find_one({"_id": user.id})
+# bump when default_data or the stored encoding changes; migrate_cats upgrades old docs
+# v2: compact codec (sparse inventory, int epoch timestamps, int64 coins)
+# v3: shield_until folded into protected_until
+CAT_SCHEMA_VERSION = 3
+CAT_MIGRATION_BATCH = int(os.getenv("CAT_MIGRATION_BATCH", "1000"))
+CAT_MIGRATION_ID = f"migration:cats:v{CAT_SCHEMA_VERSION}:{'short' if CAT_SHORT_KEYS else 'long'}"
+
+
+def cat_defaults(user=None):
+    """Fields every cat has. ``name`` needs the Telegram user, so it's left out without one."""
     default_data = {
-        "name": user.first_name,
         "coins": 500,
         "fish": 2,
         "xp": 0,
@@ -95,19 +1295,622 @@ def get_cat(user):
         "wanted": 0,
         "created": datetime.now(timezone.utc),
     }
-    if not cat:
-        cat = {"_id": user.id, **default_data}
-        cats.insert_one(cat)
-    else:
-        update_fields = {k: v for k, v in default_data.items() if k not in cat}
-        if update_fields:
-            cats.update_one({"_id": user.id}, {"$set": update_fields})
-            cat.update(update_fields)
-    return cat
+    if user is not None:
+        default_data["name"] = user.first_name
+    return default_data
+
+
+async def load_cat(user):
+    """Read (or create) a cat from Mongo. Returns its ``CatState`` and the fields to rewrite."""
+    raw = await cats.find_one({"_id": user.id})
+    if raw and raw.get("schema_version") == CAT_SCHEMA_VERSION and stale_field("coins") not in raw:
+        return CatState.from_bson(raw), ()  # ⚡ already has every field, nothing to diff
+
+    default_data = cat_defaults(user)
+    if not raw:
+        cat = {"_id": user.id, **default_data, "schema_version": CAT_SCHEMA_VERSION}
+        await cats.insert_one(encode_cat(cat))
+        ledger.record(user.id, "signup", "coins", default_data["coins"])
+        return CatState.from_dict(cat), ()
+
+    # stored in the other key layout: rename in place so cached writes hit the right keys
+    renames = {stale_field(name): cat_field(name) for name in SHORT_KEYS if stale_field(name) in raw}
+    if renames:
+        await cats.update_one({"_id": user.id}, {"$rename": renames})
+    stored = {renames.get(k, k): v for k, v in raw.items()}
+
+    cat = decode_cat(raw)
+    shield_until = cat.pop("shield_until", None)
+    if shield_until or cat_field("shield_until") in stored:
+        # pre-v3 shield: one protection field now, fold it in right away
+        protected_until = max(filter(None, (cat.get("protected_until"), shield_until)), default=None)
+        cat["protected_until"] = protected_until
+        await cats.update_one({"_id": user.id}, {
+            "$set": {cat_field("protected_until"): encode_value("protected_until", protected_until)},
+            "$unset": {cat_field("shield_until"): ""},
+        })
+        stored[cat_field("protected_until")] = encode_value("protected_until", protected_until)
+    legacy = [k for k, v in cat.items() if k != "_id" and encode_value(k, v) != stored.get(cat_field(k))]
+    update_fields = {k: v for k, v in default_data.items() if k not in cat}
+    update_fields["schema_version"] = CAT_SCHEMA_VERSION
+    cat.update(update_fields)
+    return CatState.from_dict(cat), [*update_fields, *legacy]
+
+
+def _epoch_seconds(expr):
+    return {"$toLong": {"$divide": [{"$toLong": expr}, 1000]}}
+
+
+def cat_upgrade_pipeline():
+    """Update pipeline that brings any stored cat to the current schema and layout."""
+    def ref(name):
+        return f"${cat_field(name)}"
+
+    def is_type(name, bson_type):
+        return {"$eq": [{"$type": ref(name)}, bson_type]}
+
+    layout = {cat_field(name): {"$ifNull": [ref(name), f"${stale_field(name)}"]} for name in SHORT_KEYS}
+    fill_missing = {
+        cat_field(name): {"$cond": [is_type(name, "missing"), {"$literal": encode_value(name, value)}, ref(name)]}
+        for name, value in cat_defaults().items()
+    }
+    compact = {
+        cat_field(name): {"$switch": {"branches": [
+            {"case": is_type(name, "date"), "then": _epoch_seconds(ref(name))},
+            {"case": is_type(name, "string"), "then": _epoch_seconds({"$dateFromString": {"dateString": ref(name)}})},
+            {"case": is_type(name, "double"), "then": {"$toLong": ref(name)}},
+        ], "default": ref(name)}}
+        for name in TIMESTAMP_FIELDS
+    }
+    compact[cat_field("coins")] = {
+        "$cond": [{"$gte": [ref("coins"), COIN_INF_FLOOR]}, COIN_CAP, {"$toLong": ref("coins")}]
+    }
+    compact[cat_field("inventory")] = {"$cond": [
+        is_type("inventory", "object"),
+        {"$arrayToObject": {"$filter": {
+            "input": {"$objectToArray": ref("inventory")}, "cond": {"$ne": ["$$this.v", 0]},
+        }}},
+        ref("inventory"),
+    ]}
+    compact["schema_version"] = CAT_SCHEMA_VERSION
+    # $max skips null/missing, so whichever expiry is later wins
+    protection = {cat_field("protected_until"): {"$max": [ref("protected_until"), ref("shield_until")]}}
+
+    return [
+        {"$set": layout},
+        {"$unset": [stale_field(name) for name in SHORT_KEYS]},
+        {"$set": fill_missing},
+        {"$set": compact},
+        {"$set": protection},
+        {"$unset": [cat_field("shield_until")]},
+    ]
+
+
+async def migrate_cats(batch_size: int = CAT_MIGRATION_BATCH):
+    """Upgrade old cats to ``CAT_SCHEMA_VERSION`` in the background.
+
+    One pipelined ``update_many`` per batch of ids renames keys to the
+    active layout, fills missing fields and compacts legacy values, all
+    server-side. Progress is checkpointed in ``global`` so a restart picks
+    up where the last run stopped. A missing ``name`` stays missing (it
+    needs the Telegram user); readers already fall back to "Cat".
+    """
+    state_id = CAT_MIGRATION_ID
+    state = await global_state.find_one({"_id": state_id}) or {}
+    if state.get("state") == "done":
+        return
+
+    outdated = {"$or": [
+        {"schema_version": {"$ne": CAT_SCHEMA_VERSION}},
+        {stale_field("coins"): {"$exists": True}},
+    ]}
+    upgrade = cat_upgrade_pipeline()
+
+    migrated = state.get("migrated", 0)
+    remaining = await cats.count_documents(outdated)
+    logger.info("cat migration to v%d: %d cats left", CAT_SCHEMA_VERSION, remaining)
+
+    async for batch in cats.iterate_batches(outdated, {"_id": 1}, batch_size, after=state.get("last_id")):
+        ids = [c["_id"] for c in batch]
+        result = await cats.update_many({"_id": {"$in": ids}, **outdated}, upgrade)
+        migrated += result.modified_count
+        remaining = max(0, remaining - len(ids))
+        await global_state.update_one(
+            {"_id": state_id},
+            {"$set": {
+                "type": "migration",
+                "state": "running",
+                "last_id": ids[-1],
+                "migrated": migrated,
+                "remaining": remaining,
+                "updated": datetime.utcnow(),
+            }},
+            upsert=True,
+        )
+        logger.info("cat migration to v%d: %d done, ~%d left", CAT_SCHEMA_VERSION, migrated, remaining)
+
+    await global_state.update_one(
+        {"_id": state_id},
+        {"$set": {"type": "migration", "state": "done", "remaining": 0, "updated": datetime.utcnow()}},
+        upsert=True,
+    )
+    logger.info("cat migration to v%d finished, %d cats upgraded", CAT_SCHEMA_VERSION, migrated)
+
+
+# fields each read-only command needs; a cache miss reads only these
+CAT_READS = {
+    "bal": ("coins",),
+    "inventory": ("inventory",),
+    "xp": ("level", "xp", "dna", "fish"),
+    "meow": ("level", "coins", "fish", "kills", "deaths", "dna"),
+    "fishlb": ("name", "fish_total_earned"),
+    "toprich": ("name", "coins"),
+    "topkill": ("name", "kills"),
+}
+
+
+def cat_projection(fields):
+    return {cat_field(f): 1 for f in fields}
+
+
+async def load_partial_cat(user, fields):
+    """Read only ``fields`` of a cat; None if it needs a full load (new, outdated or old layout)."""
+    projection = {**cat_projection(fields), "schema_version": 1, stale_field("coins"): 1}
+    raw = await cats.find_one({"_id": user.id}, projection)
+    if not raw or raw.get("schema_version") != CAT_SCHEMA_VERSION or stale_field("coins") in raw:
+        return None
+    del raw["schema_version"]
+    return CatState.from_bson(raw, fields)
+
+
+def projection_report(docs):
+    """Average stored bytes a command reads per cat: whole document vs its CAT_READS projection."""
+    count = max(1, len(docs))
+    full = sum(len(bson.encode(doc)) for doc in docs) / count
+    report = {}
+    for command, fields in CAT_READS.items():
+        keep = {"_id", *cat_projection(fields)}
+        projected = sum(len(bson.encode({k: v for k, v in doc.items() if k in keep})) for doc in docs)
+        report[command] = (full, projected / count)
+    return report
+
+
+cat_cache = CatCache(cats, load_cat, CAT_CACHE_SIZE, CAT_FLUSH_INTERVAL, load_partial_cat)
+
+
+async def get_cat(user, fields=None):
+    """Cat of a Telegram user. Read-only commands pass ``fields`` (see CAT_READS)."""
+    return await cat_cache.get(user, fields)
+
+
+def cat_inc(cat, path, amount=1, reason=None):
+    """Add ``amount`` to a (dotted) field, e.g. ``cat_inc(cat, "dna.luck", 2)``.
+
+    Coin and item changes pass a ``reason`` so they land in the ledger.
+    """
+    cat_cache.inc(cat, path, amount)
+    if path in GROUP_BOARD_FIELDS:
+        group_boards.changed(cat)
+    if path in WINDOW_FIELDS and amount > 0:
+        window_counters.add(cat, path, amount)
+    if reason:
+        ledger.record(cat["_id"], reason, ledger_key(path), amount)
+
+
+def cat_set(cat, path, value, reason=None):
+    """Change one (dotted) field; only that path is written back."""
+    cat_cache.set(cat, path, value)
+    if path in GROUP_BOARD_FIELDS:
+        group_boards.changed(cat)
+    if reason:
+        ledger.record(cat["_id"], reason, ledger_key(path), value=value)
+
+# ================= COOLDOWNS =================
+
+class Cooldown:
+    """Fixed-length cooldowns kept only in memory.
+
+    Every key gets the same duration, so expiry order is insertion order:
+    expired keys are purged from the front of a deque in O(1) and the table
+    never holds more than ``max_entries`` keys.
+    """
+
+    def __init__(self, seconds: float, max_entries: int = 100000):
+        self.seconds = seconds
+        self.max_entries = max_entries
+        self._until = {}       # key -> expiry (monotonic)
+        self._order = deque()  # (expiry, key), oldest first
+
+    def _purge(self, now):
+        while self._order and self._order[0][0] <= now:
+            until, key = self._order.popleft()
+            if self._until.get(key) == until:
+                del self._until[key]
+
+    def hit(self, key, now: float = None) -> bool:
+        """True if ``key`` is free (and starts its cooldown), False while cooling down."""
+        now = time.monotonic() if now is None else now
+        self._purge(now)
+        if key in self._until:
+            return False
+
+        until = now + self.seconds
+        self._until[key] = until
+        self._order.append((until, key))
+        while len(self._until) > self.max_entries:
+            # closest to expiry anyway
+            old_until, old_key = self._order.popleft()
+            if self._until.get(old_key) == old_until:
+                del self._until[old_key]
+        return True
+
+    def __len__(self):
+        return len(self._until)
+
+
+async def claim_timed_reward(cat, field: str, period: timedelta, coins: int) -> bool:
+    """Pay ``coins`` and stamp ``field`` if ``period`` has passed, in one conditional update."""
+    now = datetime.utcnow()
+
+    # the cached copy mirrors every committed claim, so most repeats stop here
+    last = cat.get(field)
+    if last and (now - last) < period:
+        return False
+
+    stored = cat_field(field)
+    result = await cats.update_one(
+        {"_id": cat["_id"], "$or": [
+            {stored: None},
+            {stored: {"$lte": encode_value(field, now - period)}},
+            {stored: {"$lte": now - period}},  # not yet migrated to epoch seconds
+        ]},
+        {"$set": {stored: encode_value(field, now)}, "$inc": {cat_field("coins"): coins}},
+    )
+    if not result.modified_count:
+        return False
+
+    cat_cache.apply_committed(cat["_id"], inc={"coins": coins}, set={field: now})
+    group_boards.changed(cat)
+    ledger.record(cat["_id"], field.removeprefix("last_"), "coins", coins)
+    return True
+
+# ================= TRANSFERS =================
+
+async def transfer_coins(sender, receiver, amount: int, reason: str, partial=False, fee=0.0):
+    """Move coins between two cats atomically on the server.
+
+    Without ``partial`` it's all or nothing (/give). With ``partial`` the
+    sender pays whatever they have, up to ``amount`` (/rob). ``fee`` is a
+    cut taken from the moved coins before the receiver gets them.
+
+    Returns ``(taken, received)``; ``(0, 0)`` means nothing moved.
+    """
+    # pending cached deltas must land first, the debit checks the stored balance
+    await cat_cache.flush([sender["_id"], receiver["_id"]])
+    collection = cats.collection
+    coins = cat_field("coins")
+    # the owner's wallet never runs dry and its stored cap is never debited
+    infinite = sender["coins"] == float("inf")
+
+    def move(session):
+        if infinite:
+            taken = amount
+        elif partial:
+            before = collection.find_one_and_update(
+                {"_id": sender["_id"], coins: {"$gt": 0}},
+                [{"$set": {coins: {"$max": [0, {"$subtract": [f"${coins}", amount]}]}}}],
+                projection={coins: 1},
+                return_document=pymongo.ReturnDocument.BEFORE,
+                session=session,
+            )
+            taken = int(min(amount, before[coins])) if before else 0
+        else:
+            result = collection.update_one(
+                {"_id": sender["_id"], coins: {"$gte": amount}},
+                {"$inc": {coins: -amount}},
+                session=session,
+            )
+            taken = amount if result.modified_count else 0
+
+        received = taken - int(taken * fee)
+        if received:
+            collection.update_one(
+                {"_id": receiver["_id"]}, {"$inc": {coins: received}}, session=session
+            )
+        return taken, received
+
+    taken, received = await cats.run_atomic(move)
+    if taken:
+        cat_cache.apply_committed(sender["_id"], inc={"coins": -taken})
+        cat_cache.apply_committed(receiver["_id"], inc={"coins": received})
+        group_boards.changed(sender)
+        group_boards.changed(receiver)
+        ledger.record(sender["_id"], reason, "coins", -taken)
+        ledger.record(receiver["_id"], reason, "coins", received)
+    return taken, received
+
+# ================= LEDGER =================
+
+LEDGER_FLUSH_INTERVAL = float(os.getenv("LEDGER_FLUSH_INTERVAL", "2"))
+LEDGER_BATCH = int(os.getenv("LEDGER_BATCH", "500"))
+LEDGER_MAX_BUFFER = int(os.getenv("LEDGER_MAX_BUFFER", "50000"))
+LEDGER_RECONCILE_INTERVAL = float(os.getenv("LEDGER_RECONCILE_INTERVAL", "60"))
+
+
+def ledger_key(path):
+    """Ledger key of a cat field: ``coins``, or the item name for ``inventory.<item>``."""
+    return path.removeprefix("inventory.")
+
+
+class Ledger:
+    """Append-only log of every coin and item movement.
+
+    ``record`` only appends to a memory buffer; a background task writes it
+    with ``insert_many``, so commands never wait on the ledger. Events are
+    tiny: ``u`` user id, ``r`` reason, ``k`` "coins" or an item name, ``d``
+    the delta (or ``s`` for an absolute set) and ``t`` the time.
+
+    A second task folds settled events past a checkpoint in ``global`` into
+    ``ledger_balances`` (per cat) and ``ledger_daily`` (per day and reason),
+    one transaction per batch where the server supports it. Reports only
+    read the daily totals. Each cat's first reconcile stores its pre-ledger
+    ``opening`` balance; after that, real coins minus ledger coins minus
+    opening is ``drift``, a movement that never made it into the ledger.
+    """
+
+    CHECKPOINT = "ledger:reconcile"
+
+    def __init__(self, events, balances, daily, flush_interval: float, batch_size: int,
+                 max_buffer: int, reconcile_interval: float):
+        self.events = events
+        self.balances = balances
+        self.daily = daily
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_buffer = max_buffer
+        self.reconcile_interval = reconcile_interval
+        # an in-flight insert_many can land this late; newer events wait a round
+        self.settle = DB_TIMEOUT + 2
+        self._buffer = deque()
+        self._lock = asyncio.Lock()
+        self._wake = asyncio.Event()
+        self._last_event = {}   # user_id -> monotonic time of their latest event
+        self._unchecked = set()  # reconciled cats whose drift isn't checked yet
+        self._unsure = set()     # _ids of a failed insert that may or may not be stored
+        self._tasks = []
+        self.recorded = 0
+        self.written = 0
+        self.dropped = 0
+        self.reconciled = 0
+        self.drifted = 0
+
+    def record(self, user_id, reason: str, key: str, delta=0, value=None):
+        event = {"u": user_id, "r": reason, "k": key, "t": datetime.now(timezone.utc)}
+        if value is None:
+            event["d"] = delta
+        else:
+            event["s"] = value
+        if len(self._buffer) >= self.max_buffer:
+            # Mongo has been down for a while, keep memory bounded
+            self._buffer.popleft()
+            self.dropped += 1
+        self._buffer.append(event)
+        self._last_event[user_id] = time.monotonic()
+        self.recorded += 1
+        if len(self._buffer) >= self.batch_size:
+            self._wake.set()
+
+    async def flush(self):
+        async with self._lock:
+            while self._buffer:
+                count = min(self.batch_size, len(self._buffer))
+                batch = [self._buffer.popleft() for _ in range(count)]
+                try:
+                    if self._unsure:
+                        batch = await self._resolve(batch)
+                    if batch:
+                        await self.events.insert_many(batch, ordered=False)
+                except pymongo.errors.BulkWriteError as e:
+                    # duplicates are events a timed-out attempt already stored
+                    failed = sorted(
+                        err["index"] for err in e.details["writeErrors"] if err["code"] != 11000
+                    )
+                    retry = [batch[i] for i in failed]
+                    for event in retry:
+                        event.pop("_id", None)  # fresh id, the reconciler may be past the old one
+                    self._buffer.extendleft(reversed(retry))
+                    self.written += len(batch) - len(retry)
+                    if retry:
+                        raise
+                except Exception:
+                    # unknown outcome: the next round looks up which of these got stored
+                    self._unsure.update(event["_id"] for event in batch if "_id" in event)
+                    self._buffer.extendleft(reversed(batch))
+                    raise
+                else:
+                    self.written += len(batch)
+
+    async def _resolve(self, batch):
+        """Drop events a failed insert stored after all; the rest get fresh ids.
+
+        Retrying under the old id could land behind the reconcile checkpoint
+        and never be counted.
+        """
+        unsure = {event["_id"] for event in batch if event.get("_id") in self._unsure}
+        if not unsure:
+            return batch
+        stored = {doc["_id"] for doc in await self.events.find({"_id": {"$in": list(unsure)}}, {"_id": 1})}
+        self._unsure.difference_update(unsure)
+        self.written += len(stored)
+        batch = [event for event in batch if event.get("_id") not in stored]
+        for event in batch:
+            if event.get("_id") in unsure:
+                del event["_id"]
+        return batch
+
+    async def reconcile(self):
+        """Fold settled events into balances and daily totals, then check drift."""
+        state = await global_state.find_one({"_id": self.CHECKPOINT}) or {}
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=self.settle)
+        query = {"_id": {"$lt": ObjectId.from_datetime(cutoff)}}
+
+        async for batch in self.events.iterate_batches(
+            query, batch_size=self.batch_size, after=state.get("last_id")
+        ):
+            balance_ops, daily_ops = self._fold(batch)
+            last_id = batch[-1]["_id"]
+
+            def commit(session):
+                self.balances.collection.bulk_write(balance_ops, ordered=False, session=session)
+                self.daily.collection.bulk_write(daily_ops, ordered=False, session=session)
+                global_state.collection.update_one(
+                    {"_id": self.CHECKPOINT},
+                    {"$set": {"type": "ledger", "last_id": last_id, "updated": datetime.now(timezone.utc)}},
+                    upsert=True,
+                    session=session,
+                )
+
+            await self.events.run_atomic(commit)
+            self.reconciled += len(batch)
+            self._unchecked.update(event["u"] for event in batch)
+
+        await self._check_drift()
+
+    def _fold(self, batch):
+        balances = {}  # user_id -> {"$inc": {...}, "$set": {...}}
+        daily = {}     # "<day>:<reason>" -> {"$inc": {...}}
+        for event in batch:
+            key = event["k"]
+            field = "coins" if key == "coins" else f"items.{key}"
+            ops = balances.setdefault(event["u"], {"$inc": {}, "$set": {}})
+            totals = daily.setdefault(
+                (event["t"].strftime("%Y-%m-%d"), event["r"]), {"events": 0}
+            )
+            totals["events"] += 1
+
+            if "s" in event:
+                ops["$inc"].pop(field, None)
+                ops["$set"][field] = event["s"]
+                if key == "coins":
+                    ops["$set"]["opening"] = 0
+                continue
+
+            delta = event["d"]
+            if field in ops["$set"]:
+                ops["$set"][field] += delta
+            else:
+                ops["$inc"][field] = ops["$inc"].get(field, 0) + delta
+
+            if key == "coins":
+                side = "minted" if delta > 0 else "burned"
+                totals[side] = totals.get(side, 0) + abs(delta)
+            else:
+                totals[field] = totals.get(field, 0) + delta
+
+        balance_ops = [
+            pymongo.UpdateOne({"_id": user_id}, {k: v for k, v in ops.items() if v}, upsert=True)
+            for user_id, ops in balances.items()
+        ]
+        daily_ops = [
+            pymongo.UpdateOne(
+                {"_id": f"{day}:{reason}"},
+                {"$set": {"day": day, "reason": reason}, "$inc": totals},
+                upsert=True,
+            )
+            for (day, reason), totals in daily.items()
+        ]
+        return balance_ops, daily_ops
+
+    async def _check_drift(self):
+        # cats with recent events may have movements the ledger hasn't seen yet
+        quiet = time.monotonic() - (self.flush_interval + 2 * self.settle)
+        for user_id, seen in list(self._last_event.items()):
+            if seen < quiet:
+                del self._last_event[user_id]
+        ready = [u for u in self._unchecked if u not in self._last_event]
+        if not ready:
+            return
+
+        await cat_cache.flush(ready)
+        for start in range(0, len(ready), self.batch_size):
+            ids = ready[start:start + self.batch_size]
+            found = await cats.find({"_id": {"$in": ids}}, {cat_field("coins"): 1})
+            real = {c["_id"]: decode_cat(c).get("coins", 0) for c in found}
+            books = await self.balances.find({"_id": {"$in": ids}}, {"coins": 1, "opening": 1, "drift": 1})
+
+            ops = []
+            for book in books:
+                coins, booked = real.get(book["_id"]), book.get("coins", 0)
+                if coins is None or not math.isfinite(coins) or not math.isfinite(booked):
+                    continue  # owner's infinite wallet can't drift
+                if "opening" not in book:
+                    ops.append(pymongo.UpdateOne(
+                        {"_id": book["_id"]}, {"$set": {"opening": coins - booked, "drift": 0}}
+                    ))
+                    continue
+                drift = coins - booked - book["opening"]
+                if drift != book.get("drift", 0):
+                    ops.append(pymongo.UpdateOne({"_id": book["_id"]}, {"$set": {"drift": drift}}))
+                    if drift:
+                        self.drifted += 1
+                        logger.warning("ledger drift for cat %s: %+d coins", book["_id"], drift)
+
+            if ops:
+                await self.balances.bulk_write(ops, ordered=False)
+            self._unchecked.difference_update(ids)
+
+    async def _run_flush(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("ledger flush failed")
+
+    async def _run_reconcile(self):
+        while True:
+            await asyncio.sleep(self.reconcile_interval)
+            try:
+                await self.reconcile()
+            except Exception:
+                logger.exception("ledger reconcile failed")
+
+    def start(self):
+        if not self._tasks:
+            self._tasks = [
+                asyncio.create_task(self._run_flush()),
+                asyncio.create_task(self._run_reconcile()),
+            ]
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        await self.flush()
+
+    def stats(self):
+        return {
+            "buffered": len(self._buffer),
+            "recorded": self.recorded,
+            "written": self.written,
+            "dropped": self.dropped,
+            "reconciled": self.reconciled,
+            "drifted": self.drifted,
+        }
+
+
+ledger = Ledger(
+    economy_ledger, ledger_balances, ledger_daily,
+    LEDGER_FLUSH_INTERVAL, LEDGER_BATCH, LEDGER_MAX_BUFFER, LEDGER_RECONCILE_INTERVAL,
+)
 
 def evolve(cat):
-    current_xp = cat.get("xp", 0)
-    old_level = cat.get("level", "🐱 Kitten")
+    current_xp = cat.xp
+    old_level = cat.level
 
     new_level = old_level
     for name, xp_required in reversed(LEVELS):
@@ -115,40 +1918,395 @@ def evolve(cat):
             new_level = name
             break
 
-    cat["level"] = new_level
+    if new_level != old_level:
+        cat_set(cat, "level", new_level)
     return old_level != new_level  # Returns True if leveled up
 
-def is_protected(cat):
-    protected_until = cat.get("protected_until")
-    if not protected_until:
-        return False
+# ================= STATUS =================
+# health, jail and protection are stored as "value as of a timestamp" and
+# worked out when a cat is read, so no job ever has to sweep the cats
 
-    # 🛠 Convert naive datetime → UTC aware
-    if protected_until.tzinfo is None:
-        protected_until = protected_until.replace(tzinfo=timezone.utc)
+HEALTH_MAX = 100
+HEALTH_REGEN_PER_HOUR = float(os.getenv("HEALTH_REGEN_PER_HOUR", "25"))  # dead → full in 4h
+KILL_MIN_HEALTH = int(os.getenv("KILL_MIN_HEALTH", str(HEALTH_MAX)))  # can't be attacked again below this
+SHIELD_DURATION = timedelta(days=1)
+JAIL_DURATION = timedelta(minutes=30)
 
-    return protected_until > datetime.now(timezone.utc)
-    
-def calculate_global_rank(user_id):
-    all_cats = list(cats.find().sort("coins", -1))
-    for idx, c in enumerate(all_cats, 1):
-        if c["_id"] == user_id:
-            return idx
-    return 0
-    
-# 👑 OWNER GOD MODE
-    if is_owner_user(user.id):
-        cat["coins"] = float("inf")
-        cat["xp"] = float("inf")
-        cat["level"] = "👑 Legend Cat"
-        cat["dna"] = {
-            "aggression": 100,
-            "intelligence": 100,
-            "luck": 100,
-            "charm": 100,
+
+def _until(cat, field):
+    stamp = cat.get(field)
+    if stamp and stamp.tzinfo is None:  # 🛠 naive → UTC aware
+        stamp = stamp.replace(tzinfo=timezone.utc)
+    return stamp
+
+
+def time_left(cat, field, now=None):
+    """Remaining time on an expiry field, or ``None`` once it has passed."""
+    until = _until(cat, field)
+    now = now or datetime.now(timezone.utc)
+    return until - now if until and until > now else None
+
+
+def format_left(delta):
+    minutes = max(1, int(delta.total_seconds()) // 60)
+    days, minutes = divmod(minutes, 1440)
+    hours, minutes = divmod(minutes, 60)
+    parts = [f"{n}{unit}" for n, unit in ((days, "d"), (hours, "h"), (minutes, "m")) if n]
+    return " ".join(parts)
+
+
+def current_health(cat, now=None):
+    """``health`` was true at ``health_at``; it regrows linearly from there."""
+    health = cat.get("health", HEALTH_MAX)
+    if health >= HEALTH_MAX:
+        return HEALTH_MAX
+    since = _until(cat, "health_at")
+    if since is None:  # hurt before regen existed: long healed
+        return HEALTH_MAX
+    hours = ((now or datetime.now(timezone.utc)) - since).total_seconds() / 3600
+    return min(HEALTH_MAX, int(health + max(0.0, hours) * HEALTH_REGEN_PER_HOUR))
+
+
+def recovery_left(cat, now=None):
+    """Time until a cat can be attacked again, or ``None`` if it already can."""
+    missing = KILL_MIN_HEALTH - current_health(cat, now)
+    if missing <= 0:
+        return None
+    return timedelta(hours=missing / HEALTH_REGEN_PER_HOUR)
+
+
+def set_health(cat, health, now=None):
+    cat_set(cat, "health", max(0, min(HEALTH_MAX, health)))
+    cat_set(cat, "health_at", now or datetime.now(timezone.utc))
+
+
+def is_protected(cat, now=None):
+    return time_left(cat, "protected_until", now) is not None
+
+
+def is_jailed(cat, now=None):
+    return time_left(cat, "jail_until", now) is not None
+
+
+def protect_for(cat, duration, now=None):
+    """Start protection, or stack it on top of what's left."""
+    now = now or datetime.now(timezone.utc)
+    cat_set(cat, "protected_until", now + (time_left(cat, "protected_until", now) or timedelta()) + duration)
+
+
+def check_protection(attacker, victim, reason, now=None):
+    """Shared by rob, kill and /use shield. Returns "open", "broken" or "blocked".
+
+    A shield still in the victim's inventory switches itself on when it
+    blocks an attack; an attacker's Shield Breaker ends active protection
+    and gets past an inventory shield without using it up. Items are only
+    spent once the outcome is decided.
+    """
+    now = now or datetime.now(timezone.utc)
+    active = is_protected(victim, now)
+    if not active and victim.inventory["shield"] <= 0:
+        return "open"
+
+    if attacker.inventory["shield_breaker"] > 0:
+        cat_inc(attacker, "inventory.shield_breaker", -1, reason=reason)
+        if active:
+            cat_set(victim, "protected_until", None)
+        return "broken"
+
+    if not active:
+        cat_inc(victim, "inventory.shield", -1, reason=reason)
+        protect_for(victim, SHIELD_DURATION, now)
+    return "blocked"
+
+
+async def count_protected():
+    """Cats protected right now (indexed range count on ``protected_until``)."""
+    now = encode_value("protected_until", datetime.now(timezone.utc))
+    return await cats.count_documents({cat_field("protected_until"): {"$gt": now}})
+
+# ================= RANK SERVICE =================
+
+# board name -> cat field it ranks by
+RANK_FIELDS = {
+    "coins": "coins",
+    "kills": "kills",
+    "fish": "fish_total_earned",
+}
+
+
+async def get_global_rank(cat, board: str = "coins") -> int:
+    """1-based rank of ``cat`` on a board, counting only cats strictly ahead.
+
+    Uses the cat's cached value and an indexed range count, so the cost does
+    not grow with the size of the collection the way a full sort would.
+    """
+    field = RANK_FIELDS[board]
+    ahead = await cats.count_documents({
+        "_id": {"$ne": cat["_id"]},
+        cat_field(field): {"$gt": encode_value(field, cat.get(field, 0))},
+    })
+    return ahead + 1
+
+
+def keyset(score_key: str, tie_key: str, score, tie, forward: bool = True) -> dict:
+    """Rows past ``(score, tie)`` in board order (both descending), or before it going back."""
+    op = "$lt" if forward else "$gt"
+    return {"$or": [{score_key: {op: score}}, {score_key: score, tie_key: {op: tie}}]}
+
+
+async def get_board_position(collection, query: dict, score_key: str, tie_key: str, score, tie) -> int:
+    """0-based position of ``(score, tie)`` on a board, ties broken the way pages are.
+
+    Same indexed range count as ``get_global_rank``, so deep positions cost
+    no more than the top ones.
+    """
+    return await collection.count_documents({"$and": [query, keyset(score_key, tie_key, score, tie, forward=False)]})
+
+# ================= GROUP BOARDS =================
+
+# cat field -> score key in group_members
+GROUP_BOARD_FIELDS = {
+    "coins": "c",
+    "kills": "k",
+    "fish_total_earned": "f",
+}
+GROUP_FLUSH_INTERVAL = float(os.getenv("GROUP_FLUSH_INTERVAL", "5"))
+GROUP_SEEN_REFRESH = float(os.getenv("GROUP_SEEN_REFRESH", "3600"))  # rewrite "last seen" at most hourly
+GROUP_SEEN_MEMORY = int(os.getenv("GROUP_SEEN_MEMORY", "200000"))    # (group, cat) pairs remembered
+
+
+def group_member_key(chat_id: int, user_id: int) -> str:
+    return f"{chat_id}:{user_id}"
+
+
+class GroupBoards:
+    """Per-group leaderboards, kept up to date as cats chat and earn.
+
+    ``group_members`` has one small record per cat active in a group: ``g``
+    chat id, ``u`` user id, ``n`` name, ``t`` last seen (epoch) and the cat's
+    board scores copied in (``c`` coins, ``k`` kills, ``f`` fish earnings).
+    A group's top 10 is then an indexed ``(g, score)`` read that never
+    touches ``cats``.
+
+    ``seen`` and ``changed`` only take notes in memory. ``flush`` upserts new
+    (or long unseen) memberships and sends each changed cat's scores to all
+    its groups with one ``update_many``, so chat traffic adds no writes.
+    """
+
+    def __init__(self, collection, flush_interval: float, seen_refresh: float, max_seen: int):
+        self.collection = collection
+        self.flush_interval = flush_interval
+        self.seen_refresh = seen_refresh
+        self.max_seen = max_seen
+        self._seen = OrderedDict()  # (chat_id, user_id) -> epoch it was last written
+        self._joins = {}            # (chat_id, user_id) -> cat to upsert
+        self._changed = {}          # user_id -> cat whose scores moved
+        self._task = None
+        self.writes = 0
+
+    def seen(self, chat_id: int, cat):
+        key = (chat_id, cat["_id"])
+        written = self._seen.get(key)
+        if written is None or time.time() - written >= self.seen_refresh:
+            self._joins[key] = cat
+
+    def changed(self, cat):
+        self._changed[cat["_id"]] = cat
+
+    def _scores(self, cat):
+        cat = cat_cache.peek(cat["_id"]) or cat  # newest copy, e.g. after a transfer
+        return {short: encode_value(field, cat.get(field, 0)) for field, short in GROUP_BOARD_FIELDS.items()}
+
+    async def flush(self):
+        joins, self._joins = self._joins, {}
+        changed, self._changed = self._changed, {}
+        now = int(time.time())
+
+        requests = [
+            pymongo.UpdateOne(
+                {"_id": group_member_key(chat_id, user_id)},
+                {"$set": {"g": chat_id, "u": user_id, "n": cat.get("name", "Cat"), "t": now, **self._scores(cat)}},
+                upsert=True,
+            )
+            for (chat_id, user_id), cat in joins.items()
+        ]
+        requests += [pymongo.UpdateMany({"u": user_id}, {"$set": self._scores(cat)}) for user_id, cat in changed.items()]
+        if not requests:
+            return 0
+
+        try:
+            await self.collection.bulk_write(requests, ordered=False)
+        except Exception:
+            # keep the notes for the next round; scores are read fresh then anyway
+            for key, cat in joins.items():
+                self._joins.setdefault(key, cat)
+            for user_id, cat in changed.items():
+                self._changed.setdefault(user_id, cat)
+            raise
+
+        for key in joins:
+            self._seen[key] = now
+            self._seen.move_to_end(key)
+        while len(self._seen) > self.max_seen:
+            self._seen.popitem(last=False)
+        self.writes += len(requests)
+        return len(requests)
+
+    async def top(self, chat_id: int, field: str, limit: int = 10):
+        """Best ``limit`` members of a group on one board, as ``_id``/``name``/``field`` dicts."""
+        short = GROUP_BOARD_FIELDS[field]
+        rows = await self.collection.find(
+            {"g": chat_id}, projection={"_id": 0, "u": 1, "n": 1, short: 1}, sort=[(short, -1)], limit=limit
+        )
+        return [{"_id": r["u"], "name": r.get("n", "Cat"), field: decode_value(field, r.get(short, 0))} for r in rows]
+
+    async def remove_group(self, chat_id: int):
+        """Bot left the group: drop its members."""
+        for key in [key for key in self._seen if key[0] == chat_id]:
+            del self._seen[key]
+        self._joins = {key: cat for key, cat in self._joins.items() if key[0] != chat_id}
+        await self.collection.delete_many({"g": chat_id})
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("group board flush failed")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+    def stats(self):
+        return {
+            "pending": len(self._joins) + len(self._changed),
+            "remembered": len(self._seen),
+            "writes": self.writes,
         }
-    return cat
-    
+
+
+group_boards = GroupBoards(group_members, GROUP_FLUSH_INTERVAL, GROUP_SEEN_REFRESH, GROUP_SEEN_MEMORY)
+
+# ================= WINDOWED BOARDS =================
+
+# cat field -> counter key in window_scores
+WINDOW_FIELDS = {
+    "kills": "k",
+    "fish_total_earned": "f",
+}
+WINDOW_FLUSH_INTERVAL = float(os.getenv("WINDOW_FLUSH_INTERVAL", "5"))
+WINDOW_GRACE = timedelta(days=1)  # a finished window lingers this long before TTL removes it
+
+
+def window_bounds(kind: str, now: datetime = None):
+    """``(id, end)`` of the UTC day or ISO week containing ``now``."""
+    now = now or datetime.now(timezone.utc)
+    day = datetime(now.year, now.month, now.day, tzinfo=timezone.utc)
+    if kind == "day":
+        return f"d{day:%Y%m%d}", day + timedelta(days=1)
+    year, week, weekday = now.isocalendar()
+    return f"w{year}{week:02d}", day + timedelta(days=8 - weekday)
+
+
+class WindowCounters:
+    """Per-cat counters for the current day and week.
+
+    ``window_scores`` holds one record per (window, cat): ``w`` window id
+    (``d20261018``, ``w202642``), ``u`` user id, ``n`` name, the counters
+    (``k`` kills, ``f`` fish earnings) and ``x``, the time a TTL index
+    deletes it. A new window simply starts new records, so rollover never
+    rewrites anything, and a board is one indexed ``(w, counter)`` read.
+
+    ``add`` only sums into memory; ``flush`` sends one upserting ``$inc``
+    per (window, cat).
+    """
+
+    KINDS = ("day", "week")
+
+    def __init__(self, collection, flush_interval: float):
+        self.collection = collection
+        self.flush_interval = flush_interval
+        self._pending = {}  # (window id, user_id) -> [name, expires, {counter: amount}]
+        self._task = None
+        self.writes = 0
+
+    def add(self, cat, field: str, amount):
+        counter = WINDOW_FIELDS[field]
+        for kind in self.KINDS:
+            window, end = window_bounds(kind)
+            entry = self._pending.setdefault((window, cat["_id"]), [None, end + WINDOW_GRACE, {}])
+            entry[0] = cat.get("name", "Cat")
+            entry[2][counter] = entry[2].get(counter, 0) + amount
+
+    async def flush(self):
+        pending, self._pending = self._pending, {}
+        requests = [
+            pymongo.UpdateOne(
+                {"_id": f"{window}:{user_id}"},
+                {"$inc": counters, "$set": {"w": window, "u": user_id, "n": name, "x": expires}},
+                upsert=True,
+            )
+            for (window, user_id), (name, expires, counters) in pending.items()
+        ]
+        if not requests:
+            return 0
+
+        try:
+            await self.collection.bulk_write(requests, ordered=False)
+        except Exception:
+            # merge back so the next flush retries the sums
+            for key, (name, expires, counters) in pending.items():
+                entry = self._pending.setdefault(key, [name, expires, {}])
+                for counter, amount in counters.items():
+                    entry[2][counter] = entry[2].get(counter, 0) + amount
+            raise
+
+        self.writes += len(requests)
+        return len(requests)
+
+    async def top(self, kind: str, field: str, limit: int = 10, exclude: int = None):
+        """Best ``limit`` cats of the current window, as ``_id``/``name``/``field`` dicts."""
+        counter = WINDOW_FIELDS[field]
+        query = {"w": window_bounds(kind)[0], counter: {"$gt": 0}}
+        if exclude is not None:
+            query["u"] = {"$ne": exclude}
+        rows = await self.collection.find(
+            query, projection={"_id": 0, "u": 1, "n": 1, counter: 1}, sort=[(counter, -1)], limit=limit
+        )
+        return [{"_id": r["u"], "name": r.get("n", "Cat"), field: r[counter]} for r in rows]
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("window counter flush failed")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+    def stats(self):
+        return {"pending": len(self._pending), "writes": self.writes}
+
+
+window_counters = WindowCounters(window_scores, WINDOW_FLUSH_INTERVAL)
+
 # ================= GAME GUIDE =================
 
 async def games(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -179,84 +2337,94 @@ async def games(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         "📊 Profile & Stats:\n"
         "  /meow — Profile\n"
-        "  /toprich — Richest cats\n"
-        "  /topkill — Top fighters\n"
+        "  /toprich — Richest cats (this group in groups, add 'global' for everyone)\n"
+        "  /topkill [today|week] — Top fighters\n"
+        "  /fishlb [today|week] — Top fishers\n"
         "  /xp — Check XP & DNA stats\n"
         "  Levels: 🐱 Kitten → 😺 Teen → 😼 Rogue → 🐯 Alpha → 👑 Legend\n"
         f"📈 Levels:\n{level_text}"
     )
-    await update.message.reply_text(text)
+    await reply(update.message, text)
 
 # ---- Passive XP + Activity XP System ----
-async def on_chat(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not update.message or not update.message.text:
-        return
+# These are stages of the text pipeline (see MESSAGE PIPELINE below). Each
+# one gets the shared TextMessage and returns True to stop the pipeline.
 
-    cat = get_cat(update.effective_user)
-    now = time.time()
+CHAT_XP_COOLDOWN = 4  # seconds
+chat_cooldown = Cooldown(CHAT_XP_COOLDOWN)
 
-    # Anti-spam cooldown (4 sec)
-    if now - cat.get("last_msg", 0) < 4:
-        return
+async def xp_cooldown_stage(msg) -> bool:
+    # Anti-spam cooldown (4 sec), memory only: nothing is written per message
+    msg.earns_xp = chat_cooldown.hit(msg.user.id)
+    return False
 
-    cat["last_msg"] = now
+
+async def xp_dna_stage(msg) -> bool:
+    if not msg.earns_xp:
+        return False
+    cat = msg.cat
 
     # Base chat XP
     xp_gain = random.randint(2, 5)
 
     # Longer messages = little more XP
-    msg_len = len(update.message.text)
+    msg_len = len(msg.text)
     if msg_len > 80:
         xp_gain += 2
     elif msg_len > 40:
         xp_gain += 1
 
-    cat["xp"] += xp_gain
+    cat_inc(cat, "xp", xp_gain)
 
     # Random DNA stat improvement (UNCHANGED)
-    stat = random.choice(list(cat["dna"]))
-    cat["dna"][stat] += random.randint(1, 2)
+    stat = random.choice(Dna.FIELDS)
+    cat_inc(cat, f"dna.{stat}", random.randint(1, 2))
+    return False
+
+
+async def level_stage(msg) -> bool:
+    # 🔼 LEVEL CHECK (XP BASED NOW)
+    if not msg.earns_xp or not evolve(msg.cat):
+        return False
+
+    level_msg = (
+        f"🎉 {msg.user.first_name}'s cat leveled up!\n"
+        f"🏆 New Rank: {msg.cat.level}"
+    )
 
-    # 🔼 LEVEL CHECK (XP BASED NOW)
-    leveled_up = evolve(cat)
+    # Group notification
+    await reply(msg.message, level_msg)
 
-    if leveled_up:
-        level_msg = (
-            f"🎉 {update.effective_user.first_name}'s cat leveled up!\n"
-            f"🏆 New Rank: {cat['level']}"
+    # DM notification
+    try:
+        await send(
+            msg.context.bot,
+            chat_id=msg.user.id,
+            text=f"📩 LEVEL UP!\nYour cat is now {msg.cat.level} 🎉",
+            droppable=True
         )
+    except:
+        pass
+    return False
 
-        # Group notification
-        await update.message.reply_text(level_msg)
-
-        # DM notification
-        try:
-            await context.bot.send_message(
-                chat_id=update.effective_user.id,
-                text=f"📩 LEVEL UP!\nYour cat is now {cat['level']} 🎉"
-            )
-        except:
-            pass
 
+async def bonus_stage(msg) -> bool:
     # 🎁 Small random bonus event (2%)
-    if random.random() < 0.02:
+    if msg.earns_xp and random.random() < 0.02:
         bonus = random.randint(10, 25)
-        cat["coins"] += bonus
-        await update.message.reply_text(f"💰 You found {bonus} bonus coins while chatting!")
-
-    cats.update_one({"_id": cat["_id"]}, {"$set": cat})
+        cat_inc(msg.cat, "coins", bonus, reason="chat_bonus")
+        await reply(msg.message, f"💰 You found {bonus} bonus coins while chatting!")
+    return False
     
 async def fish(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
-    cat = get_cat(user)
-    inventory = cat.get("inventory", {})
+    cat = await get_cat(user)
     now = datetime.now(timezone.utc)
 
     today = now.date().isoformat()
-    last_date = cat.get("last_fish_date")
-    streak = cat.get("fish_streak", 0)
+    streak = cat.fish_streak
 
-    if last_date == today:
+    if cat.last_fish_date == today:
         streak += 1
     else:
         streak = 1
@@ -265,9 +2433,9 @@ async def fish(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     bait_bonus = 0
     bait_msg = ""
-    if inventory.get("fish_bait", 0) > 0:
+    if cat.inventory["fish_bait"] > 0:
         bait_bonus = random.randint(50, 150)
-        inventory["fish_bait"] -= 1
+        cat_inc(cat, "inventory.fish_bait", -1, reason="fish")
         bait_msg = "🐟 Magic bait boosted your luck!\n"
 
     roll = random.randint(1, 100)
@@ -324,7 +2492,7 @@ async def fish(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # 🔴 LOSS
     else:
         loss = random.randint(1000, 2000)
-        current = cat.get("coins", 0)
+        current = cat.coins
 
         if current < loss:
             loss = max(50, int(current * 0.5))
@@ -332,35 +2500,43 @@ async def fish(update: Update, context: ContextTypes.DEFAULT_TYPE):
         coins_change = -loss
         msg = f"{random.choice(loss_msgs)}\n💸 Lost 🪙 {loss}"
 
-    new_balance = max(0, cat.get("coins", 0) + coins_change)
-
-    update_data = {
-        "coins": new_balance,
-        "fish_streak": streak,
-        "last_fish_date": today,
-        "inventory": inventory,
-    }
+    # never below zero; from the change itself so the owner's inf balance can't turn into inf - inf
+    cat_inc(cat, "coins", max(-cat.coins, coins_change), reason="fish")
+    cat_set(cat, "fish_streak", streak)
+    cat_set(cat, "last_fish_date", today)
 
     if coins_change > 0:
-        update_data["fish_total_earned"] = cat.get("fish_total_earned", 0) + coins_change
+        cat_inc(cat, "fish_total_earned", coins_change)
 
-    cats.update_one({"_id": user.id}, {"$set": update_data})
-
-    await update.message.reply_text(msg)
+    await reply(update.message, msg)
 
 # ---------------- LEADERBOARD ----------------
 async def fishlb(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    top_users = cats.find().sort("fish_total_earned", -1).limit(5)
+    kind = board_window(context)
+    if kind:
+        return await send_window_board(update, "fish", kind)
+
+    chat_id = board_scope(update, context)
+    if chat_id is None:
+        top_users = await cats.find(
+            projection=cat_projection(CAT_READS["fishlb"]),
+            sort=[(cat_field("fish_total_earned"), -1)],
+            limit=5,
+        )
+        top_users = [decode_cat(u) for u in top_users]
+    else:
+        await group_boards.flush()
+        top_users = await group_boards.top(chat_id, "fish_total_earned", limit=5)
 
     text = "🏆 Top Fishing Legends 🏆\n\n"
     for i, u in enumerate(top_users, start=1):
         text += f"{i}. {u.get('name','Cat')} — 🪙 {u.get('fish_total_earned',0)}\n"
 
-    await update.message.reply_text(text)
+    await reply(update.message, text)
     
 # ---- /xp command ----
 async def xp(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    cat = get_cat(update.effective_user)
+    cat = await get_cat(update.effective_user, CAT_READS["xp"])
 
     # 👑 OWNER GOD MODE XP
     if is_owner_user(update.effective_user.id):
@@ -375,7 +2551,7 @@ async def xp(update: Update, context: ContextTypes.DEFAULT_TYPE):
             f"▫️ Charm: 100\n"
             f"🐟 Fish: ∞"
         )
-        await update.message.reply_text(text, parse_mode=ParseMode.MARKDOWN)
+        await reply(update.message, text, parse_mode=ParseMode.MARKDOWN)
         return
 
     # 👤 NORMAL USER
@@ -391,27 +2567,21 @@ async def xp(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"▫️ Charm: {stats['charm']}\n"
         f"🐟 Fish: {cat['fish']}"
     )
-    await update.message.reply_text(text, parse_mode=ParseMode.MARKDOWN)
+    await reply(update.message, text, parse_mode=ParseMode.MARKDOWN)
 
 # ================= ECONOMY =================
 
 async def daily(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # ✅ Only in DM
     if update.effective_chat.type != "private":
-        return await update.message.reply_text("⚠️ Daily reward DM only.")
-
-    cat = get_cat(update.effective_user)
-    now = datetime.utcnow()  # ✅ FIXED
+        return await reply(update.message, "⚠️ Daily reward DM only.")
 
-    last = cat.get("last_daily")
-    if last and (now - last) < timedelta(hours=24):
-        return await update.message.reply_text("⏳ Already claimed today!")
+    cat = await get_cat(update.effective_user)
 
-    cat["coins"] += 400
-    cat["last_daily"] = now
-    cats.update_one({"_id": cat["_id"]}, {"$set": cat})
+    if not await claim_timed_reward(cat, "last_daily", timedelta(hours=24), 400):
+        return await reply(update.message, "⏳ Already claimed today!")
 
-    await update.message.reply_text("🎁 You got $400!")
+    await reply(update.message, "🎁 You got $400!")
 
 
 # 🆕 GROUP CLAIM REWARD (1000+ MEMBERS ONLY)
@@ -420,44 +2590,38 @@ async def claim(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # ❌ Not allowed in private chat
     if chat.type == "private":
-        return await update.message.reply_text("❌ Use /daily in DM for personal reward.")
+        return await reply(update.message, "❌ Use /daily in DM for personal reward.")
 
     # 👥 Check group size
     try:
         members = await context.bot.get_chat_member_count(chat.id)
     except:
-        return await update.message.reply_text("⚠️ Unable to verify group size.")
+        return await reply(update.message, "⚠️ Unable to verify group size.")
 
     if members < 1000:
-        return await update.message.reply_text("🚫 This command works only in groups with 1000+ members.")
-
-    cat = get_cat(update.effective_user)
-    now = datetime.utcnow()  # ✅ FIXED
-
-    last = cat.get("last_claim")
-    if last and (now - last) < timedelta(hours=24):
-        return await update.message.reply_text("⏳ You already claimed a group reward today!")
+        return await reply(update.message, "🚫 This command works only in groups with 1000+ members.")
 
+    cat = await get_cat(update.effective_user)
     reward = 250  # Group reward amount
 
-    cat["coins"] += reward
-    cat["last_claim"] = now
-    cats.update_one({"_id": cat["_id"]}, {"$set": cat})
+    if not await claim_timed_reward(cat, "last_claim", timedelta(hours=24), reward):
+        return await reply(update.message, "⏳ You already claimed a group reward today!")
 
-    await update.message.reply_text(f"🏆 Group reward claimed! You received ${reward}")
+    await reply(update.message, f"🏆 Group reward claimed! You received ${reward}")
 
 
 # 💰 CHECK BALANCE
 async def bal(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    cat = get_cat(update.effective_user)
-    await update.message.reply_text(f"💰 Balance: ${cat['coins']}")
+    cat = await get_cat(update.effective_user, CAT_READS["bal"])
+    await reply(update.message, f"💰 Balance: ${cat['coins']}")
 
 
 # 💸 GIVE MONEY (with OWNER protection)
 async def give(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # ❌ OWNER PROTECTION: Agar reply kiya gaya user OWNER hai
     if update.message.reply_to_message and is_owner_user(update.message.reply_to_message.from_user.id):
-        await update.message.reply_text(
+        await reply(
+            update.message,
             "👑 Hold on! This cat is the OWNER of the bot 😼\n"
             "💰 You can't give or take money from them.",
             parse_mode=ParseMode.MARKDOWN
@@ -465,31 +2629,26 @@ async def give(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     if not update.message.reply_to_message or not context.args:
-        return await update.message.reply_text("❗ Reply with /give <amount>")
+        return await reply(update.message, "❗ Reply with /give <amount>")
 
-    sender = get_cat(update.effective_user)
-    receiver = get_cat(update.message.reply_to_message.from_user)
+    sender = await get_cat(update.effective_user)
+    receiver = await get_cat(update.message.reply_to_message.from_user)
 
     try:
         amount = int(context.args[0])
         if amount <= 0:
-            return await update.message.reply_text("Enter a valid amount.")
+            return await reply(update.message, "Enter a valid amount.")
     except:
-        return await update.message.reply_text("Enter a valid number.")
+        return await reply(update.message, "Enter a valid number.")
 
     if sender["coins"] < amount:
-        return await update.message.reply_text("Not enough money.")
+        return await reply(update.message, "Not enough money.")
 
-    tax = int(amount * 0.05)
-    final = amount - tax
+    taken, final = await transfer_coins(sender, receiver, amount, "give", fee=0.05)
+    if not taken:
+        return await reply(update.message, "Not enough money.")
 
-    sender["coins"] -= amount
-    receiver["coins"] += final
-
-    cats.update_one({"_id": sender["_id"]}, {"$set": sender})
-    cats.update_one({"_id": receiver["_id"]}, {"$set": receiver})
-
-    await update.message.reply_text(f"🐾 Sent ${final} after tax!")
+    await reply(update.message, f"🐾 Sent ${final} after tax!")
     
 # ================== SHOP DATA ==================
 GIFT_ITEMS = {
@@ -526,7 +2685,8 @@ async def shop(update: Update, context: ContextTypes.DEFAULT_TYPE):
         [InlineKeyboardButton("🎁 Gift Shop", callback_data="giftshop:open")]
     ]
 
-    await update.message.reply_text(
+    await reply(
+        update.message,
         "🛒 *Catverse Black Market*",
         parse_mode="Markdown",
         reply_markup=InlineKeyboardMarkup(keyboard)
@@ -540,10 +2700,10 @@ async def shop_system(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not is_owner(query, context):
         return await query.answer("🚫 This shop isn't yours!", show_alert=True)
 
-    cat = get_cat(query.from_user)
+    cat = await get_cat(query.from_user)
 
-    if "inventory" not in cat or not isinstance(cat["inventory"], dict):
-        cat["inventory"] = {}
+    if "inventory" not in cat:
+        cat_set(cat, "inventory", {})
 
     data = query.data
 
@@ -553,23 +2713,23 @@ async def shop_system(update: Update, context: ContextTypes.DEFAULT_TYPE):
             [InlineKeyboardButton("🧪 Items Shop", callback_data="shop:items")],
             [InlineKeyboardButton("🎁 Gift Shop", callback_data="giftshop:open")]
         ]
-        await query.edit_message_text("🛒 *Catverse Black Market*", parse_mode="Markdown",
-                                      reply_markup=InlineKeyboardMarkup(keyboard))
+        await edit(query.message, "🛒 *Catverse Black Market*", parse_mode="Markdown",
+                   reply_markup=InlineKeyboardMarkup(keyboard))
 
     # ===== OPEN ITEMS SHOP =====
     elif data == "shop:items":
         keyboard = [[InlineKeyboardButton(i.replace('_',' ').title(), callback_data=f"shop:view:{i}")] for i in SHOP_ITEMS]
         keyboard.append([InlineKeyboardButton("⬅ Back", callback_data="shop:main")])
-        await query.edit_message_text("🧪 *Black Market Items*", parse_mode="Markdown",
-                                      reply_markup=InlineKeyboardMarkup(keyboard))
+        await edit(query.message, "🧪 *Black Market Items*", parse_mode="Markdown",
+                   reply_markup=InlineKeyboardMarkup(keyboard))
 
     # ===== OPEN GIFT SHOP =====
     elif data == "giftshop:open":
         keyboard = [[InlineKeyboardButton(f"{v['emoji']} {k.title()} - ${v['price']}",
                                           callback_data=f"giftshop:view:{k}")] for k, v in GIFT_ITEMS.items()]
         keyboard.append([InlineKeyboardButton("⬅ Back", callback_data="shop:main")])
-        await query.edit_message_text("🎁 *Gift Shop*", parse_mode="Markdown",
-                                      reply_markup=InlineKeyboardMarkup(keyboard))
+        await edit(query.message, "🎁 *Gift Shop*", parse_mode="Markdown",
+                   reply_markup=InlineKeyboardMarkup(keyboard))
 
     # ===== VIEW NORMAL ITEM =====
     elif data.startswith("shop:view:"):
@@ -582,7 +2742,7 @@ async def shop_system(update: Update, context: ContextTypes.DEFAULT_TYPE):
             [InlineKeyboardButton("🛒 Purchase", callback_data=f"shop:buy:{item}")],
             [InlineKeyboardButton("⬅ Back", callback_data="shop:items")]
         ]
-        await query.edit_message_text(text, parse_mode="Markdown", reply_markup=InlineKeyboardMarkup(keyboard))
+        await edit(query.message, text, parse_mode="Markdown", reply_markup=InlineKeyboardMarkup(keyboard))
 
     # ===== BUY NORMAL ITEM =====
     elif data.startswith("shop:buy:"):
@@ -592,11 +2752,11 @@ async def shop_system(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if cat["coins"] < price:
             return await query.answer("💸 You don't have enough coins!", show_alert=True)
 
-        cat["coins"] -= price
-        cat["inventory"][item] = cat["inventory"].get(item, 0) + 1
-        cats.update_one({"_id": cat["_id"]}, {"$set": {"coins": cat["coins"], "inventory": cat["inventory"]}})
+        cat_inc(cat, "coins", -price, reason="shop")
+        cat_inc(cat, f"inventory.{item}", 1, reason="shop")
 
-        await query.edit_message_text(
+        await edit(
+            query.message,
             f"✅ Purchased *{item.replace('_',' ').title()}*\n💰 Balance: ${cat['coins']}",
             parse_mode="Markdown",
             reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("⬅ Back", callback_data="shop:items")]])
@@ -613,7 +2773,7 @@ async def shop_system(update: Update, context: ContextTypes.DEFAULT_TYPE):
             [InlineKeyboardButton("🛒 Buy Gift", callback_data=f"giftshop:buy:{item}")],
             [InlineKeyboardButton("⬅ Back", callback_data="giftshop:open")]
         ]
-        await query.edit_message_text(text, parse_mode="Markdown", reply_markup=InlineKeyboardMarkup(keyboard))
+        await edit(query.message, text, parse_mode="Markdown", reply_markup=InlineKeyboardMarkup(keyboard))
 
     # ===== BUY GIFT =====
     elif data.startswith("giftshop:buy:"):
@@ -623,11 +2783,11 @@ async def shop_system(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if cat["coins"] < price:
             return await query.answer("💸 You don't have enough coins!", show_alert=True)
 
-        cat["coins"] -= price
-        cat["inventory"][item] = cat["inventory"].get(item, 0) + 1
-        cats.update_one({"_id": cat["_id"]}, {"$set": {"coins": cat["coins"], "inventory": cat["inventory"]}})
+        cat_inc(cat, "coins", -price, reason="shop")
+        cat_inc(cat, f"inventory.{item}", 1, reason="shop")
 
-        await query.edit_message_text(
+        await edit(
+            query.message,
             f"🎁 Gift Purchased: {GIFT_ITEMS[item]['emoji']} *{item.title()}*\n💰 Balance: ${cat['coins']}",
             parse_mode="Markdown",
             reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("⬅ Back", callback_data="giftshop:open")]])
@@ -635,49 +2795,42 @@ async def shop_system(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 # ----------------- /gift COMMAND -----------------
 async def gift(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    sender = get_cat(update.effective_user)
+    sender = await get_cat(update.effective_user)
 
     if not update.message.reply_to_message:
-        return await update.message.reply_text("Reply to someone to gift 🎁")
+        return await reply(update.message, "Reply to someone to gift 🎁")
 
     if not context.args:
-        return await update.message.reply_text("Usage: /gift <item>")
+        return await reply(update.message, "Usage: /gift <item>")
 
     item = context.args[0].lower()
     if item not in GIFT_ITEMS:
-        return await update.message.reply_text("Invalid gift item.")
+        return await reply(update.message, "Invalid gift item.")
 
     if sender.get("inventory", {}).get(item, 0) <= 0:
-        return await update.message.reply_text("You don't own this gift.")
+        return await reply(update.message, "You don't own this gift.")
 
     receiver_user = update.message.reply_to_message.from_user
-    receiver = get_cat(receiver_user)
+    receiver = await get_cat(receiver_user)
 
     # Deduct from sender
-    sender["inventory"][item] -= 1
-    if sender["inventory"][item] <= 0:
-        del sender["inventory"][item]
+    cat_inc(sender, f"inventory.{item}", -1, reason="gift")
 
     # Add to receiver
-    receiver.setdefault("inventory", {})
-    receiver["inventory"][item] = receiver["inventory"].get(item, 0) + 1
-
-    # Update DB
-    cats.update_one({"_id": sender["_id"]}, {"$set": {"inventory": sender["inventory"]}})
-    cats.update_one({"_id": receiver["_id"]}, {"$set": {"inventory": receiver["inventory"]}})
+    cat_inc(receiver, f"inventory.{item}", 1, reason="gift")
 
     # Prepare reply
     if item == "kiss":
         # Clickable user link
         user_link = f"[{receiver_user.first_name}](tg://user?id={receiver_user.id})"
         text = f"{GIFT_ITEMS[item]['emoji']} Gift sent to {user_link} 💖"
-        await update.message.reply_text(text, parse_mode="Markdown")
+        await reply(update.message, text, parse_mode="Markdown")
     else:
-        await update.message.reply_text(f"{GIFT_ITEMS[item]['emoji']} Gift sent to {receiver_user.first_name} 💖")
+        await reply(update.message, f"{GIFT_ITEMS[item]['emoji']} Gift sent to {receiver_user.first_name} 💖")
         
 # ================= INVENTORY =================
 async def inventory(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    cat = get_cat(update.effective_user)
+    cat = await get_cat(update.effective_user, CAT_READS["inventory"])
     inv = cat.get("inventory", {})
 
     msg = "🎒 *Your Inventory*\n\n"
@@ -696,15 +2849,16 @@ async def inventory(update: Update, context: ContextTypes.DEFAULT_TYPE):
     else:
         msg += "🎁 *Gift Items:* Empty 😿"
 
-    await update.message.reply_text(msg, parse_mode="Markdown")
+    await reply(update.message, msg, parse_mode="Markdown")
 
 # -------------------- ITEM USE LOGIC --------------------
 
 async def use(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    cat = get_cat(update.effective_user)  # get user data
+    cat = await get_cat(update.effective_user)  # get user data
 
     if not context.args:
-        return await update.message.reply_text(
+        return await reply(
+            update.message,
             "Usage: /use <item>\nExample: /use shield"
         )
 
@@ -714,117 +2868,104 @@ async def use(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # ------------------- SHIELD -------------------
     if item == "shield":
         if inventory.get("shield", 0) <= 0:
-            return await update.message.reply_text("❌ You don't own a shield.")
+            return await reply(update.message, "❌ You don't own a shield.")
 
-        inventory["shield"] -= 1
-        cat["shield_until"] = datetime.now(timezone.utc) + timedelta(days=1)
-        await update.message.reply_text("🛡 Shield activated for 24 hours!")
+        cat_inc(cat, "inventory.shield", -1, reason="use")
+        protect_for(cat, SHIELD_DURATION)
+        left = format_left(time_left(cat, "protected_until"))
+        await reply(update.message, f"🛡 Shield activated! Protected for {left}.")
 
     # ------------------- SHIELD BREAKER -------------------
     elif item == "shield_breaker":
         if inventory.get("shield_breaker", 0) <= 0:
-            return await update.message.reply_text("❌ You don't own a Shield Breaker.")
+            return await reply(update.message, "❌ You don't own a Shield Breaker.")
         # For shield breaker, it is consumed automatically in rob command
-        return await update.message.reply_text("ℹ️ Use a Shield Breaker during a robbery!")
+        return await reply(update.message, "ℹ️ Use a Shield Breaker during a robbery!")
 
     # ------------------- LUCK BOOST -------------------
     elif item == "luck_boost":
         if inventory.get("luck_boost", 0) <= 0:
-            return await update.message.reply_text("❌ You don't own a Luck Boost.")
+            return await reply(update.message, "❌ You don't own a Luck Boost.")
         # For luck boost, it is consumed automatically in rob command
-        return await update.message.reply_text("ℹ️ Luck Boost will be applied automatically on next robbery!")
+        return await reply(update.message, "ℹ️ Luck Boost will be applied automatically on next robbery!")
 
     # ------------------- BAIL PASS -------------------
     elif item == "bail_pass":
         if inventory.get("bail_pass", 0) <= 0:
-            return await update.message.reply_text("❌ You don't own a Bail Pass.")
+            return await reply(update.message, "❌ You don't own a Bail Pass.")
         # Used automatically when jailed
-        return await update.message.reply_text("ℹ️ Bail Pass will be used automatically if jailed!")
+        return await reply(update.message, "ℹ️ Bail Pass will be used automatically if jailed!")
 
     # ------------------- FISH BAIT -------------------
     elif item == "fish_bait":
         if inventory.get("fish_bait", 0) <= 0:
-            return await update.message.reply_text("❌ You don't own Fish Bait.")
+            return await reply(update.message, "❌ You don't own Fish Bait.")
         # Consumed automatically in fishing
-        return await update.message.reply_text("ℹ️ Fish Bait will be consumed automatically in next fishing event!")
+        return await reply(update.message, "ℹ️ Fish Bait will be consumed automatically in next fishing event!")
 
     else:
-        return await update.message.reply_text("❌ Unknown item!")
-
-    # Update cat inventory & db
-    cat["inventory"] = inventory
-    cats.update_one({"_id": cat["_id"]}, {"$set": cat})
-
-
-# ------------------- HELPER FUNCTION -------------------
-def has_active_shield(cat):
-    """Check if the cat has an active shield protection"""
-    return cat.get("shield_until") and cat["shield_until"] > datetime.now(timezone.utc)
+        return await reply(update.message, "❌ Unknown item!")
 
 
 # ------------------- ROB COMMAND LOGIC EXAMPLES -------------------
 async def rob(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    attacker = get_cat(update.effective_user)
+    attacker = await get_cat(update.effective_user)
     target_user = update.message.reply_to_message.from_user
-    target = get_cat(target_user)
+    target = await get_cat(target_user)
+
+    # 0️⃣ Jail
+    if is_jailed(attacker):
+        return await reply(update.message, f"🚔 You're in jail! Free in {format_left(time_left(attacker, 'jail_until'))}.")
 
     # 1️⃣ Check Shield
-    if has_active_shield(target):
-        if attacker["inventory"].get("shield_breaker", 0) > 0:
-            attacker["inventory"]["shield_breaker"] -= 1
-            target["shield_until"] = None
-            await update.message.reply_text("💣 You broke the target's shield!")
-        else:
-            return await update.message.reply_text("🛡 Target is protected by a shield! Use a Shield Breaker.")
+    guard = check_protection(attacker, target, "rob")
+    if guard == "blocked":
+        return await reply(update.message, "🛡 Target is protected by a shield! Use a Shield Breaker.")
+    if guard == "broken":
+        await reply(update.message, "💣 You broke the target's shield!")
 
     # 2️⃣ Luck Boost
     luck_bonus = 0
     if attacker["inventory"].get("luck_boost", 0) > 0:
         luck_bonus = 20
-        attacker["inventory"]["luck_boost"] -= 1
-        await update.message.reply_text("🍀 Luck Boost applied! +20% success chance.")
+        cat_inc(attacker, "inventory.luck_boost", -1, reason="rob")
+        await reply(update.message, "🍀 Luck Boost applied! +20% success chance.")
 
     # 3️⃣ Determine success
     success_chance = 50 + luck_bonus
     if random.randint(1, 100) <= success_chance:
         reward = 200
-        attacker["coins"] += reward
-        await update.message.reply_text(f"✅ Robbery successful! You gained ${reward}")
+        cat_inc(attacker, "coins", reward, reason="rob")
+        await reply(update.message, f"✅ Robbery successful! You gained ${reward}")
     else:
         # Check Bail Pass
         if attacker["inventory"].get("bail_pass", 0) > 0:
-            attacker["inventory"]["bail_pass"] -= 1
-            await update.message.reply_text("🚔 Bail Pass used! You escaped jail.")
+            cat_inc(attacker, "inventory.bail_pass", -1, reason="rob")
+            await reply(update.message, "🚔 Bail Pass used! You escaped jail.")
         else:
-            attacker["jail_until"] = datetime.now(timezone.utc) + timedelta(minutes=30)
-            await update.message.reply_text("❌ Robbery failed! You are jailed for 30 minutes.")
-
-    # Update attacker & target
-    cats.update_one({"_id": attacker["_id"]}, {"$set": attacker})
-    cats.update_one({"_id": target["_id"]}, {"$set": target})
+            cat_set(attacker, "jail_until", datetime.now(timezone.utc) + JAIL_DURATION)
+            await reply(update.message, "❌ Robbery failed! You are jailed for 30 minutes.")
 
 
 # ------------------- FISHING EVENT EXAMPLE -------------------
 async def moon_mere_papa(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    cat = get_cat(update.effective_user)
+    cat = await get_cat(update.effective_user)
     inventory = cat.get("inventory", {})
 
     rare_bonus = 0
     if inventory.get("fish_bait", 0) > 0:
         rare_bonus = 15
-        inventory["fish_bait"] -= 1
-        await update.message.reply_text("🐟 Fish Bait used! +15% rare chance")
+        cat_inc(cat, "inventory.fish_bait", -1, reason="fish_event")
+        await reply(update.message, "🐟 Fish Bait used! +15% rare chance")
 
     if random.randint(1, 100) <= 10 + rare_bonus:
         reward = 500
-        await update.message.reply_text(f"🎉 You caught a rare fish! +${reward}")
+        await reply(update.message, f"🎉 You caught a rare fish! +${reward}")
     else:
         reward = 100
-        await update.message.reply_text(f"🐟 You caught a normal fish. +${reward}")
+        await reply(update.message, f"🐟 You caught a normal fish. +${reward}")
 
-    cat["coins"] += reward
-    cat["inventory"] = inventory
-    cats.update_one({"_id": cat["_id"]}, {"$set": cat})
+    cat_inc(cat, "coins", reward, reason="fish_event")
         
     
 # ================= ROB =================
@@ -832,7 +2973,8 @@ async def moon_mere_papa(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def rob(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # ❌ OWNER PROTECTION: Agar reply kiya gaya user OWNER hai
     if update.message.reply_to_message and is_owner_user(update.message.reply_to_message.from_user.id):
-        await update.message.reply_text(
+        await reply(
+            update.message,
             "👑 Stop right there!\n"
             "Ye koi normal cat nahi 😼\n"
             "✨ This is the OWNER of the bot.\n"
@@ -842,86 +2984,105 @@ async def rob(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     if update.effective_chat.type == "private":
-        return await update.message.reply_text("❌ Rob works in groups only.")
+        return await reply(update.message, "❌ Rob works in groups only.")
     if not update.message.reply_to_message:
-        return await update.message.reply_text("❗ Reply to a cat and use /rob <amount>")
+        return await reply(update.message, "❗ Reply to a cat and use /rob <amount>")
 
     try:
         amount = int(context.args[0])
     except:
-        return await update.message.reply_text("💸 Use like: /rob <amount>")
+        return await reply(update.message, "💸 Use like: /rob <amount>")
 
     if amount < 1 or amount > 1000:
-        return await update.message.reply_text("❗ You can only rob between 1 - 1000.")
+        return await reply(update.message, "❗ You can only rob between 1 - 1000.")
 
     thief_user = update.effective_user
     victim_user = update.message.reply_to_message.from_user
 
     if victim_user.id == thief_user.id:
-        return await update.message.reply_text("🙀 You can't rob yourself!")
+        return await reply(update.message, "🙀 You can't rob yourself!")
 
     if victim_user.is_bot:
-        return await update.message.reply_text("🤖 That's a bot!")
+        return await reply(update.message, "🤖 That's a bot!")
 
-    thief = get_cat(thief_user)
-    victim = get_cat(victim_user)
+    thief = await get_cat(thief_user)
+    victim = await get_cat(victim_user)
 
     # Clickable mentions
     thief_mention = f"<a href='tg://user?id={thief_user.id}'>{thief_user.first_name}</a>"
     victim_mention = f"<a href='tg://user?id={victim_user.id}'>{victim_user.first_name}</a>"
 
+    # 🚔 JAIL CHECK
+    if is_jailed(thief):
+        return await reply(
+            update.message,
+            f"🚔 You're in jail! Free in {format_left(time_left(thief, 'jail_until'))}."
+        )
+
     # 👑 VIP SHIELD CHECK
-    if victim["inventory"].get("vip_shield", 0) > 0:
-        victim["inventory"]["vip_shield"] -= 1
-        cats.update_one({"_id": victim["_id"]}, {"$set": victim})
-        return await update.message.reply_text(
+    if victim.inventory["vip_shield"] > 0:
+        cat_inc(victim, "inventory.vip_shield", -1, reason="rob")
+        return await reply(
+            update.message,
             f"👑 VIP SHIELD activated! {victim_mention} blocked the robbery!",
             parse_mode="HTML"
         )
 
+    # broke victims first, so no shield or breaker is spent on a robbery that can't happen
+    if victim.coins <= 0:
+        return await reply(
+            update.message,
+            f"😿 {victim_mention} is broke! Has $0",
+            parse_mode="HTML"
+        )
+
     # 🛡 NORMAL PROTECTION CHECK
-    if is_protected(victim) or victim["inventory"].get("shield", 0) > 0:
-        if thief["inventory"].get("shield_breaker", 0) > 0:
-            thief["inventory"]["shield_breaker"] -= 1
-            cats.update_one({"_id": thief["_id"]}, {"$set": thief})
-            await update.message.reply_text("💣 Shield Breaker used! Protection destroyed!")
-        else:
-            return await update.message.reply_text(
-                f"🛡 {victim_mention} is protected by a magic shield!",
-                parse_mode="HTML"
-            )
+    guard = check_protection(thief, victim, "rob")
+    if guard == "blocked":
+        return await reply(
+            update.message,
+            f"🛡 {victim_mention} is protected by a magic shield!",
+            parse_mode="HTML"
+        )
+    if guard == "broken":
+        await reply(update.message, "💣 Shield Breaker used! Protection destroyed!")
 
-    steal = min(amount, victim["coins"])
+    # server-side debit: parallel robberies can never take more than the victim has
+    steal = 0
+    if victim.coins > 0:
+        steal, _ = await transfer_coins(victim, thief, amount, "rob", partial=True)
 
     if steal <= 0:
-        return await update.message.reply_text(
+        # emptied by a parallel robbery: the breaker went unused, hand it back
+        if guard == "broken":
+            cat_inc(thief, "inventory.shield_breaker", 1, reason="rob")
+        return await reply(
+            update.message,
             f"😿 {victim_mention} is broke! Has $0",
             parse_mode="HTML"
         )
 
     if steal < amount:
-        await update.message.reply_text(
-            f"⚠️ {victim_mention} has only ${victim['coins']}! You stole ${steal} instead.",
+        await reply(
+            update.message,
+            f"⚠️ {victim_mention} has only ${steal}! You stole ${steal} instead.",
             parse_mode="HTML"
         )
 
-    victim["coins"] -= steal
-    thief["coins"] += steal
-
-    cats.update_one({"_id": thief["_id"]}, {"$set": thief})
-    cats.update_one({"_id": victim["_id"]}, {"$set": victim})
-
     # ✅ Group success message with mentions
-    await update.message.reply_text(
+    await reply(
+        update.message,
         f"😼 {thief_mention} robbed {victim_mention} and stole ${steal}!",
         parse_mode="HTML"
     )
 
     # 📩 DM to victim
     try:
-        await context.bot.send_message(
+        await send(
+            context.bot,
             chat_id=victim_user.id,
             text=f"🚨 You were robbed by {thief_mention}!\n💸 Lost: ${steal}",
+            droppable=True,
             parse_mode="HTML"
         )
     except:
@@ -932,7 +3093,8 @@ async def rob(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def kill(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # ❌ OWNER PROTECTION: Agar target owner hai
     if update.message.reply_to_message and is_owner_user(update.message.reply_to_message.from_user.id):
-        await update.message.reply_text(
+        await reply(
+            update.message,
             "👑 Hold up!\n"
             "Ye koi normal cat nahi 😼\n"
             "✨ This is the OWNER of the bot.\n"
@@ -942,17 +3104,17 @@ async def kill(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     if not update.message.reply_to_message:
-        return await update.message.reply_text("Reply to attack someone.")
+        return await reply(update.message, "Reply to attack someone.")
 
     attacker_user = update.effective_user
     victim_user = update.message.reply_to_message.from_user
 
     # Khud ko attack na kar sake
     if attacker_user.id == victim_user.id:
-        return await update.message.reply_text("You can't attack yourself 😹")
+        return await reply(update.message, "You can't attack yourself 😹")
 
-    attacker = get_cat(attacker_user)
-    victim = get_cat(victim_user)
+    attacker = await get_cat(attacker_user)
+    victim = await get_cat(victim_user)
 
     # Clickable mentions
     attacker_mention = f"<a href='tg://user?id={attacker_user.id}'>{attacker_user.first_name}</a>"
@@ -960,39 +3122,47 @@ async def kill(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # 🛡 PROTECTION CHECK
     if victim["inventory"].get("vip_shield", 0) > 0:
-        return await update.message.reply_text(
+        return await reply(
+            update.message,
             f"👑 {victim_mention} is protected by a VIP Shield!",
             parse_mode="HTML"
         )
 
-    if victim["inventory"].get("shield", 0) > 0 or is_protected(victim):
-        return await update.message.reply_text(
-            f"🛡 {victim_mention} is protected right now!",
+    # 🪦 Dead or still healing (before any shield gets used up)
+    now = datetime.now(timezone.utc)
+    recovering = recovery_left(victim, now)
+    if recovering:
+        health = current_health(victim, now)
+        status = "is already dead!" if health <= 0 else f"is still recovering (❤️ {health}/{HEALTH_MAX})!"
+        return await reply(
+            update.message,
+            f"☠️ {victim_mention} {status}\nAttack again in {format_left(recovering)} 😼",
             parse_mode="HTML"
         )
 
-    # 🪦 Already dead check
-    if victim.get("health", 100) <= 0:
-        return await update.message.reply_text(
-            f"☠️ {victim_mention} is already dead!\nNo need to attack again 😼",
+    guard = check_protection(attacker, victim, "kill", now)
+    if guard == "blocked":
+        return await reply(
+            update.message,
+            f"🛡 {victim_mention} is protected right now!",
             parse_mode="HTML"
         )
+    if guard == "broken":
+        await reply(update.message, "💣 Shield Breaker used! Protection destroyed!")
 
     # 🎁 Reward
     reward = random.randint(80, 160)
 
-    attacker["kills"] += 1
-    victim["deaths"] += 1
-    attacker["coins"] += reward
-
-    # Victim health zero
-    victim["health"] = 0
+    cat_inc(attacker, "kills", 1)
+    cat_inc(victim, "deaths", 1)
+    cat_inc(attacker, "coins", reward, reason="kill")
 
-    cats.update_one({"_id": attacker["_id"]}, {"$set": attacker})
-    cats.update_one({"_id": victim["_id"]}, {"$set": victim})
+    # Victim health zero, regrows from now
+    set_health(victim, 0, now)
 
     # ✅ Group message
-    await update.message.reply_text(
+    await reply(
+        update.message,
         f"⚔️ {attacker_mention} attacked {victim_mention} and won!\n"
         f"💰 Reward: ${reward}",
         parse_mode="HTML"
@@ -1000,13 +3170,15 @@ async def kill(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # 📩 DM to victim
     try:
-        await context.bot.send_message(
+        await send(
+            context.bot,
             chat_id=victim_user.id,
+            droppable=True,
             text=(
                 f"🚨 <b>You were attacked!</b>\n"
                 f"⚔️ Attacker: {attacker_mention}\n"
                 f"💀 You lost the fight and are now dead.\n"
-                f"❤️ Health: 0"
+                f"❤️ Health: 0 (full again in {format_left(timedelta(hours=HEALTH_MAX / HEALTH_REGEN_PER_HOUR))})"
             ),
             parse_mode="HTML"
         )
@@ -1016,59 +3188,61 @@ async def kill(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # ================= PROTECTION COMMAND =================
 
 async def protect(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    cat = get_cat(update.effective_user)
+    cat = await get_cat(update.effective_user)
     now = datetime.now(timezone.utc)
 
     # ❗ Show usage if no argument
     if not context.args:
-        return await update.message.reply_text("⚠️ Usage: /protection 1d")
+        return await reply(update.message, "⚠️ Usage: /protection 1d")
 
     # ❌ Only 1d allowed
     if context.args[0].lower() != "1d":
-        return await update.message.reply_text("❗ Users can only use: 1d")
+        return await reply(update.message, "❗ Users can only use: 1d")
 
     # 🛡 Already protected check
-    protected_until = cat.get("protected_until")
-    if protected_until and protected_until.tzinfo is None:
-        protected_until = protected_until.replace(tzinfo=timezone.utc)
-
-    if protected_until and protected_until > now:
-        remaining = protected_until - now
-        hours = remaining.seconds // 3600
-        minutes = (remaining.seconds % 3600) // 60
-        days = remaining.days
-
-        time_text = ""
-        if days > 0:
-            time_text += f"{days}d "
-        if hours > 0:
-            time_text += f"{hours}h "
-        if minutes > 0:
-            time_text += f"{minutes}m"
-
-        return await update.message.reply_text(
-            f"🛡 You are already protected!\n⏳ Time left: {time_text.strip()}"
+    remaining = time_left(cat, "protected_until", now)
+    if remaining:
+        return await reply(
+            update.message,
+            f"🛡 You are already protected!\n⏳ Time left: {format_left(remaining)}"
         )
 
     # 💰 Cost check
     cost = 600
     if cat["coins"] < cost:
-        return await update.message.reply_text(f"Need ${cost} for protection.")
+        return await reply(update.message, f"Need ${cost} for protection.")
 
     # ✅ Activate protection
-    cat["coins"] -= cost
-    cat["protected_until"] = now + timedelta(days=1)
+    cat_inc(cat, "coins", -cost, reason="protect")
+    protect_for(cat, timedelta(days=1), now)
 
-    cats.update_one({"_id": cat["_id"]}, {"$set": cat})
-
-    await update.message.reply_text("🛡 Protection enabled for 1 day.")
+    await reply(update.message, "🛡 Protection enabled for 1 day.")
     
 # ================= BUTTONS =================
-def leaderboard_buttons():
-    keyboard = [[
-        InlineKeyboardButton("🏆 Richest Cats", callback_data="lb_rich"),
-        InlineKeyboardButton("⚔️ Top Fighters", callback_data="lb_kill"),
-    ]]
+def leaderboard_buttons(shown: str = "", version: int = 0, group: bool = False, page=None):
+    # callback data carries the board/version currently on screen so a tap
+    # that would show the same content can skip the edit; "@g" marks a group board.
+    # ``page`` is (board, number, page entry) and adds the prev / my position / next row.
+    keyboard = []
+    if page is not None:
+        board, number, (_, first, last, more) = page
+        scope = "g" if group else "-"
+        nav = []
+        if number > 0:
+            nav.append(InlineKeyboardButton("⬅️ Prev", callback_data=f"lbp:{board}:{scope}:{number - 1}:p:{first[0]}:{first[1]}"))
+        nav.append(InlineKeyboardButton("📍 My Position", callback_data=f"lbp:{board}:{scope}:0:m"))
+        if more:
+            nav.append(InlineKeyboardButton("Next ➡️", callback_data=f"lbp:{board}:{scope}:{number + 1}:n:{last[0]}:{last[1]}"))
+        keyboard.append(nav)
+        if number > 0:
+            shown = ""  # switching board goes back to page 1 even for the same board
+
+    if group:
+        shown += "@g"
+    keyboard.append([
+        InlineKeyboardButton("🏆 Richest Cats", callback_data=f"lb_rich:{shown}:{version}"),
+        InlineKeyboardButton("⚔️ Top Fighters", callback_data=f"lb_kill:{shown}:{version}"),
+    ])
     return InlineKeyboardMarkup(keyboard)
 
 # ================= RANK BADGES =================
@@ -1076,104 +3250,427 @@ def rank_decor(rank: int) -> str:
     return ["👑", "🥈", "🥉"][rank-1] if rank <= 3 else "🎖"
 
 # ================= RANK MOVEMENT =================
-def get_rank_arrow(user_id: int, board_type: str, new_rank: int) -> str:
-    key = f"{board_type}_{user_id}"
-    prev = leaderboard_history.find_one({"_id": key})
+async def get_rank_arrows(board_type: str, user_ids: list) -> dict:
+    """Compare new ranks with the stored ones and save them: one read, one bulk write."""
+    keys = {user_id: f"{board_type}_{user_id}" for user_id in user_ids}
+    history = await leaderboard_history.find({"_id": {"$in": list(keys.values())}})
+    old_ranks = {h["_id"]: h["rank"] for h in history}
+
+    arrows = {}
+    writes = []
+    for new_rank, user_id in enumerate(user_ids, 1):
+        key = keys[user_id]
+        old_rank = old_ranks.get(key)
+
+        if old_rank is None:
+            arrows[user_id] = "🆕"
+        elif new_rank < old_rank:
+            arrows[user_id] = "🔼"
+        elif new_rank > old_rank:
+            arrows[user_id] = "🔽"
+        else:
+            arrows[user_id] = "➖"
+            continue
+
+        writes.append(pymongo.UpdateOne({"_id": key}, {"$set": {"rank": new_rank}}, upsert=True))
+
+    if writes:
+        await leaderboard_history.bulk_write(writes, ordered=False)
+    return arrows
+
+# ================= BUILD BOARDS =================
 
-    if not prev:
-        leaderboard_history.insert_one({"_id": key, "rank": new_rank})
-        return "🆕"
+LEADERBOARD_PAGE_SIZE = 10
+
+# board -> (cat field, title, score format)
+BOARDS = {
+    "rich": ("coins", "🏆 Top Rich Cats", lambda coins: f"${coins}"),
+    "kill": ("kills", "⚔️ Top Fighters", lambda kills: f"{kills} wins"),
+}
 
-    old_rank = prev["rank"]
-    leaderboard_history.update_one({"_id": key}, {"$set": {"rank": new_rank}})
 
-    if new_rank < old_rank:
-        return "🔼"
-    elif new_rank > old_rank:
-        return "🔽"
-    return "➖"
+def board_source(board: str, chat_id: int = None):
+    """``(collection, filter, score key, tie key, name key)`` a board reads from."""
+    field = BOARDS[board][0]
+    if chat_id is None:
+        return cats, {"_id": {"$ne": OWNER_ID}}, cat_field(field), "_id", cat_field("name")  # exclude owner
+    return group_members, {"g": chat_id, "u": {"$ne": OWNER_ID}}, GROUP_BOARD_FIELDS[field], "u", "n"
 
-# ================= BUILD RICH BOARD =================
 
-def build_rich_board():
-    top = cats.find({"_id": {"$ne": OWNER_ID}}).sort("coins", -1).limit(10)  # exclude owner
-    msg = "<b>🏆 Top Rich Cats</b>\n\n"
+def board_anchor(board: str, row: dict):
+    """Keyset cursor of a row: its stored score and user id."""
+    field = BOARDS[board][0]
+    return encode_value(field, row[field]), row["_id"]
 
-    for i, c in enumerate(top, 1):  
-        user_id = c["_id"]  
-        name = c.get("name", "Cat")  
-        coins = c.get("coins", 0)  
 
-        badge = rank_decor(i)  
-        arrow = get_rank_arrow(user_id, "rich", i)  
-        mention = f"<a href='tg://user?id={user_id}'>{name}</a>"  
+async def fetch_page(board: str, chat_id: int = None, anchor=None, forward=True, limit=LEADERBOARD_PAGE_SIZE):
+    """``limit`` rows after ``anchor`` (before it when going back), and whether more follow that way.
 
-        msg += f"{badge} {i}. {mention} {arrow} — ${coins}\n"  
+    Keyset on (score, user id) instead of skip(), so page 37 costs what page 1 does.
+    """
+    field = BOARDS[board][0]
+    collection, query, score_key, tie_key, name_key = board_source(board, chat_id)
+    if anchor is not None:
+        query = {"$and": [query, keyset(score_key, tie_key, *anchor, forward)]}
+    order = -1 if forward else 1
+    rows = await collection.find(
+        query,
+        projection={tie_key: 1, score_key: 1, name_key: 1},
+        sort=[(score_key, order), (tie_key, order)],
+        limit=limit + 1,
+    )
+    more = len(rows) > limit
+    rows = rows[:limit]
+    if not forward:
+        rows.reverse()
+    return [
+        {"_id": r[tie_key], "name": r.get(name_key, "Cat"), field: decode_value(field, r.get(score_key, 0))}
+        for r in rows
+    ], more
+
+
+def render_board(board: str, rows: list, chat_id: int = None, page: int = 0, arrows: dict = None) -> str:
+    field, title, fmt = BOARDS[board]
+    if chat_id is not None:
+        title += " of this Group"
+    if page:
+        title += f" · Page {page + 1}"
+    msg = f"<b>{title}</b>\n\n"
+    if not rows and chat_id is not None:
+        msg += "😿 No cats ranked here yet, chat a little first!"
+
+    for i, c in enumerate(rows, page * LEADERBOARD_PAGE_SIZE + 1):
+        user_id = c["_id"]
+        name = c.get("name", "Cat")
+
+        badge = rank_decor(i)
+        mention = f"<a href='tg://user?id={user_id}'>{name}</a>"
+        arrow = f" {arrows[user_id]}" if arrows else ""
+
+        msg += f"{badge} {i}. {mention}{arrow} — {fmt(c.get(field, 0))}\n"
 
     return msg
 
-#================= BUILD KILL BOARD =================
 
-def build_kill_board():
-    top = cats.find({"_id": {"$ne": OWNER_ID}}).sort("kills", -1).limit(10)  # exclude owner
-    msg = "<b>⚔️ Top Fighters</b>\n\n"
+async def build_board(board: str, chat_id: int = None) -> str:
+    """Page 1, the only page with rank movement arrows."""
+    # push pending changes first so the board matches what users see in /bal
+    if chat_id is None:
+        await cat_cache.flush()
+        history = board
+    else:
+        await group_boards.flush()
+        history = f"{board}@{chat_id}"
+    top, _ = await fetch_page(board, chat_id)
+    arrows = await get_rank_arrows(history, [c["_id"] for c in top])
+    return render_board(board, top, chat_id, arrows=arrows)
+
+
+async def build_rich_board(chat_id: int = None):
+    return await build_board("rich", chat_id)
+
+
+async def build_kill_board(chat_id: int = None):
+    return await build_board("kill", chat_id)
 
-    for i, c in enumerate(top, 1):  
-        user_id = c["_id"]  
-        name = c.get("name", "Cat")  
-        kills = c.get("kills", 0)  
 
-        badge = rank_decor(i)  
-        arrow = get_rank_arrow(user_id, "kill", i)  
-        mention = f"<a href='tg://user?id={user_id}'>{name}</a>"  
+WINDOW_TITLES = {"day": "Today", "week": "This Week"}
 
-        msg += f"{badge} {i}. {mention} {arrow} — {kills} wins\n"  
+
+async def build_window_board(kind: str, field: str, title: str, fmt, limit: int = 10, exclude: int = None) -> str:
+    await window_counters.flush()
+    top = await window_counters.top(kind, field, limit, exclude)
+    msg = f"<b>{title} {WINDOW_TITLES[kind]}</b>\n\n"
+    if not top:
+        msg += "😴 Nothing yet in this window, be the first!"
+
+    for i, c in enumerate(top, 1):
+        mention = f"<a href='tg://user?id={c['_id']}'>{c['name']}</a>"
+        msg += f"{rank_decor(i)} {i}. {mention} — {fmt(c[field])}\n"
 
     return msg
 
+
+def window_builders():
+    """Snapshot builders for every windowed board, e.g. ``kill_week``."""
+    boards = {
+        "kill": ("kills", "⚔️ Top Fighters", lambda kills: f"{kills} wins", 10, OWNER_ID),
+        "fish": ("fish_total_earned", "🎣 Top Fishers", lambda coins: f"🪙 {coins}", 5, None),
+    }
+    return {
+        f"{board}_{kind}": (lambda chat_id, kind=kind, spec=spec: build_window_board(kind, *spec))
+        for board, spec in boards.items()
+        for kind in WindowCounters.KINDS
+    }
+
+# ================= SNAPSHOTS =================
+
+LEADERBOARD_TTL = float(os.getenv("LEADERBOARD_TTL", "30"))
+LEADERBOARD_MAX_SNAPSHOTS = int(os.getenv("LEADERBOARD_MAX_SNAPSHOTS", "5000"))  # global + per-group boards
+LEADERBOARD_MAX_PAGES = int(os.getenv("LEADERBOARD_MAX_PAGES", "5000"))  # deeper pages, all boards together
+
+
+class LeaderboardSnapshots:
+    """Rendered boards shared by every requester for ``ttl`` seconds.
+
+    A board (global, or one group's) is rebuilt at most once per ttl no
+    matter how many /toprich calls or button taps arrive; ``version`` only
+    moves when the rendered HTML actually changes. The least recently used
+    snapshots are dropped past ``max_snapshots``.
+
+    Pages of the paginated boards are cached per snapshot version and
+    dropped whenever their board is rebuilt, so every page a user flips
+    through comes from the same generation of data as page 1.
+    """
+
+    def __init__(self, builders: dict, ttl: float, max_snapshots: int, max_pages: int):
+        self.builders = builders
+        self.ttl = ttl
+        self.max_snapshots = max_snapshots
+        self.max_pages = max_pages
+        self._snapshots = OrderedDict()  # (board, chat_id) -> (expires_at, version, html)
+        self._pages = OrderedDict()      # (board, chat_id, version, page) -> (html, first, last, more)
+        self._locks = {}
+        self.page_hits = 0
+        self.page_misses = 0
+        self.builds = {"global": [0, 0.0, 0.0], "group": [0, 0.0, 0.0]}  # count, total s, max s
+
+    async def get(self, board: str, chat_id: int = None):
+        key = (board, chat_id)
+        snap = self._snapshots.get(key)
+        if snap and snap[0] > time.monotonic():
+            self._snapshots.move_to_end(key)
+            return snap[1], snap[2]
+
+        async with self._locks.setdefault(key, asyncio.Lock()):
+            snap = self._snapshots.get(key)
+            if snap and snap[0] > time.monotonic():
+                return snap[1], snap[2]
+
+            started = time.perf_counter()
+            html = await self.builders[board](chat_id)
+            self._timed("global" if chat_id is None else "group", time.perf_counter() - started)
+
+            version = snap[1] if snap else 0
+            if not snap or snap[2] != html:
+                version += 1
+
+            self._drop_pages(key)
+            self._snapshots[key] = (time.monotonic() + self.ttl, version, html)
+            self._snapshots.move_to_end(key)
+            self._evict()
+            return version, html
+
+    async def get_page(self, board: str, chat_id: int = None, page: int = 0, anchor=None, forward=True):
+        """``(version, (html, first, last, more))`` for one page; ``anchor`` is the cursor
+        of the neighbouring page's edge, only needed on a cache miss."""
+        version, html = await self.get(board, chat_id)
+        if anchor is None:
+            page = 0
+        key = (board, chat_id, version, page)
+        entry = self._pages.get(key)
+        if entry is not None:
+            self.page_hits += 1
+            self._pages.move_to_end(key)
+            return version, entry
+
+        self.page_misses += 1
+        if page == 0:
+            rows, more = await fetch_page(board, chat_id)
+        else:
+            rows, more = await fetch_page(board, chat_id, anchor, forward)
+            html = render_board(board, rows, chat_id, page)
+            if not forward:
+                more = True  # the page we came back from
+        entry = self.store_page(key, html, board, rows, more)
+        return version, entry
+
+    def store_page(self, key, html, board, rows, more):
+        entry = (
+            html,
+            board_anchor(board, rows[0]) if rows else None,
+            board_anchor(board, rows[-1]) if rows else None,
+            more and bool(rows),
+        )
+        self._pages[key] = entry
+        self._pages.move_to_end(key)
+        while len(self._pages) > self.max_pages:
+            self._pages.popitem(last=False)
+        return entry
+
+    def _drop_pages(self, key):
+        for page_key in [k for k in self._pages if k[:2] == key]:
+            del self._pages[page_key]
+
+    def _timed(self, scope, seconds):
+        timing = self.builds[scope]
+        timing[0] += 1
+        timing[1] += seconds
+        timing[2] = max(timing[2], seconds)
+
+    def _evict(self):
+        while len(self._snapshots) > self.max_snapshots:
+            key, _ = self._snapshots.popitem(last=False)
+            lock = self._locks.get(key)
+            if lock is not None and not lock.locked():
+                del self._locks[key]
+
+    def stats(self):
+        return {
+            "snapshots": len(self._snapshots),
+            "pages": len(self._pages),
+            "page_hits": self.page_hits,
+            "page_misses": self.page_misses,
+            **{
+                scope: {"builds": n, "avg_ms": total / n * 1000 if n else 0.0, "max_ms": worst * 1000}
+                for scope, (n, total, worst) in self.builds.items()
+            },
+        }
+
+
+leaderboards = LeaderboardSnapshots(
+    {"rich": build_rich_board, "kill": build_kill_board, **window_builders()},
+    LEADERBOARD_TTL,
+    LEADERBOARD_MAX_SNAPSHOTS,
+    LEADERBOARD_MAX_PAGES,
+)
+
 # ================= COMMANDS =================
-async def toprich(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    msg = build_rich_board()
-    await update.message.reply_text(
-        msg,
+def board_scope(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Chat id of the group board to show, or None for the global one (``/toprich global``)."""
+    chat = update.effective_chat
+    if chat.type not in (ChatType.GROUP, ChatType.SUPERGROUP):
+        return None
+    if context.args and context.args[0].lower() == "global":
+        return None
+    return chat.id
+
+
+BOARD_WINDOWS = {"today": "day", "daily": "day", "day": "day", "week": "week", "weekly": "week"}
+
+
+def board_window(context: ContextTypes.DEFAULT_TYPE):
+    """``day``/``week`` when the command asked for a windowed board (``/topkill today``)."""
+    return BOARD_WINDOWS.get(context.args[0].lower()) if context.args else None
+
+
+async def send_window_board(update: Update, board: str, kind: str):
+    _, msg = await leaderboards.get(f"{board}_{kind}")
+    await reply(update.message, msg, parse_mode=ParseMode.HTML)
+
+
+async def send_board(update: Update, board: str, chat_id: int = None):
+    version, entry = await leaderboards.get_page(board, chat_id)
+    await reply(
+        update.message,
+        entry[0],
         parse_mode=ParseMode.HTML,
-        reply_markup=leaderboard_buttons()
+        reply_markup=leaderboard_buttons(board, version, group=chat_id is not None, page=(board, 0, entry))
     )
 
+async def toprich(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await send_board(update, "rich", board_scope(update, context))
+
 async def topkill(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    msg = build_kill_board()
-    await update.message.reply_text(
-        msg,
-        parse_mode=ParseMode.HTML,
-        reply_markup=leaderboard_buttons()
-    )
+    kind = board_window(context)
+    if kind:
+        return await send_window_board(update, "kill", kind)
+    await send_board(update, "kill", board_scope(update, context))
 
 # ================= BUTTON SWITCH =================
 async def leaderboard_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
 
-    if query.data == "lb_rich":
-        msg = build_rich_board()
+    # lb_<board>:<shown board>[@g]:<shown version>  (old buttons are just lb_<board>)
+    target, _, shown = query.data[len("lb_"):].partition(":")
+    board = "rich" if target == "rich" else "kill"
+    group = shown.partition(":")[0].endswith("@g")
+    version, entry = await leaderboards.get_page(board, query.message.chat.id if group else None)
+
+    if shown == f"{board}{'@g' if group else ''}:{version}":
+        return  # already on screen, editing would only fail with "not modified"
+
+    await edit(
+        query.message,
+        entry[0],
+        parse_mode=ParseMode.HTML,
+        reply_markup=leaderboard_buttons(board, version, group=group, page=(board, 0, entry))
+    )
+
+
+async def position_page(board: str, chat_id: int, user):
+    """``(version, page, entry)`` of the page holding ``user``, or None when they aren't on the board.
+
+    The rank service gives the exact position; the page is then filled with
+    keyset reads on both sides of the user, so it lines up with Prev/Next.
+    """
+    field = BOARDS[board][0]
+    collection, query, score_key, tie_key, _ = board_source(board, chat_id)
+    if user.id == OWNER_ID:
+        return None
+    if chat_id is None:
+        cat = await get_cat(user, CAT_READS[f"top{board}"])
+        score, name = encode_value(field, cat.get(field, 0)), cat.get("name", "Cat")
+    else:
+        record = await group_members.find_one({"_id": group_member_key(chat_id, user.id)})
+        if not record:
+            return None
+        score, name = record.get(score_key, 0), record.get("n", "Cat")
+
+    version, _ = await leaderboards.get(board, chat_id)
+    position = await get_board_position(collection, query, score_key, tie_key, score, user.id)
+    page, offset = divmod(position, LEADERBOARD_PAGE_SIZE)
+    if page == 0:
+        version, entry = await leaderboards.get_page(board, chat_id)
+        return version, 0, entry
+
+    anchor = (score, user.id)
+    before = (await fetch_page(board, chat_id, anchor, forward=False, limit=offset))[0] if offset else []
+    after, more = await fetch_page(board, chat_id, anchor, limit=LEADERBOARD_PAGE_SIZE - offset - 1)
+    rows = [*before, {"_id": user.id, "name": name, field: decode_value(field, score)}, *after]
+    html = render_board(board, rows, chat_id, page)
+    return version, page, leaderboards.store_page((board, chat_id, version, page), html, board, rows, more)
+
+
+async def leaderboard_page_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+
+    # lbp:<board>:<g|->:<page>:<n|p|m>[:<score>:<user id>]
+    parts = query.data.split(":")
+    board = parts[1] if parts[1] in BOARDS else "rich"
+    group = parts[2] == "g"
+    chat_id = query.message.chat.id if group else None
+    page, action = int(parts[3]), parts[4]
+
+    if action == "m":
+        found = await position_page(board, chat_id, query.from_user)
+        if found is None:
+            return await query.answer("😿 You're not on this board yet!", show_alert=True)
+        version, page, entry = found
     else:
-        msg = build_kill_board()
+        anchor = (int(parts[5]), int(parts[6])) if len(parts) > 6 else None
+        version, entry = await leaderboards.get_page(board, chat_id, page, anchor, forward=action == "n")
+    await query.answer()
 
-    await query.edit_message_text(
-        msg,
+    await edit(
+        query.message,
+        entry[0],
         parse_mode=ParseMode.HTML,
-        reply_markup=leaderboard_buttons()
+        reply_markup=leaderboard_buttons(board, version, group=group, page=(board, page, entry))
     )
 
 # ================= /me Command =================
 async def meow(update: Update, context: ContextTypes.DEFAULT_TYPE):
     target_user = update.message.reply_to_message.from_user if update.message.reply_to_message else update.effective_user
-    cat = get_cat(target_user)
+    cat = await get_cat(target_user, CAT_READS["meow"])
 
     # 👑 OWNER PROFILE (GOD MODE)
     if is_owner_user(target_user.id):
         # Owner ke liye stats hardcode + infinite coins
         mention = f"<a href='tg://user?id={target_user.id}'>{target_user.first_name}</a>"
-        await update.message.reply_text(
+        await reply(
+            update.message,
             f"👑 {mention} — <b>CATVERSE OWNER</b>\n\n"
             f"<b>🐾 Level:</b> 👑 Legend Cat\n"
             f"<b>💰 Money:</b> ∞\n"
@@ -1188,11 +3685,12 @@ async def meow(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # 🐱 Normal users
     d = cat["dna"]
-    rank = calculate_global_rank(cat["_id"])
+    rank = await get_global_rank(cat)
     mention = f"<a href='tg://user?id={target_user.id}'>{target_user.first_name}</a>"
 
     # Agar owner ne recently /lobu ya /give se coins diye, wo DB me update ho chuke honge, yahan latest show hoga
-    await update.message.reply_text(
+    await reply(
+        update.message,
         f"🐾 {mention} — \n\n<b>🐾 Level:</b> {cat['level']}\n"
         f"<b>💰 Money:</b> ${cat['coins']}\n"
         f"<b>🏆 Rank:</b> #{rank}\n"
@@ -1206,13 +3704,15 @@ async def meow(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def lobu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # ✅ Sirf owner use kar sakta
     if not is_owner_user(update.effective_user.id):
-        return await update.message.reply_text(
+        return await reply(
+            update.message,
             "🚫 Sorry! Only the OWNER can use this command!"
         )
 
     # ✅ Reply aur amount check
     if not update.message.reply_to_message or not context.args:
-        return await update.message.reply_text(
+        return await reply(
+            update.message,
             "Usage: /lobu <amount> (reply to a user)"
         )
 
@@ -1220,26 +3720,25 @@ async def lobu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         amount = int(context.args[0])
     except:
-        return await update.message.reply_text("❌ Enter a valid number!")
+        return await reply(update.message, "❌ Enter a valid number!")
 
     # ✅ Target user
     target_user = update.message.reply_to_message.from_user
-    target = get_cat(target_user)
+    target = await get_cat(target_user)
 
     # ✅ Owner coins = infinite
-    cat_owner = get_cat(update.effective_user)
-    cat_owner["coins"] = float("inf")
-    cats.update_one({"_id": cat_owner["_id"]}, {"$set": cat_owner})  # DB update
+    cat_owner = await get_cat(update.effective_user)
+    cat_set(cat_owner, "coins", float("inf"), reason="lobu")
 
     # ✅ Target ko coins add karna
-    target["coins"] += amount
-    cats.update_one({"_id": target["_id"]}, {"$set": target})  # DB update
+    cat_inc(target, "coins", amount, reason="lobu")
 
     # ✅ Mention
     mention = f"<a href='tg://user?id={target_user.id}'>{target_user.first_name}</a>"
 
     # ✅ Reply message (proper indentation inside function)
-    await update.message.reply_text(
+    await reply(
+        update.message,
         f"👑 Owner Power Activated!\n\n"
         f"✨ {mention} just received ${amount} instantly!\n"
         f"💰 Owner's magic never fails!",
@@ -1257,17 +3756,15 @@ async def fun(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "😼 Mischievous cat almost stole your money!",
     ]
     msg = random.choice(responses)
-    cat = get_cat(update.effective_user)
+    cat = await get_cat(update.effective_user)
 
     if "$120" in msg:
-        cat["coins"] += 120
+        cat_inc(cat, "coins", 120, reason="fun")
     if "fish" in msg:
-        cat["fish"] += 1
+        cat_inc(cat, "fish", 1, reason="fun")
     if "luck" in msg:
-        cat["dna"]["luck"] += 2
-
-    cats.update_one({"_id": cat["_id"]}, {"$set": cat})
-    await update.message.reply_text(msg)
+        cat_inc(cat, "dna.luck", 2)
+    await reply(update.message, msg)
 
 # ================= UPGRADE =================
 
@@ -1280,27 +3777,28 @@ UPGRADE_COSTS = {
 
 async def upgrade(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not context.args:
-        return await update.message.reply_text(
+        return await reply(
+            update.message,
             "Usage: /upgrade <stat> <amount>\nStats: aggression, intelligence, luck, charm"
         )
 
-    cat = get_cat(update.effective_user)
+    cat = await get_cat(update.effective_user)
     stat = context.args[0].lower()
     amount = int(context.args[1]) if len(context.args) > 1 else 1
 
     if stat not in UPGRADE_COSTS:
-        return await update.message.reply_text("❌ Invalid stat!")
+        return await reply(update.message, "❌ Invalid stat!")
 
     cost = UPGRADE_COSTS[stat] * amount
     if cat["coins"] < cost:
-        return await update.message.reply_text(f"❌ Not enough money! Costs ${cost}")
+        return await reply(update.message, f"❌ Not enough money! Costs ${cost}")
 
-    cat["coins"] -= cost
-    cat["dna"][stat] += amount
+    cat_inc(cat, "coins", -cost, reason="upgrade")
+    cat_inc(cat, f"dna.{stat}", amount)
     evolve(cat)
-    cats.update_one({"_id": cat["_id"]}, {"$set": cat})
 
-    await update.message.reply_text(
+    await reply(
+        update.message,
         f"✅ {stat.capitalize()} increased by {amount}! Spent ${cost}\n"
         f"New {stat.capitalize()}: {cat['dna'][stat]}\n"
         f"Current Level: {cat['level']}"
@@ -1314,15 +3812,427 @@ OWNER_USERNAME = "@btw_moon"
 TOKEN = os.getenv("TOKEN")
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 
-# Initialize Groq client
-client = AsyncGroq(api_key=GROQ_API_KEY) if GROQ_API_KEY else None
+# ================= AI GATEWAY =================
+
+GROQ_BASE_URL = os.getenv("GROQ_BASE_URL")  # e.g. a local fake completion server in tests
+AI_MODEL = os.getenv("AI_MODEL", "llama-3.3-70b-versatile")
+AI_TIMEOUT = float(os.getenv("AI_TIMEOUT", "8"))            # whole-request deadline, queueing included
+AI_CONCURRENCY = int(os.getenv("AI_CONCURRENCY", "16"))     # completions in flight at once
+AI_BREAKER_FAILURES = int(os.getenv("AI_BREAKER_FAILURES", "5"))
+AI_BREAKER_COOLDOWN = float(os.getenv("AI_BREAKER_COOLDOWN", "30"))
+AI_HEDGE_AFTER = float(os.getenv("AI_HEDGE_AFTER", "0"))    # 0 = off; else send a second try after this long
+
+
+def percentile(values, p: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(p * len(ordered)))] if ordered else 0.0
+
+
+class AIUnavailable(Exception):
+    """The gateway gave up; ``reason`` is disabled, open, busy, timeout or error."""
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class CircuitBreaker:
+    """Closed until ``failures`` calls fail in a row, then open: every call is
+    refused at once for ``cooldown`` seconds. After that one probe goes
+    through (half-open); its success closes the breaker, its failure reopens it.
+    """
+
+    def __init__(self, failures: int, cooldown: float):
+        self.failures = failures
+        self.cooldown = cooldown
+        self.failed = 0
+        self.opened_at = None
+        self.probing = False
+        self.trips = 0
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if self.probing or time.monotonic() - self.opened_at >= self.cooldown:
+            return "half-open"
+        return "open"
+
+    def allow(self) -> bool:
+        if self.opened_at is None:
+            return True
+        if self.probing or time.monotonic() - self.opened_at < self.cooldown:
+            return False
+        self.probing = True
+        return True
+
+    def success(self):
+        self.failed = 0
+        self.opened_at = None
+        self.probing = False
+
+    def failure(self):
+        self.failed += 1
+        if self.probing or self.failed >= self.failures:
+            if self.opened_at is None or self.probing:
+                self.trips += 1
+            self.opened_at = time.monotonic()
+        self.probing = False
+
+    def release(self):
+        """The probe ended without telling us anything (e.g. no free slot)."""
+        self.probing = False
+
+
+class AIGateway:
+    """Every AI completion goes through here.
+
+    One deadline covers waiting for a slot and the call itself, at most
+    ``concurrency`` completions are in flight, and while the breaker is open
+    callers get ``AIUnavailable`` immediately instead of piling up behind a
+    slow provider. With ``hedge_after`` set, a second attempt is sent when
+    the first is slow (or fails fast) and whichever answers first wins.
+    """
+
+    def __init__(self, client, model: str, timeout: float, concurrency: int,
+                 breaker: CircuitBreaker, hedge_after: float = 0.0, window: int = 500):
+        self.client = client
+        self.model = model
+        self.timeout = timeout
+        self.concurrency = concurrency
+        self.breaker = breaker
+        self.hedge_after = hedge_after
+        self._slots = None
+        self.in_flight = 0
+        self.latencies = deque(maxlen=window)  # seconds, successful requests only
+        self.requests = 0
+        self.ok = 0
+        self.errors = {"disabled": 0, "open": 0, "busy": 0, "timeout": 0, "error": 0}
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def _fail(self, reason: str):
+        self.errors[reason] += 1
+        return AIUnavailable(reason)
+
+    async def complete(self, messages, **params) -> str:
+        """Text of one chat completion, or ``AIUnavailable``."""
+        self.requests += 1
+        if self.client is None:
+            raise self._fail("disabled")
+        if not self.breaker.allow():
+            raise self._fail("open")
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.concurrency)
+
+        started = time.monotonic()
+        sent = []  # when each attempt got its slot
+        try:
+            text = await asyncio.wait_for(self._hedged(messages, params, sent), self.timeout)
+        except asyncio.TimeoutError:
+            if not sent or time.monotonic() - sent[0] < self.timeout / 2:
+                # mostly spent queueing behind our own cap: don't blame the provider
+                self.breaker.release()
+                raise self._fail("busy") from None
+            self.breaker.failure()
+            raise self._fail("timeout") from None
+        except Exception as e:
+            logger.warning("AI completion failed: %r", e)
+            self.breaker.failure()
+            raise self._fail("error") from e
+
+        self._succeeded(time.monotonic() - started)
+        return text
+
+    async def stream(self, messages, **params):
+        """Yield the text chunks of one streamed completion.
+
+        Same slot, deadline and breaker as ``complete`` (no hedging: half a
+        reply can't be swapped for another one). The deadline only counts
+        time spent waiting on the provider, not time the caller spends with
+        a chunk (e.g. queued behind our own send throttle). Closing the
+        generator early, e.g. once the reply is long enough, counts as a
+        success.
+        """
+        self.requests += 1
+        if self.client is None:
+            raise self._fail("disabled")
+        if not self.breaker.allow():
+            raise self._fail("open")
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.concurrency)
+
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            self.breaker.release()
+            raise self._fail("busy") from None
+
+        self.in_flight += 1
+        budget = self.timeout - (time.monotonic() - started)  # provider time left
+        stream = None
+        try:
+            waited = time.monotonic()
+            stream = await asyncio.wait_for(
+                self.client.chat.completions.create(model=self.model, messages=messages, stream=True, **params),
+                budget,
+            )
+            budget -= time.monotonic() - waited
+            chunks = stream.__aiter__()
+            while True:
+                waited = time.monotonic()
+                try:
+                    chunk = await asyncio.wait_for(chunks.__anext__(), budget)
+                except StopAsyncIteration:
+                    break
+                budget -= time.monotonic() - waited
+                text = chunk.choices[0].delta.content if chunk.choices else None
+                if text:
+                    yield text  # the clock is stopped while the caller has it
+        except GeneratorExit:
+            self._succeeded(self.timeout - budget)
+            raise
+        except asyncio.TimeoutError:
+            self.breaker.failure()
+            raise self._fail("timeout") from None
+        except Exception as e:
+            logger.warning("AI stream failed: %r", e)
+            self.breaker.failure()
+            raise self._fail("error") from e
+        else:
+            self._succeeded(self.timeout - budget)
+        finally:
+            self.in_flight -= 1
+            self._slots.release()
+            if stream is not None:
+                await stream.close()
+
+    def _succeeded(self, elapsed):
+        self.breaker.success()
+        self.ok += 1
+        self.latencies.append(elapsed)
+
+    async def _attempt(self, messages, params, sent):
+        async with self._slots:
+            sent.append(time.monotonic())
+            self.in_flight += 1
+            try:
+                completion = await self.client.chat.completions.create(
+                    model=self.model, messages=messages, **params
+                )
+            finally:
+                self.in_flight -= 1
+        return completion.choices[0].message.content
+
+    async def _hedged(self, messages, params, sent):
+        if not self.hedge_after:
+            return await self._attempt(messages, params, sent)
+
+        first = asyncio.ensure_future(self._attempt(messages, params, sent))
+        second = None
+        try:
+            done, _ = await asyncio.wait({first}, timeout=self.hedge_after)
+            if done and first.exception() is None:
+                return first.result()
+
+            # slow or already failed: one more try, first good answer wins
+            self.hedges += 1
+            second = asyncio.ensure_future(self._attempt(messages, params, sent))
+            pending = {second} if done else {first, second}
+            error = first.exception() if done else None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is second:
+                            self.hedge_wins += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in (first, second):
+                if task is not None and not task.done():
+                    task.cancel()
+
+    def stats(self):
+        return {
+            "state": self.breaker.state,
+            "trips": self.breaker.trips,
+            "in_flight": self.in_flight,
+            "requests": self.requests,
+            "ok": self.ok,
+            "errors": dict(self.errors),
+            "p50": percentile(self.latencies, 0.5),
+            "p95": percentile(self.latencies, 0.95),
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+        }
+
+
+# the gateway owns deadlines and retries, so the SDK's own are switched off
+client = AsyncGroq(
+    api_key=GROQ_API_KEY, base_url=GROQ_BASE_URL, timeout=AI_TIMEOUT, max_retries=0
+) if GROQ_API_KEY else None
+ai_gateway = AIGateway(
+    client, AI_MODEL, AI_TIMEOUT, AI_CONCURRENCY,
+    CircuitBreaker(AI_BREAKER_FAILURES, AI_BREAKER_COOLDOWN), AI_HEDGE_AFTER,
+)
 
 # ================= STORAGE & MEMORY =================
-chat_memory = {}  # chat_id: deque
-user_emotions = {}
-user_last_interaction = {}
-dm_enabled_users = {}
-game_sessions = {}
+MEMORY_MAX_ENTRIES = int(os.getenv("MEMORY_MAX_ENTRIES", "50000"))            # chats + users remembered at once
+MEMORY_MAX_BYTES = int(os.getenv("MEMORY_MAX_BYTES", str(64 * 2 ** 20)))
+MEMORY_IDLE_TTL = float(os.getenv("MEMORY_IDLE_TTL", str(6 * 3600)))          # forget chats/users quiet this long
+MEMORY_ENTRY_OVERHEAD = 200  # key tuple, bookkeeping list and dict slot, per entry
+CHAT_MEMORY_TURNS = 20
+CHAT_MEMORY_TEXT = 500       # chars kept per remembered message
+
+
+class ChatLog:
+    """Ring buffer of one chat's last turns, kept as ``(from_bot, text)`` pairs."""
+
+    __slots__ = ("turns",)
+
+    def __init__(self, size: int = CHAT_MEMORY_TURNS):
+        self.turns = deque(maxlen=size)
+
+    def add(self, role: str, text: str):
+        self.turns.append((role == "assistant", text[:CHAT_MEMORY_TEXT]))
+
+    def messages(self, last: int = None):
+        """The turns in the ``{"role", "content"}`` shape the AI expects."""
+        turns = list(self.turns)[-last:] if last else self.turns
+        return [{"role": "assistant" if bot else "user", "content": text} for bot, text in turns]
+
+    def user_texts(self):
+        return [text for bot, text in self.turns if not bot]
+
+
+class MemoryStore:
+    """What the bot remembers between messages: chat logs, moods, games, prefs.
+
+    One LRU across all namespaces with a global entry and byte budget.
+    Entries idle for ``ttl`` seconds are dropped; over budget the least
+    recently used go first. Sizes come from ``deep_size`` and are measured
+    again when a value is changed in place (``touch``).
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int, ttl: float):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()  # (namespace, key) -> [value, bytes, last used], oldest first
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = {"idle": 0, "entries": 0, "bytes": 0}
+
+    def get(self, namespace: str, key, default=None):
+        entry = self._entries.get((namespace, key))
+        now = time.monotonic()
+        if entry is not None and now - entry[2] > self.ttl:
+            self._drop((namespace, key), "idle")
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        entry[2] = now
+        self._entries.move_to_end((namespace, key))
+        return entry[0]
+
+    def set(self, namespace: str, key, value):
+        """Store ``value`` (replacing any old one) and return it."""
+        self.pop(namespace, key)
+        size = deep_size(value) + MEMORY_ENTRY_OVERHEAD
+        self._entries[(namespace, key)] = [value, size, time.monotonic()]
+        self.bytes += size
+        self._trim()
+        return value
+
+    def touch(self, namespace: str, key):
+        """Mark a value used and measure it again after an in-place change."""
+        entry = self._entries.get((namespace, key))
+        if entry is None:
+            return
+        size = deep_size(entry[0]) + MEMORY_ENTRY_OVERHEAD
+        self.bytes += size - entry[1]
+        entry[1], entry[2] = size, time.monotonic()
+        self._entries.move_to_end((namespace, key))
+        self._trim()
+
+    def pop(self, namespace: str, key, default=None):
+        entry = self._entries.pop((namespace, key), None)
+        if entry is None:
+            return default
+        self.bytes -= entry[1]
+        return entry[0]
+
+    def values(self, namespace: str):
+        return [entry[0] for (ns, _), entry in self._entries.items() if ns == namespace]
+
+    def _drop(self, full_key, reason: str):
+        self.bytes -= self._entries.pop(full_key)[1]
+        self.evictions[reason] += 1
+
+    def _trim(self):
+        # oldest first, so expired entries are always at the front
+        now = time.monotonic()
+        while self._entries:
+            full_key, entry = next(iter(self._entries.items()))
+            if now - entry[2] > self.ttl:
+                self._drop(full_key, "idle")
+            elif len(self._entries) > self.max_entries:
+                self._drop(full_key, "entries")
+            elif self.bytes > self.max_bytes and len(self._entries) > 1:
+                self._drop(full_key, "bytes")
+            else:
+                break
+
+    def stats(self):
+        self._trim()
+        by_namespace = {}
+        for namespace, _ in self._entries:
+            by_namespace[namespace] = by_namespace.get(namespace, 0) + 1
+        return {
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "by_namespace": by_namespace,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": dict(self.evictions),
+        }
+
+
+memory = MemoryStore(MEMORY_MAX_ENTRIES, MEMORY_MAX_BYTES, MEMORY_IDLE_TTL)
+
+
+def chat_log(chat_id: int) -> ChatLog:
+    return memory.get("chat", chat_id) or memory.set("chat", chat_id, ChatLog())
+
+
+def remember(chat_id: int, role: str, text: str):
+    chat_log(chat_id).add(role, text)
+    memory.touch("chat", chat_id)
+
+
+async def dm_enabled(user_id: int) -> bool:
+    """DM chat toggle: lives on the user doc, ``memory`` only caches it."""
+    enabled = memory.get("dm", user_id)
+    if enabled is None:
+        doc = await users.find_one({"_id": user_id}, {"dm": 1})
+        enabled = memory.set("dm", user_id, (doc or {}).get("dm", True))
+    return enabled
+
+
+async def set_dm_enabled(user, enabled: bool):
+    await users.update_one(
+        {"_id": user.id},
+        {"$set": {"dm": enabled}, "$setOnInsert": {"name": user.first_name}},
+        upsert=True,
+    )
+    memory.set("dm", user.id, enabled)
+
 
 # ================= TIMEZONE =================
 INDIAN_TIMEZONE = pytz.timezone('Asia/Kolkata')
@@ -1354,6 +4264,110 @@ SOFT_WARNINGS = ["Arre aaram se 😼", "Thoda pyaar se bol na 🐾", "Gussa lag
 
 WORD_STARTS = ["PYTHON", "APPLE", "TIGER", "ELEPHANT", "RAINBOW"]
 
+# ================= KEYWORDS =================
+# intent -> phrases (owner/name/time/... answered locally, see LOCAL INTENTS)
+# the English questions are spelled out whole: "what", "is", "the" alone explain nothing
+INTENT_PHRASES = {
+    "owner": [
+        "owner", "maalik", "malik", "creator", "kisne banaya", "baap papa kaun",
+        "who is your owner", "who s your owner", "your owner", "who owns you", "who made you",
+        "who created you", "your creator",
+    ],
+    "name": [
+        "tumhara naam", "tera naam", "apna naam", "naam kya", "name kya", "naam batao",
+        "kaun ho", "kon ho", "tum kaun ho", "kaun ho tum",
+        "your name", "what is your name", "what s your name", "whats your name", "who are you",
+    ],
+    "time": [
+        "time", "samay", "kitne baje", "date", "tarikh", "kya din", "konsa din",
+        "what time is it", "what is the time", "what s the time", "whats the time",
+        "what is the date", "what s the date", "whats the date", "todays date", "today s date",
+        "what day is it", "what day is today",
+    ],
+    "greeting": ["hi", "hello", "hey", "namaste", "hola", "good morning", "gm"],
+    "goodbye": ["bye", "goodbye", "tata", "alvida", "see you", "good night", "gn"],
+    "thanks": ["thanks", "thank you", "thanku", "thx", "dhanyavad", "shukriya"],
+    "sorry": ["sorry", "maaf", "apology"],
+}
+
+EMOTION_WORDS = {
+    "love": ["love", "pyaar", "dil"],
+    "angry": ["angry", "gussa", "naraz"],
+    "crying": ["cry", "crying", "sad", "dukh", "dukhi"],
+    "funny": ["funny", "lol", "joke", "jokes", "haha"],
+}
+# first listed group present wins; a greeting means a happy user
+EMOTION_ORDER = [("love", "love"), ("angry", "angry"), ("crying", "crying"), ("funny", "funny"), ("greeting", "happy")]
+
+CAT_CALLS = ["meowstric", "meow", "billi", "bilii", "cat"]
+
+# words that only address or soften, never change what is asked ("bhai tumhara naam kya hai?");
+# no generic function words here, or "is it time to sleep?" would read as a time question
+INTENT_FILLER = [
+    "bhai", "yaar", "yr", "please", "pls", "plz", "ji", "bot", "ok", "acha", "achha",
+    "batao", "bata", "btao", "bolo", "tell me",
+    "kya", "hai", "h", "hain", "kaun", "kon", "tumhara", "tumhari", "tera", "teri", "abhi", "aaj",
+]
+
+
+# \w plus combining marks: Devanagari vowel signs (कैसे) aren't \w and would split words
+WORD_CHAR = r"[\w\u0300-\u036f\u0900-\u097f]"
+WORD = re.compile(WORD_CHAR + "+")
+
+
+class KeywordClassifier:
+    """All keyword lists compiled into one regex, one named group per list.
+
+    A single ``finditer`` over the lowercased text tags every word with the
+    list it belongs to (or as a plain word). Keywords match whole words
+    only, so "hi" is not found in "this" nor "cat" in "education", and
+    stretched Hinglish spellings still count: "hiii", "byeee", "pyaaar".
+    When lists overlap the one given first wins (so filler goes last and
+    "who made you" beats "who"); within a list the longer phrase wins.
+    """
+
+    def __init__(self, groups: dict):
+        branches = []
+        for name, phrases in groups.items():
+            alternatives = [self._pattern(p) for p in sorted(set(phrases), key=len, reverse=True)]
+            branches.append(f"(?P<{name}>{'|'.join(alternatives)})")
+        self.regex = re.compile(
+            rf"(?<!{WORD_CHAR})(?:{'|'.join(branches)})(?!{WORD_CHAR})|(?P<word>{WORD_CHAR}+)"
+        )
+
+    @staticmethod
+    def _pattern(phrase: str) -> str:
+        # every letter may be stretched ("pyaar" -> p+y+a+r+); "what s" also matches "what's"
+        return r"\W+".join(
+            "".join(f"{re.escape(ch)}+" for ch, _ in groupby(word)) for word in phrase.split()
+        )
+
+    def scan(self, text: str) -> dict:
+        """Words per matched list, plus ``words``: every word in the text."""
+        found = {"words": 0}
+        for match in self.regex.finditer(text.lower()):
+            size = 1 if match.lastgroup == "word" else len(WORD.findall(match.group()))
+            found["words"] += size
+            if match.lastgroup != "word":
+                found[match.lastgroup] = found.get(match.lastgroup, 0) + size
+        return found
+
+
+keywords = KeywordClassifier({
+    "abuse": ABUSIVE_WORDS,
+    **INTENT_PHRASES,
+    **EMOTION_WORDS,
+    "cat": CAT_CALLS,
+    "filler": INTENT_FILLER,
+})
+
+
+@lru_cache(maxsize=512)
+def read_message(text: str) -> dict:
+    """``keywords.scan`` of a message, shared by the abuse check, mood and AI stages. Don't modify."""
+    return keywords.scan(text)
+
+
 # ================= WEATHER DATA =================
 WEATHER_DATA = {
     "mumbai": {"temp": "32°C", "condition": "Sunny ☀️", "humidity": "65%"},
@@ -1365,51 +4379,39 @@ WEATHER_DATA = {
 
 # ================= HELPERS =================
 def get_emotion(emotion_type: str = None, user_id: int = None):
-    if user_id and user_id in user_emotions:
-        emotion_type = user_emotions[user_id]
+    mood = memory.get("mood", user_id) if user_id else None
+    if mood:
+        emotion_type = mood
     if emotion_type in EMOTIONAL_RESPONSES:
         return random.choice(EMOTIONAL_RESPONSES[emotion_type])
     return random.choice(random.choice(list(EMOTIONAL_RESPONSES.values())))
 
 
 def update_user_emotion(user_id: int, message: str):
-    message_lower = message.lower()
-    if any(w in message_lower for w in ['love', 'pyaar', 'dil']):
-        user_emotions[user_id] = "love"
-    elif any(w in message_lower for w in ['angry', 'gussa', 'naraz']):
-        user_emotions[user_id] = "angry"
-    elif any(w in message_lower for w in ['cry', 'sad', 'dukh']):
-        user_emotions[user_id] = "crying"
-    elif any(w in message_lower for w in ['funny', 'lol', 'joke']):
-        user_emotions[user_id] = "funny"
-    elif any(w in message_lower for w in ['hi', 'hello', 'hey']):
-        user_emotions[user_id] = "happy"
-    else:
-        user_emotions[user_id] = "thinking"
-    user_last_interaction[user_id] = datetime.now()
+    found = read_message(message)
+    memory.set("mood", user_id, next((mood for group, mood in EMOTION_ORDER if group in found), "thinking"))
 
 
 def contains_abuse(text: str):
-    t = text.lower()
-    return any(re.search(rf"\b{w}\b", t) for w in ABUSIVE_WORDS)
+    return "abuse" in read_message(text)
 
 
 # ================= WORD CHAIN GAME =================
 def start_word_game(user_id: int):
     start_word = random.choice(WORD_STARTS)
-    game_sessions[user_id] = {
+    memory.set("game", user_id, {
         "last_word": start_word.lower(),
         "last_letter": start_word[-1].lower(),
         "score": 0,
         "words_used": [start_word.lower()],
-    }
+    })
     return start_word
 
 
 def check_word_game(user_id: int, user_word: str):
-    if user_id not in game_sessions:
+    game = memory.get("game", user_id)
+    if game is None:
         return False, "No active game! Use /wordgame."
-    game = game_sessions[user_id]
     word = user_word.lower().strip()
     if not word.startswith(game["last_letter"]):
         return False, f"Word must start with '{game['last_letter'].upper()}'"
@@ -1421,6 +4423,7 @@ def check_word_game(user_id: int, user_word: str):
     game["last_word"] = word
     game["last_letter"] = word[-1]
     game["score"] += 10
+    memory.touch("game", user_id)
     return True, game
 
 
@@ -1469,58 +4472,143 @@ async def get_weather_info(city: str = None):
     )
 
 
-# ================= AI LOGIC WITH GROQ =================
-async def get_ai_response(chat_id: int, user_text: str, user_id: int = None) -> str:
-    # Initialize chat memory
-    if chat_id not in chat_memory:
-        chat_memory[chat_id] = deque(maxlen=20)
-    chat_memory[chat_id].append({"role": "user", "content": user_text})
-    
-    if user_id:
-        update_user_emotion(user_id, user_text)
-    
-    user_text_lower = user_text.lower()
+# ================= LOCAL INTENTS =================
+AI_INTENT_THRESHOLD = float(os.getenv("AI_INTENT_THRESHOLD", "0.9"))  # >1 = always ask the AI
+
+INTENT_RESPONSES = {
+    "owner": [
+        f"Mere owner {OWNER_NAME} hain ({OWNER_USERNAME}) 👑",
+        f"{OWNER_NAME} ({OWNER_USERNAME}) ne mujhe paala hai, wahi mere hooman hain",
+        f"Boss? {OWNER_NAME} {OWNER_USERNAME}, aur kaun! 😼",
+    ],
+    "name": [
+        f"Mera naam {BOT_NAME} hai! 🐾",
+        f"{BOT_NAME} bolte hain mujhe, yaad rakhna",
+        f"Main {BOT_NAME}, is chat ki sabse cute billi",
+    ],
+    "greeting": QUICK_RESPONSES["greeting"],
+    "goodbye": QUICK_RESPONSES["goodbye"],
+    "thanks": QUICK_RESPONSES["thanks"],
+    "sorry": QUICK_RESPONSES["sorry"],
+}
+INTENT_MOODS = {"owner": "love", "name": "happy", "greeting": "happy", "thanks": "love", "sorry": "crying"}
+
+
+class IntentEngine:
+    """Answers the questions that don't need a model: owner, name, time, hello/bye.
+
+    Confidence is the share of the message's words explained by the intent
+    plus filler, cat calls and greetings (so "hi meow, naam kya hai?" still
+    counts as a name question); the words come from ``read_message``. At or
+    above ``threshold`` we reply from the template bank; below it the
+    message goes to the AI as before.
+    """
+
+    SOFT = ("filler", "cat")
+
+    def __init__(self, names, threshold: float):
+        self.threshold = threshold
+        self.names = list(names)
+        self.checked = 0
+        self.hits = {intent: 0 for intent in self.names}
+        self.near = 0      # some intent matched, but not confidently
+        self.spent_ns = 0  # total time in classify()
+
+    def classify(self, text: str):
+        """``(intent, confidence)``; intent is None when nothing matched."""
+        return self.pick(read_message(text))
+
+    def pick(self, found: dict):
+        soft = sum(found.get(group, 0) for group in self.SOFT)
+        best, confidence = None, 0.0
+        for intent in self.names:
+            if intent not in found:
+                continue
+            share = (found[intent] + soft + (found.get("greeting", 0) if intent != "greeting" else 0)) / found["words"]
+            if share > confidence:
+                best, confidence = intent, share
+        return best, confidence
+
+    def respond(self, intent: str, user_id: int = None) -> str:
+        if intent == "time":
+            return get_time_info().replace("*", "")
+        return f"{get_emotion(INTENT_MOODS.get(intent), user_id)} {random.choice(INTENT_RESPONSES[intent])}"
+
+    def answer(self, text: str, user_id: int = None):
+        """Templated reply when confident, else None (ask the AI). Counted in stats."""
+        started = time.perf_counter_ns()
+        intent, confidence = self.classify(text)
+        self.spent_ns += time.perf_counter_ns() - started
+        self.checked += 1
+        if intent is None:
+            return None
+        if confidence < self.threshold:
+            self.near += 1
+            return None
+        self.hits[intent] += 1
+        return self.respond(intent, user_id)
+
+    def is_local(self, text: str) -> bool:
+        intent, confidence = self.classify(text)
+        return intent is not None and confidence >= self.threshold
+
+    def replay(self, corpus, thresholds=(0.5, 0.6, 0.75, 0.9, 1.0)):
+        """Provider calls a message corpus would have saved, per threshold (nothing counted)."""
+        started = time.perf_counter_ns()
+        results = [self.pick(keywords.scan(text)) for text in corpus]  # uncached, to time the scan
+        spent = time.perf_counter_ns() - started
+        by_intent = {}
+        for intent, confidence in results:
+            if intent is not None and confidence >= self.threshold:
+                by_intent[intent] = by_intent.get(intent, 0) + 1
+        return {
+            "messages": len(results),
+            "us_per_msg": spent / 1000 / len(results) if results else 0.0,
+            "by_intent": by_intent,
+            "saved": {
+                t: sum(1 for intent, confidence in results if intent is not None and confidence >= t)
+                for t in thresholds
+            },
+        }
 
-    # ================= QUICK SOFT TRIGGERS (NO FIXED ANSWER) =================
-    cat_called = any(
-        w in user_text_lower
-        for w in [
-            "meowstric", "meow", "billi", "bilii", "cat"
-        ]
-    )
+    def stats(self):
+        hits = sum(self.hits.values())
+        return {
+            "checked": self.checked,
+            "hits": hits,
+            "near": self.near,
+            "hit_rate": hits / self.checked if self.checked else 0.0,
+            "by_intent": dict(self.hits),
+            "avg_us": self.spent_ns / 1000 / self.checked if self.checked else 0.0,
+        }
 
-    owner_asked = any(
-        q in user_text_lower
-        for q in [
-            "owner", "maalik", "malik", "tumhara owner",
-            "who is your owner", "baap papa kaun", "creator kaun"
-        ]
-    )
 
-    name_asked = any(
-        n in user_text_lower
-        for n in [
-            "tumhara naam", "tera naam", "your name",
-            "naam kya hai", "name kya hai"
-        ]
-    )
+intents = IntentEngine(INTENT_PHRASES, AI_INTENT_THRESHOLD)
 
-    # Quick responses
-    if any(word in user_text_lower for word in ['hi', 'hello', 'hey', 'namaste', 'hola']):
-        if random.random() < 0.4:
-            return f"{get_emotion('happy', user_id)} {random.choice(QUICK_RESPONSES['greeting'])}"
 
-    if any(word in user_text_lower for word in ['bye', 'goodbye', 'tata', 'alvida', 'see you']):
-        if random.random() < 0.4:
-            return f"{get_emotion()} {random.choice(QUICK_RESPONSES['goodbye'])}"
+# ================= AI LOGIC WITH GROQ =================
+AI_PARAMS = {"temperature": 0.9, "max_tokens": 120, "top_p": 0.9}
+AI_REPLY_LIMIT = 300
+
 
-    if any(word in user_text_lower for word in ['thanks', 'thank you', 'dhanyavad', 'shukriya']):
-        if random.random() < 0.4:
-            return f"{get_emotion('love', user_id)} {random.choice(QUICK_RESPONSES['thanks'])}"
+def prepare_ai_chat(chat_id: int, user_text: str, user_id: int = None):
+    """``(quick reply, None)`` when no AI call is needed, else ``(None, messages for Groq)``."""
+    remember(chat_id, "user", user_text)
+    
+    if user_id:
+        update_user_emotion(user_id, user_text)
+    
+    # ================= QUICK SOFT TRIGGERS (NO FIXED ANSWER) =================
+    found = read_message(user_text)
+    cat_called = "cat" in found
+    owner_asked = "owner" in found
+    name_asked = "name" in found
 
-    if any(word in user_text_lower for word in ['sorry', 'maaf', 'apology']):
-        if random.random() < 0.4:
-            return f"{get_emotion('crying')} {random.choice(QUICK_RESPONSES['sorry'])}"
+    # Owner / name / time / hello-bye: answered from templates, no AI call
+    local = intents.answer(user_text, user_id)
+    if local:
+        remember(chat_id, "assistant", local)
+        return local, None
 
     # ================= SYSTEM PROMPT =================
     indian_time = get_indian_time()
@@ -1551,7 +4639,8 @@ async def get_ai_response(chat_id: int, user_text: str, user_id: int = None) ->
             "Answer confidently like a living cat character. "
         )
 
-    if user_id and user_id in user_emotions and user_emotions[user_id] == "angry":
+    mood = memory.get("mood", user_id) if user_id else None
+    if mood == "angry":
         system_prompt = (
             f"You are a Hinglish chatbot. User seems angry. "
             f"Try to calm them down. Be extra polite and understanding. "
@@ -1560,7 +4649,7 @@ async def get_ai_response(chat_id: int, user_text: str, user_id: int = None) ->
             f"{extra_context}"
         )
 
-    elif user_id and user_id in user_emotions and user_emotions[user_id] == "crying":
+    elif mood == "crying":
         system_prompt = (
             f"You are a Hinglish chatbot. User seems sad or crying. "
             f"Comfort them. Be empathetic and kind. "
@@ -1593,39 +4682,73 @@ async def get_ai_response(chat_id: int, user_text: str, user_id: int = None) ->
 
     # Prepare messages for Groq
     messages = [{"role": "system", "content": system_prompt}]
-    for msg in list(chat_memory[chat_id])[-5:]:
-        messages.append(msg)
+    messages += chat_log(chat_id).messages(5)
 
-    # Call Groq API
-    try:
-        if not client:
-            return f"{get_emotion('thinking')} AI service unavailable. Please try later!"
-
-        completion = await client.chat.completions.create(
-            model="llama-3.3-70b-versatile",
-            messages=messages,
-            temperature=0.9,
-            max_tokens=120,
-            top_p=0.9
-        )
+    return None, messages
 
-        ai_reply = completion.choices[0].message.content
-        ai_reply = f"{get_emotion(None, user_id)} {ai_reply}"
 
-        if len(ai_reply) > 300:
-            ai_reply = ai_reply[:297] + "..."
+def finish_ai_reply(chat_id: int, ai_reply: str) -> str:
+    """Clip to ``AI_REPLY_LIMIT`` and remember it as the bot's turn."""
+    if len(ai_reply) > AI_REPLY_LIMIT:
+        ai_reply = ai_reply[:AI_REPLY_LIMIT - 3] + "..."
 
-        chat_memory[chat_id].append({"role": "assistant", "content": ai_reply})
-        return ai_reply
+    remember(chat_id, "assistant", ai_reply)
+    return ai_reply
 
-    except Exception:
-        fallback_responses = [
-            f"{get_emotion('crying')} Arre yaar, dimaag kaam nahi kar raha! Thoda ruk ke try karna?",
-            f"{get_emotion('thinking')} Hmm... yeh to mushkil ho gaya. Phir se poocho?",
-            f"{get_emotion('angry')} AI bhai mood off hai aaj! Baad me baat karte hain!",
-            f"{get_emotion()} Oops! Connection issue. Kuch aur poocho?"
-        ]
-        return random.choice(fallback_responses)
+
+async def get_ai_response(chat_id: int, user_text: str, user_id: int = None) -> str:
+    quick, messages = prepare_ai_chat(chat_id, user_text, user_id)
+    if quick:
+        return quick
+
+    # Call Groq API (through the gateway)
+    try:
+        ai_reply = await ai_gateway.complete(messages, **AI_PARAMS)
+        return finish_ai_reply(chat_id, f"{get_emotion(None, user_id)} {ai_reply}")
+    except AIUnavailable as e:
+        return ai_fallback(e)
+
+
+async def stream_ai_response(chat_id: int, user_text: str, user_id: int = None):
+    """Like ``get_ai_response``, but yields the reply so far as tokens stream in.
+
+    Every value is ``(text, streamed)``: the full text to show (emotion
+    prefix included) and whether it came from the provider rather than a
+    template or fallback. The last one is the final, clipped reply.
+    """
+    quick, messages = prepare_ai_chat(chat_id, user_text, user_id)
+    if quick:
+        yield quick, False
+        return
+
+    prefix = get_emotion(None, user_id)
+    text = ""
+    try:
+        async with aclosing(ai_gateway.stream(messages, **AI_PARAMS)) as chunks:
+            async for chunk in chunks:
+                text += chunk
+                if len(prefix) + 1 + len(text) > AI_REPLY_LIMIT:
+                    break  # it gets clipped anyway, stop paying for tokens
+                yield f"{prefix} {text}", True
+    except AIUnavailable as e:
+        if not text:
+            yield ai_fallback(e), False
+            return
+        # provider died mid-reply: keep what already arrived
+
+    yield finish_ai_reply(chat_id, f"{prefix} {text}"), True
+
+
+def ai_fallback(error: AIUnavailable) -> str:
+    if error.reason == "disabled":
+        return f"{get_emotion('thinking')} AI service unavailable. Please try later!"
+    fallback_responses = [
+        f"{get_emotion('crying')} Arre yaar, dimaag kaam nahi kar raha! Thoda ruk ke try karna?",
+        f"{get_emotion('thinking')} Hmm... yeh to mushkil ho gaya. Phir se poocho?",
+        f"{get_emotion('angry')} AI bhai mood off hai aaj! Baad me baat karte hain!",
+        f"{get_emotion()} Oops! Connection issue. Kuch aur poocho?"
+    ]
+    return random.choice(fallback_responses)
 
 
 # ================= BUTTONS =================
@@ -1656,7 +4779,8 @@ def games_buttons():
 
 # ================= START =================
 async def start_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text(
+    await reply(
+        update.message,
         f"😺 *Meow {update.effective_user.first_name}!* 🐾\n\n"
         f"Welcome to *{BOT_NAME}* ✨\n"
         f"Your fun + games + catverse buddy 😼\n\n"
@@ -1665,15 +4789,6 @@ async def start_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         reply_markup=main_buttons()
     )
 
-# ================= CHAT =================
-async def chat_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.effective_user.id
-
-    if update.effective_chat.type == "private" and not dm_enabled_users.get(user_id, True):
-        return
-
-    await update.message.reply_text("😼 Meow! Main sun raha hoon...")
-
 # ================= BUTTON HANDLER =================
 async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
@@ -1681,23 +4796,27 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     data = q.data
 
     if data == "toggle_dm":
-        dm_enabled_users[user_id] = not dm_enabled_users.get(user_id, True)
-        status = "ON 😺" if dm_enabled_users[user_id] else "OFF 😴"
-        await q.message.edit_text(
+        enabled = not await dm_enabled(user_id)
+        await set_dm_enabled(q.from_user, enabled)
+        status = "ON 😺" if enabled else "OFF 😴"
+        await edit(
+            q.message,
             f"💬 *DM Mode Updated!*\n\nChat mode: **{status}** 🐾",
             parse_mode="Markdown",
             reply_markup=main_buttons()
         )
 
     elif data == "open_games":
-        await q.message.edit_text(
+        await edit(
+            q.message,
             "🎮 *Game Zone* 😼\nChoose one 👇",
             parse_mode="Markdown",
             reply_markup=games_buttons()
         )
 
     elif data == "open_catverse":
-        await q.message.edit_text(
+        await edit(
+            q.message,
             "🐱 *CATVERSE GUIDE*\n\n"
             "Click on /games\n\n"
             "💰 /daily (DM), /claim (1000+ grp), /bal, /give\n"
@@ -1712,7 +4831,8 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
 
     elif data == "open_admin":
-        await q.message.edit_text(
+        await edit(
+            q.message,
             "🛡️ *ADMIN COMMANDS*\n\n"
             "Reply to user message:\n"
             "• /kick\n• /ban\n• /mute\n• /unmute\n• /unban\n\n"
@@ -1722,19 +4842,19 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
 
     elif data == "game_fun":
-        await q.message.edit_text("😊 Fun coming soon 😸", reply_markup=games_buttons())
+        await edit(q.message, "😊 Fun coming soon 😸", reply_markup=games_buttons())
 
     elif data == "game_weather":
-        await q.message.edit_text("🌤️ Use:\n/weather city", reply_markup=games_buttons())
+        await edit(q.message, "🌤️ Use:\n/weather city", reply_markup=games_buttons())
 
     elif data == "game_time":
-        await q.message.edit_text("🕒 Use:\n/time or /date", reply_markup=games_buttons())
+        await edit(q.message, "🕒 Use:\n/time or /date", reply_markup=games_buttons())
 
     elif data == "game_word":
-        await q.message.edit_text("🎮 Start with:\n/wordgame", reply_markup=games_buttons())
+        await edit(q.message, "🎮 Start with:\n/wordgame", reply_markup=games_buttons())
 
     elif data == "back_main":
-        await q.message.edit_text("😺 Main Menu 🐾", reply_markup=main_buttons())
+        await edit(q.message, "😺 Main Menu 🐾", reply_markup=main_buttons())
 
     await q.answer()
 
@@ -1749,38 +4869,140 @@ async def welcome_new_member(update: Update, context: ContextTypes.DEFAULT_TYPE)
             f"🌟 Aao ji {member.first_name}! Group me welcome! 🫂",
             f"✨ Hey {member.first_name}! Great to have you here! 💖"
         ]
-        await context.bot.send_message(update.effective_chat.id, random.choice(messages))
+        await send(context.bot, update.effective_chat.id, random.choice(messages))
+
+# ================= MESSAGE PIPELINE =================
+class TextMessage:
+    """State shared by every pipeline stage for one incoming text message."""
+
+    def __init__(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        self.update = update
+        self.context = context
+        self.message = update.message
+        self.user = update.effective_user
+        self.chat = update.effective_chat
+        self.text = update.message.text
+        self.now = time.time()
+        self.cat = None
+        self.earns_xp = True
+
+        # Bot mention / reply logic
+        bot = context.bot
+        bot_username = bot.username
+        reply_to = self.message.reply_to_message
+        self.is_mention = bool(bot_username) and f"@{bot_username}" in self.text
+        self.is_reply_to_bot = bool(reply_to and reply_to.from_user and reply_to.from_user.id == bot.id)
+        self.addressed = self.chat.type == Chat.PRIVATE or self.is_mention or self.is_reply_to_bot
+
+        self.clean_text = self.text
+        if self.is_mention:
+            self.clean_text = self.text.replace(f"@{bot_username}", "").strip()
+
+
+async def membership_stage(msg) -> bool:
+    # group boards: remember this cat is active here (memory only, flushed in batches)
+    if msg.chat.type in (ChatType.GROUP, ChatType.SUPERGROUP):
+        group_boards.seen(msg.chat.id, msg.cat)
+    return False
+
+
+async def abuse_stage(msg) -> bool:
+    # Only messages meant for the bot get a warning instead of an AI reply
+    if msg.addressed and contains_abuse(msg.clean_text):
+        await reply(msg.message, f"{get_emotion('angry')} {random.choice(SOFT_WARNINGS)}")
+        return True
+    return False
+
+
+AI_STREAM = os.getenv("AI_STREAM", "1") == "1"
+AI_STREAM_EDIT_INTERVAL = float(os.getenv("AI_STREAM_EDIT_INTERVAL", "1.5"))  # seconds between progressive edits
+
+# seconds from the user's message to the first text of our reply on screen
+ai_first_text = {"stream": deque(maxlen=500), "full": deque(maxlen=500)}
+
+
+async def stream_reply(msg):
+    """Send the first streamed text right away, then edit it as more arrives.
+
+    At most one edit is in flight and a new one starts only every
+    AI_STREAM_EDIT_INTERVAL; the outbox chat buckets throttle on top.
+    """
+    sent = None
+    shown = text = ""
+    pending = None
+    last_edit = 0.0
+
+    async with aclosing(stream_ai_response(msg.chat.id, msg.clean_text, msg.user.id)) as replies:
+        async for text, streamed in replies:
+            if sent is None:
+                sent = await reply(msg.message, text)
+                if streamed:  # templates and fallbacks would flatter the provider's numbers
+                    ai_first_text["stream"].append(time.time() - msg.now)
+                shown, last_edit = text, time.monotonic()
+            elif (text != shown and (pending is None or pending.done())
+                  and time.monotonic() - last_edit >= AI_STREAM_EDIT_INTERVAL):
+                pending = asyncio.ensure_future(edit(sent, text))
+                shown, last_edit = text, time.monotonic()
+
+    if pending is not None:
+        try:
+            await pending
+        except Exception:
+            pass
+    if sent is not None and text != shown:
+        await edit(sent, text)
 
-# ================= CHAT HANDLER WITH MENTION & PRIVATE =================
-async def chat_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    message = update.message
-    user_id = message.from_user.id
-    chat_id = message.chat.id
-    bot = context.bot
-    user_text = message.text
+
+async def ai_reply_stage(msg) -> bool:
+    if not msg.addressed:
+        return True
 
     # Check DM toggle
-    if message.chat.type == Chat.PRIVATE and not dm_enabled_users.get(user_id, True):
-        return
+    if msg.chat.type == Chat.PRIVATE and not await dm_enabled(msg.user.id):
+        return True
+
+    # template answers go out at once: no typing, no pretend delay
+    local = intents.is_local(msg.clean_text)
+    if not local:
+        await msg.context.bot.send_chat_action(msg.chat.id, "typing")
+    if AI_STREAM:
+        await stream_reply(msg)
+        return True
+
+    # Typing simulation
+    if not local:
+        await asyncio.sleep(random.uniform(0.5, 1.5))
 
-    # Bot mention / reply logic
-    bot_username = (await bot.get_me()).username
-    is_mention = f"@{bot_username}" in user_text if bot_username else False
-    is_reply_to_bot = message.reply_to_message and message.reply_to_message.from_user.id == bot.id
-    should_respond = message.chat.type == "private" or is_mention or is_reply_to_bot
+    # AI reply
+    response = await get_ai_response(msg.chat.id, msg.clean_text, msg.user.id)
+    await reply(msg.message, response)
+    if not local:
+        ai_first_text["full"].append(time.time() - msg.now)
+    return True
+
+
+MESSAGE_PIPELINE = [
+    membership_stage,
+    xp_cooldown_stage,
+    xp_dna_stage,
+    level_stage,
+    bonus_stage,
+    abuse_stage,
+    ai_reply_stage,
+]
 
-    if should_respond:
-        clean_text = user_text
-        if bot_username and f"@{bot_username}" in clean_text:
-            clean_text = clean_text.replace(f"@{bot_username}", "").strip()
 
-        # Typing simulation
-        await bot.send_chat_action(chat_id, "typing")
-        await asyncio.sleep(random.uniform(0.5, 1.5))
+async def chat_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Single entry point for plain text: one cat load, writes batched by the cache."""
+    if not update.message or not update.message.text or not update.effective_user:
+        return
 
-        # AI reply
-        response = await get_ai_response(chat_id, clean_text, user_id)
-        await message.reply_text(response)
+    msg = TextMessage(update, context)
+    msg.cat = await get_cat(msg.user)
+
+    for stage in MESSAGE_PIPELINE:
+        if await stage(msg):
+            break
 
 # --- ADMIN COMMANDS IMPROVED (REPLY + @USERNAME) ---
 
@@ -1811,7 +5033,7 @@ async def admin_commands(update: Update, context: ContextTypes.DEFAULT_TYPE):
             f"{get_emotion()} Reply to user's message first! 📩",
             f"{get_emotion('angry')} Bhai kisko? Reply karo na! 😠"
         ]
-        await message.reply_text(random.choice(responses))
+        await reply(message, random.choice(responses))
         return
 
     cmd = message.text.split()[0][1:]  # Remove '/'
@@ -1825,7 +5047,7 @@ async def admin_commands(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 f"{get_emotion()} Bye bye {target_user.first_name}! 👋",
                 f"{get_emotion('happy')} {target_user.first_name} removed! 🚪"
             ]
-            await message.reply_text(random.choice(responses))
+            await reply(message, random.choice(responses))
 
         elif cmd == "ban":
             await bot.ban_chat_member(message.chat.id, target_user.id)
@@ -1834,7 +5056,7 @@ async def admin_commands(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 f"{get_emotion()} Permanent ban for {target_user.first_name}! 🔨",
                 f"{get_emotion('crying')} Sorry {target_user.first_name}, rules are rules! 😔"
             ]
-            await message.reply_text(random.choice(responses))
+            await reply(message, random.choice(responses))
 
         elif cmd == "mute":
             mute_until = datetime.now() + timedelta(hours=1)
@@ -1858,7 +5080,7 @@ async def admin_commands(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 f"{get_emotion('thinking')} {target_user.first_name} ko chup kara diya! 🤫",
                 f"{get_emotion('angry')} {target_user.first_name}, ab 1 ghante tak bolna band! ⚠️"
             ]
-            await message.reply_text(random.choice(responses))
+            await reply(message, random.choice(responses))
 
         elif cmd == "unmute":
             await bot.restrict_chat_member(
@@ -1880,11 +5102,12 @@ async def admin_commands(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 f"{get_emotion()} {target_user.first_name} ab bol sakta hai! 🎤",
                 f"{get_emotion('funny')} {target_user.first_name}, ab bol lo! 😄"
             ]
-            await message.reply_text(random.choice(responses))
+            await reply(message, random.choice(responses))
 
         elif cmd == "unban":
             await bot.unban_chat_member(message.chat.id, target_user.id)
-            await message.reply_text(
+            await reply(
+                message,
                 f"{get_emotion('happy')} {target_user.first_name} unbanned! 🐾"
             )
 
@@ -1894,7 +5117,7 @@ async def admin_commands(update: Update, context: ContextTypes.DEFAULT_TYPE):
             f"{get_emotion('angry')} Make me admin first! 👑",
             f"{get_emotion('thinking')} Can't do that! Need admin rights! 🔒"
         ]
-        await message.reply_text(random.choice(error_responses))
+        await reply(message, random.choice(error_responses))
 
 # ================= HELPERS =================
 def is_admin(user_id: int) -> bool:
@@ -1902,17 +5125,18 @@ def is_admin(user_id: int) -> bool:
 
 async def log(context, text):
     """Log messages to the logger group."""
-    await context.bot.send_message(
-        LOGGER_GROUP_ID, text, parse_mode="Markdown"
+    await send(
+        context.bot, LOGGER_GROUP_ID, text,
+        priority=PRIORITY_LOG, merge_key="log", parse_mode="Markdown"
     )
 
 # ================= START =================
 async def plp(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
-    existing = users.find_one({"_id": user.id})
+    existing = await users.find_one({"_id": user.id})
 
     # Insert a new user if not already present
-    users.update_one(
+    await users.update_one(
         {"_id": user.id},
         {"$setOnInsert": {
             "name": user.first_name,
@@ -1956,7 +5180,7 @@ async def member_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         # Update group member count and log the action
         count = await context.bot.get_chat_member_count(chat.id)
-        groups.update_one(
+        await groups.update_one(
             {"_id": chat.id},
             {"$set": {"title": chat.title, "members": count, "privacy": group_privacy, "invite_link": invite_link}},
             upsert=True
@@ -1977,7 +5201,8 @@ async def member_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if old.status in (ChatMemberStatus.MEMBER, ChatMemberStatus.ADMINISTRATOR) and new.status in (
         ChatMemberStatus.LEFT, ChatMemberStatus.KICKED
     ):
-        groups.delete_one({"_id": chat.id})
+        await groups.delete_one({"_id": chat.id})
+        await group_boards.remove_group(chat.id)
         await log(
             context,
             f"😿 *Bot Removed*\n"
@@ -1991,67 +5216,391 @@ async def stats_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     # Get current user and group stats
-    u = users.count_documents({})
-    g = groups.count_documents({})
-    members = sum(x.get("members", 0) for x in groups.find())
-
-    await update.message.reply_text(
+    u = await users.count_documents({})
+    g = await groups.count_documents({})
+    totals = await groups.aggregate([{"$group": {"_id": None, "members": {"$sum": "$members"}}}])
+    members = totals[0]["members"] if totals else 0
+
+    cache = cat_cache.stats()
+    out = outbox.stats()
+    migration = await global_state.find_one({"_id": CAT_MIGRATION_ID}) or {}
+    protected = await count_protected()
+    boards = leaderboards.stats()
+    tracked = group_boards.stats()
+    ai = ai_gateway.stats()
+    local = intents.stats()
+    remembered = memory.stats()
+    namespaces = ", ".join(f"{ns} {n}" for ns, n in sorted(remembered["by_namespace"].items())) or "empty"
+    ai_errors = " ".join(f"{reason}: *{n}*" for reason, n in ai["errors"].items())
+    queued = " / ".join(str(n) for n in out["depth"].values())
+
+    await reply(
+        update.message,
         f"📊 *Catverse Stats* 😺\n\n"
         f"👤 Users: *{u}*\n"
         f"👥 Groups: *{g}*\n"
-        f"🐾 Members: *{members}*",
+        f"🐾 Members: *{members}*\n"
+        f"🛡 Protected now: *{protected}*\n\n"
+        f"🗃 Cat cache: *{cache['size']}* hot, *{cache['dirty']}* dirty\n"
+        f"🎯 Hit rate: *{cache['hit_rate']:.0%}* ({cache['hits']}/{cache['hits'] + cache['misses']})\n"
+        f"💾 Flushes: *{cache['flushes']}* | Writes: *{cache['writes']}* | "
+        f"Evictions: *{cache['evictions']}* | Reloads: *{cache['reloads']}*\n"
+        f"🏘 Group boards: *{tracked['writes']}* writes, *{tracked['pending']}* pending, "
+        f"*{boards['snapshots']}* boards + *{boards['pages']}* pages cached "
+        f"(page hits *{boards['page_hits']}*/{boards['page_hits'] + boards['page_misses']})\n"
+        f"⏱ Board build: global *{boards['global']['avg_ms']:.1f}* / *{boards['global']['max_ms']:.1f} ms*, "
+        f"group *{boards['group']['avg_ms']:.1f}* / *{boards['group']['max_ms']:.1f} ms* (avg / max)\n"
+        f"🧠 Memory: *{remembered['entries']}* entries ({namespaces}), "
+        f"*{remembered['bytes'] / 2 ** 20:.1f}*/{MEMORY_MAX_BYTES / 2 ** 20:.0f} MB | "
+        f"evicted idle *{remembered['evictions']['idle']}*, full *{remembered['evictions']['entries']}*, "
+        f"bytes *{remembered['evictions']['bytes']}*\n"
+        f"🧬 Schema v{CAT_SCHEMA_VERSION}: *{migration.get('state', 'pending')}*, "
+        f"*{migration.get('remaining', '?')}* old cats left\n\n"
+        f"📤 Outbox queued (reply/notify/log/bulk): *{queued}*\n"
+        f"⏱ Wait: *{out['avg_wait']:.2f}s* avg, *{out['max_wait']:.2f}s* max\n"
+        f"📨 Sent: *{out['sent']}* | Failed: *{out['failed']}* | Retried: *{out['retries']}*\n"
+        f"🗑 Dropped: *{out['dropped']}* | Merged: *{out['merged']}*\n\n"
+        f"🤖 AI breaker: *{ai['state']}* (tripped {ai['trips']}x) | In flight: *{ai['in_flight']}*\n"
+        f"✅ OK: *{ai['ok']}*/{ai['requests']} | p50 *{ai['p50']:.2f}s* p95 *{ai['p95']:.2f}s*\n"
+        f"⚠️ {ai_errors}\n"
+        f"🪁 Hedged: *{ai['hedges']}* (won {ai['hedge_wins']})\n"
+        f"👀 First text p50/p95: stream *{percentile(ai_first_text['stream'], 0.5):.2f}*/"
+        f"*{percentile(ai_first_text['stream'], 0.95):.2f}s*, "
+        f"full *{percentile(ai_first_text['full'], 0.5):.2f}*/*{percentile(ai_first_text['full'], 0.95):.2f}s*\n"
+        f"⚡ Local answers: *{local['hits']}*/{local['checked']} (*{local['hit_rate']:.0%}* AI calls saved), "
+        f"*{local['near']}* near misses, *{local['avg_us']:.0f} µs* avg",
         parse_mode="Markdown"
     )
 
-# ================= USER BROADCAST =================
-async def ubroadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
+
+async def economy(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/economy [days] - coins minted and burned per reason, from the daily ledger totals."""
     if not is_admin(update.effective_user.id):
         return
 
-    if not context.args:
-        await update.message.reply_text("😾 Message missing!")
+    try:
+        days = max(1, min(int(context.args[0]), 90)) if context.args else 7
+    except ValueError:
+        return await reply(update.message, "❗ Use like: /economy <days>")
+
+    since = (datetime.now(timezone.utc) - timedelta(days=days - 1)).strftime("%Y-%m-%d")
+    rows = await ledger_daily.find({"_id": {"$gte": since}})
+
+    reasons = {}
+    for row in rows:
+        totals = reasons.setdefault(row["reason"], {"minted": 0, "burned": 0, "events": 0})
+        for key in totals:
+            totals[key] += row.get(key, 0)
+
+    minted = sum(t["minted"] for t in reasons.values())
+    burned = sum(t["burned"] for t in reasons.values())
+    lines = [
+        f"📒 *Economy, last {days} day(s)*\n",
+        f"🪙 Minted: *${minted}* | 🔥 Burned: *${burned}* | 📈 Net: *${minted - burned:+}*\n",
+    ]
+    for reason, t in sorted(reasons.items(), key=lambda r: r[1]["minted"] - r[1]["burned"], reverse=True):
+        lines.append(f"• `{reason}`: +{t['minted']} / -{t['burned']} ({t['events']} events)")
+
+    stats = ledger.stats()
+    drifting = await ledger_balances.count_documents({"drift": {"$ne": 0}})
+    lines += [
+        "",
+        f"🧾 Ledger: *{stats['written']}* written, *{stats['buffered']}* buffered, *{stats['dropped']}* dropped",
+        f"⚖️ Cats drifting from the ledger: *{drifting}*",
+    ]
+    await reply(update.message, "\n".join(lines), parse_mode="Markdown")
+
+
+async def codec_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/codec - bytes per cat in each encoding (synthetic 1M dataset, live sample) and in memory."""
+    if not is_admin(update.effective_user.id):
+        return
+
+    sample = [synthetic_cat(i) for i in range(1000)]
+    synthetic = codec_report(sample)
+    mem_report = memory_report(sample)
+    total = await cats.count_documents({})
+    live_docs = await cats.aggregate([{"$sample": {"size": 1000}}])
+    live = codec_report(live_docs, scale=total)
+    reads = projection_report(live_docs or [encode_cat(decode_cat(doc)) for doc in sample])
+
+    def row(report, key, label):
+        size = report["per_doc"][key]
+        saved = report["saved_per_doc"].get(key)
+        diff = f" (-{saved:.0f})" if saved is not None else ""
+        return f"• {label}: *{size:.0f} B*{diff} → *{report['scaled_mb'][key]:.0f} MB*"
+
+    lines = [
+        "🧬 *Cat encoding, synthetic 1M cats*\n",
+        row(synthetic, "legacy", "Legacy"),
+        row(synthetic, "compact", "Compact"),
+        row(synthetic, "compact_short", "Compact + short keys"),
+        f"\n📦 *Live sample of {live['docs']} / {total} cats*\n",
+        row(live, "legacy", "Stored now"),
+        row(live, "compact", "Compact"),
+        row(live, "compact_short", "Compact + short keys"),
+        "\n🧠 *In memory, per cached cat*\n",
+        f"• dict: *{mem_report['dict']:.0f} B* → CatState: *{mem_report['model']:.0f} B* "
+        f"(cache of {CAT_CACHE_SIZE}: *{mem_report['dict'] * CAT_CACHE_SIZE / 2 ** 20:.1f}* → "
+        f"*{mem_report['model'] * CAT_CACHE_SIZE / 2 ** 20:.1f} MB*)",
+        "\n📐 *Bytes read per cat, whole doc → projection*\n",
+        *(f"• /{command}: {full:.0f} → *{projected:.0f} B*" for command, (full, projected) in reads.items()),
+        f"\n🔑 Active layout: *{'short' if CAT_SHORT_KEYS else 'long'}* keys, schema v{CAT_SCHEMA_VERSION}",
+    ]
+    await reply(update.message, "\n".join(lines), parse_mode="Markdown")
+
+async def intents_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/intents - replay the messages in chat memory through the local intent engine."""
+    if not is_admin(update.effective_user.id):
         return
 
-    text = " ".join(context.args)
-    sent = 0
+    corpus = [text for log in memory.values("chat") for text in log.user_texts()]
+    if not corpus:
+        return await reply(update.message, "🗒 No messages in chat memory yet.")
+
+    report = intents.replay(corpus)
+    live = intents.stats()
+    lines = [
+        f"⚡ *Local intents, replay of {report['messages']} messages*\n",
+        f"🎚 Threshold: *{intents.threshold:.2f}* (env `AI_INTENT_THRESHOLD`)",
+        f"⏱ Keyword scan: *{report['us_per_msg']:.1f} µs* per message "
+        f"(~{1e6 / report['us_per_msg'] if report['us_per_msg'] else 0:,.0f} msg/s)",
+        "",
+        *(f"• {intent}: *{n}*" for intent, n in sorted(report["by_intent"].items(), key=lambda r: -r[1])),
+        "",
+        "📉 AI calls saved per threshold:",
+        *(f"• {t:.2f}: *{n}* ({n / report['messages']:.0%})" for t, n in report["saved"].items()),
+        "",
+        f"🔴 Live: *{live['hits']}*/{live['checked']} answered locally, *{live['near']}* near misses",
+    ]
+    await reply(update.message, "\n".join(lines), parse_mode="Markdown")
+
+# ================= BROADCAST ENGINE =================
+
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "20"))
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "25"))  # msgs/sec, Telegram allows ~30
+BROADCAST_BATCH = int(os.getenv("BROADCAST_BATCH", "200"))
+BROADCAST_REPORT_EVERY = 15  # seconds between progress edits
+
+
+class BroadcastEngine:
+    """Background user/group broadcasts that resume after a restart.
+
+    Targets are walked in ``_id`` order one batch at a time. Each batch is sent
+    concurrently through the outbox's bulk lane, bounded by a semaphore and
+    a broadcast token bucket that leaves headroom for normal replies. Chats
+    that blocked or removed the bot are deleted with one ``delete_many``, and
+    the position is checkpointed in ``global_state``. A restart re-sends at
+    most the batch that was in flight.
+    """
+
+    def __init__(self, targets: dict, concurrency: int, rate: float, batch_size: int):
+        self.targets = targets  # kind -> (collection, prefix, label)
+        self.bucket = TokenBucket(rate)
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.batch_size = batch_size
+        self._tasks = {}
+
+    def running(self, kind: str) -> bool:
+        return kind in self._tasks
+
+    async def start(self, bot, kind: str, text: str, admin_chat_id: int):
+        label = self.targets[kind][2]
+        status = await send(bot, admin_chat_id, f"📣 {label} broadcast started...", priority=PRIORITY_REPLY)
+        job = {
+            "_id": f"broadcast:{kind}",
+            "type": "broadcast",
+            "kind": kind,
+            "text": text,
+            "admin_chat_id": admin_chat_id,
+            "status_message_id": status.message_id,
+            "last_id": None,
+            "sent": 0,
+            "failed": 0,
+            "removed": 0,
+            "started": datetime.now(timezone.utc),
+            "state": "running",
+        }
+        await global_state.update_one({"_id": job["_id"]}, {"$set": job}, upsert=True)
+        self._spawn(bot, job)
+
+    async def resume(self, bot):
+        for job in await global_state.find({"type": "broadcast", "state": "running"}):
+            if not self.running(job["kind"]):
+                logger.info("resuming %s broadcast after %s", job["kind"], job["last_id"])
+                self._spawn(bot, job)
+
+    async def stop(self):
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _spawn(self, bot, job):
+        kind = job["kind"]
+        task = asyncio.create_task(self._run(bot, job))
+        self._tasks[kind] = task
+        task.add_done_callback(lambda _: self._tasks.pop(kind, None))
+
+    async def _run(self, bot, job):
+        collection, prefix, label = self.targets[job["kind"]]
+        text = f"{prefix} {job['text']}"
+        started = time.monotonic()
+        sent_before = job["sent"]
+        last_report = started
+
+        try:
+            async for batch in collection.iterate_batches(
+                projection={"_id": 1}, batch_size=self.batch_size, after=job["last_id"]
+            ):
+                results = await asyncio.gather(*(self._deliver(bot, d["_id"], text) for d in batch))
+
+                dead = [d["_id"] for d, result in zip(batch, results) if result == "dead"]
+                if dead:
+                    await collection.delete_many({"_id": {"$in": dead}})
+
+                job["last_id"] = batch[-1]["_id"]
+                job["sent"] += results.count("sent")
+                job["failed"] += results.count("failed")
+                job["removed"] += len(dead)
+                await global_state.update_one(
+                    {"_id": job["_id"]},
+                    {"$set": {k: job[k] for k in ("last_id", "sent", "failed", "removed")}},
+                )
 
-    # Send the broadcast to all users in the database
-    for u in users.find():
+                if time.monotonic() - last_report >= BROADCAST_REPORT_EVERY:
+                    last_report = time.monotonic()
+                    rate = (job["sent"] - sent_before) / (last_report - started)
+                    await self._report(bot, job, f"📣 {label} broadcast running...", rate)
+        except Exception:
+            logger.exception("%s broadcast stopped at %s", job["kind"], job["last_id"])
+            raise
+
+        await global_state.update_one({"_id": job["_id"]}, {"$set": {"state": "done"}})
+        rate = (job["sent"] - sent_before) / max(time.monotonic() - started, 1e-6)
+        await self._report(bot, job, f"😺 {label} broadcast done", rate)
+
+    async def _deliver(self, bot, chat_id, text) -> str:
+        """Send once and classify the outcome; the outbox already retried any RetryAfter."""
+        async with self.semaphore:
+            await self.bucket.acquire()
+            try:
+                await send(bot, chat_id, text, priority=PRIORITY_BULK)
+                return "sent"
+            except RetryAfter as e:
+                self.bucket.pause(e.retry_after)  # still flooding after the outbox's retries: slow the rest
+                return "failed"
+            except Forbidden:
+                return "dead"  # blocked, kicked or deactivated
+            except BadRequest as e:
+                return "dead" if "chat not found" in e.message.lower() else "failed"
+            except TelegramError:
+                return "failed"
+
+    async def _report(self, bot, job, title, rate):
+        text = (
+            f"{title}\n"
+            f"✅ Sent: {job['sent']}\n"
+            f"⚠️ Failed: {job['failed']}\n"
+            f"🧹 Removed: {job['removed']}\n"
+            f"⚡ Speed: {rate:.1f} msg/s"
+        )
         try:
-            await context.bot.send_message(u["_id"], f"🐱 {text}")
-            sent += 1
-        except:
-            users.delete_one({"_id": u["_id"]})  # Cleanup dead users
+            await outbox.submit(
+                job["admin_chat_id"], text,
+                lambda t: bot.edit_message_text(
+                    t, chat_id=job["admin_chat_id"], message_id=job["status_message_id"]
+                ),
+                PRIORITY_LOG,
+            )
+        except TelegramError:
+            pass
 
-    await update.message.reply_text(f"😺 User broadcast done\nSent: {sent}")
 
-# ================= GROUP BROADCAST =================
-async def gbroadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
+broadcasts = BroadcastEngine(
+    {
+        "users": (users, "🐱", "User"),
+        "groups": (groups, "🐾", "Group"),
+    },
+    BROADCAST_CONCURRENCY,
+    BROADCAST_RATE,
+    BROADCAST_BATCH,
+)
+
+
+async def start_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE, kind: str):
     if not is_admin(update.effective_user.id):
         return
 
     if not context.args:
-        await update.message.reply_text("😾 Message missing!")
+        await reply(update.message, "😾 Message missing!")
+        return
+
+    if broadcasts.running(kind):
+        await reply(update.message, "⏳ A broadcast is already running, wait for it to finish!")
         return
 
-    text = " ".join(context.args)
-    sent = 0
+    await broadcasts.start(context.bot, kind, " ".join(context.args), update.effective_chat.id)
 
-    # Send the broadcast to all groups in the database
-    for g in groups.find():
-        try:
-            await context.bot.send_message(g["_id"], f"🐾 {text}")
-            sent += 1
-        except:
-            groups.delete_one({"_id": g["_id"]})  # Cleanup dead groups
+# ================= USER BROADCAST =================
+async def ubroadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await start_broadcast(update, context, "users")
 
-    await update.message.reply_text(f"😺 Group broadcast done\nSent: {sent}")
+# ================= GROUP BROADCAST =================
+async def gbroadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await start_broadcast(update, context, "groups")
 
     
 #  ================= MAIN =================
 
+async def run_cat_migration():
+    try:
+        await migrate_cats()
+    except Exception:
+        logger.exception("cat migration failed, it resumes on next start")
+
+
+async def post_init(app):
+    try:
+        await ensure_indexes()
+    except Exception:
+        if STRICT_INDEXES:
+            raise
+        logger.exception("index bootstrap failed")
+    cat_cache.start()
+    group_boards.start()
+    window_counters.start()
+    ledger.start()
+    app.bot_data["cat_migration"] = asyncio.create_task(run_cat_migration())
+    await broadcasts.resume(app.bot)
+
+
+async def post_shutdown(app):
+    migration = app.bot_data.get("cat_migration")
+    if migration is not None:
+        migration.cancel()
+    await broadcasts.stop()
+    await outbox.close()
+    await cat_cache.close()
+    await group_boards.close()
+    await window_counters.close()
+    await ledger.close()
+    db_executor.shutdown(wait=True)
+    mongo_client.close()
+
+
 def main():
-    app = ApplicationBuilder().token(BOT_TOKEN).build()
+    logging.basicConfig(format="%(asctime)s %(name)s %(levelname)s %(message)s", level=logging.INFO)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    app = (
+        ApplicationBuilder()
+        .token(BOT_TOKEN)
+        .concurrent_updates(True)  # DB calls are awaited, so let other chats run meanwhile
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
 
     app.add_handler(CommandHandler("games", games))
     app.add_handler(CommandHandler("xp", xp))
@@ -2072,6 +5621,7 @@ def main():
     app.add_handler(CommandHandler("toprich", toprich))
     app.add_handler(CommandHandler("topkill", topkill))
     app.add_handler(CallbackQueryHandler(leaderboard_callback, pattern="^lb_"))
+    app.add_handler(CallbackQueryHandler(leaderboard_page_callback, pattern="^lbp:"))
     app.add_handler(CommandHandler("shop", shop))
     app.add_handler(CommandHandler("inventory", inventory))
     app.add_handler(CallbackQueryHandler(shop_system, pattern="^shop:"))
@@ -2084,6 +5634,9 @@ def main():
     app.add_handler(ChatMemberHandler(welcome_new_member, ChatMemberHandler.CHAT_MEMBER))
     app.add_handler(CommandHandler("plp", plp))
     app.add_handler(CommandHandler("stats", stats_cmd))
+    app.add_handler(CommandHandler("economy", economy))
+    app.add_handler(CommandHandler("codec", codec_cmd))
+    app.add_handler(CommandHandler("intents", intents_cmd))
     app.add_handler(CommandHandler("ubroadcast", ubroadcast))
     app.add_handler(CommandHandler("gbroadcast", gbroadcast))
     app.add_handler(ChatMemberHandler(member_update))
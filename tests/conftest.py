@@ -0,0 +1,38 @@
+import asyncio
+import os
+import sys
+
+import mongomock
+import pytest
+
+os.environ.setdefault("BOT_TOKEN", "test")
+os.environ.setdefault("MONGO_URI", "mongodb://localhost:27017")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import catverse_bot as bot  # noqa: E402
+
+COLLECTIONS = [
+    "cats", "global_state", "leaderboard_history", "users", "groups", "economy_ledger",
+    "ledger_balances", "ledger_daily", "group_members", "window_scores",
+]
+
+
+class FakeUser:
+    def __init__(self, user_id, first_name="Cat"):
+        self.id = user_id
+        self.first_name = first_name
+        self.is_bot = False
+
+
+@pytest.fixture
+def db(monkeypatch):
+    """Every collection backed by a fresh in-memory mongomock database."""
+    mock = mongomock.MongoClient()["catverse"]
+    for name in COLLECTIONS:
+        monkeypatch.setattr(getattr(bot, name), "collection", mock[name])
+    return mock
+
+
+@pytest.fixture
+def run():
+    return lambda coro: asyncio.run(coro)
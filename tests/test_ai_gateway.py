@@ -0,0 +1,115 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import catverse_bot as bot
+
+
+def chunk(text):
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text))])
+
+
+class FakeStream:
+    def __init__(self, words, gap):
+        self.words = list(words)
+        self.gap = gap
+        self.closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self.words:
+            raise StopAsyncIteration
+        await asyncio.sleep(self.gap)
+        return chunk(self.words.pop(0))
+
+    async def close(self):
+        self.closed = True
+
+
+class FakeClient:
+    """Just enough of ``AsyncGroq`` for streamed completions."""
+
+    def __init__(self, words, gap=0.01):
+        self.words = words
+        self.gap = gap
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    async def create(self, model, messages, stream=False, **params):
+        return FakeStream(self.words, self.gap)
+
+
+def gateway(client, timeout=0.2):
+    return bot.AIGateway(client, "test-model", timeout, 4, bot.CircuitBreaker(1, 30))
+
+
+def test_slow_consumer_is_not_a_provider_timeout(run):
+    gw = gateway(FakeClient(["a ", "b ", "c"]), timeout=0.2)
+
+    async def scenario():
+        text = ""
+        async for piece in gw.stream([]):
+            text += piece
+            await asyncio.sleep(0.15)  # e.g. waiting on the outbox chat bucket
+        return text
+
+    assert run(scenario()) == "a b c"
+    stats = gw.stats()
+    assert stats["state"] == "closed" and stats["ok"] == 1
+    assert stats["errors"]["timeout"] == 0
+
+
+def test_slow_provider_still_times_out(run):
+    gw = gateway(FakeClient(["a ", "b ", "c"], gap=0.15), timeout=0.2)
+
+    async def scenario():
+        async for _ in gw.stream([]):
+            pass
+
+    with pytest.raises(bot.AIUnavailable) as e:
+        run(scenario())
+    assert e.value.reason == "timeout"
+    assert gw.stats()["state"] == "open"
+
+
+def test_closing_early_counts_as_success(run):
+    client = FakeClient(["a ", "b ", "c"])
+    gw = gateway(client)
+
+    async def scenario():
+        async with bot.aclosing(gw.stream([])) as pieces:
+            async for _ in pieces:
+                break
+
+    run(scenario())
+    stats = gw.stats()
+    assert stats["ok"] == 1 and stats["in_flight"] == 0
+
+
+def test_only_provider_replies_count_towards_stream_first_text(monkeypatch, run):
+    sent = []
+
+    async def reply(message, text, **kwargs):
+        sent.append(text)
+        return SimpleNamespace(text=text)
+
+    async def edit(message, text, **kwargs):
+        sent.append(text)
+
+    monkeypatch.setattr(bot, "reply", reply)
+    monkeypatch.setattr(bot, "edit", edit)
+    monkeypatch.setattr(bot, "ai_gateway", gateway(FakeClient(["meow ", "meow"], gap=0)))
+    monkeypatch.setitem(bot.ai_first_text, "stream", bot.deque(maxlen=500))
+
+    def msg(text):
+        return SimpleNamespace(chat=SimpleNamespace(id=-5), user=SimpleNamespace(id=42), clean_text=text,
+                               message=None, now=bot.time.time())
+
+    run(bot.stream_reply(msg("what time is it")))
+    assert sent and not bot.ai_first_text["stream"]  # template answer, no provider involved
+
+    run(bot.stream_reply(msg("tell me a story about fish")))
+    assert "meow meow" in sent[-1]
+    assert len(bot.ai_first_text["stream"]) == 1
@@ -0,0 +1,64 @@
+import asyncio
+import time
+
+import pytest
+
+import catverse_bot as bot
+from conftest import FakeUser
+
+LATENCY = 0.1  # injected per round trip
+
+
+class SlowCollection:
+    """mongomock collection where every call first waits ``LATENCY`` on the db thread."""
+
+    def __init__(self, collection):
+        self._collection = collection
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if not callable(attr):
+            return attr
+
+        def slow(*args, **kwargs):
+            time.sleep(LATENCY)
+            return attr(*args, **kwargs)
+        return slow
+
+
+@pytest.fixture
+def slow_cats(db, monkeypatch):
+    monkeypatch.setattr(bot.cats, "collection", SlowCollection(db["cats"]))
+    monkeypatch.setattr(bot, "cat_cache", bot.CatCache(bot.cats, bot.load_cat, 1000, 60, bot.load_partial_cat))
+
+
+def test_updates_keep_flowing_while_mongo_is_slow(slow_cats, run):
+    loads = 20
+
+    async def scenario():
+        hot = await bot.get_cat(FakeUser(1))
+        updates = 0
+        done = asyncio.Event()
+
+        async def chatter():
+            # a cached cat keeps taking updates while other handlers wait on Mongo
+            nonlocal updates
+            while not done.is_set():
+                bot.cat_inc(hot, "xp", 1)
+                updates += 1
+                await asyncio.sleep(0.005)
+
+        ticker = asyncio.ensure_future(chatter())
+        started = time.perf_counter()
+        await asyncio.gather(*[bot.get_cat(FakeUser(i)) for i in range(2, 2 + loads)])
+        elapsed = time.perf_counter() - started
+        done.set()
+        await ticker
+        return hot, updates, elapsed
+
+    hot, updates, elapsed = run(scenario())
+    serial = loads * LATENCY * 2  # a miss is find_one + insert_one
+    print(f"\n{loads} slow loads in {elapsed:.2f}s (serial {serial:.1f}s), {updates} updates meanwhile")
+    assert elapsed < serial / 4
+    assert updates >= elapsed / 0.005 / 4
+    assert hot["xp"] == updates
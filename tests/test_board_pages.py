@@ -0,0 +1,77 @@
+import random
+
+import pytest
+
+import catverse_bot as bot
+
+PAGE = bot.LEADERBOARD_PAGE_SIZE
+
+
+@pytest.fixture
+def board_db(db):
+    rng = random.Random(20)
+    cats = [{"_id": bot.OWNER_ID, "name": "Owner", "coins": float("inf"), "kills": 999}]
+    for i in range(1, 96):
+        # few distinct scores, so most pages break ties on the user id
+        cats.append({"_id": i, "name": f"Cat {i}", "coins": rng.choice([0, 50, 500, 500, 900]), "kills": rng.randint(0, 4)})
+    db["cats"].insert_many([bot.encode_cat(cat) for cat in cats])
+    db["group_members"].insert_many([
+        {"g": -7, "u": cat["_id"], "n": cat["name"], "c": bot.encode_value("coins", cat["coins"]), "k": cat["kills"]}
+        for cat in cats if cat["_id"] % 3
+    ])
+    db["group_members"].insert_one({"g": -8, "u": 1, "n": "Elsewhere", "c": 10 ** 6, "k": 0})
+    return db, cats
+
+
+def offset_ranking(cats, board, group=None):
+    field = bot.BOARDS[board][0]
+    rows = [c for c in cats if c["_id"] != bot.OWNER_ID and (group is None or c["_id"] % 3)]
+    rows.sort(key=lambda c: (c[field], c["_id"]), reverse=True)
+    return [(c["_id"], c[field]) for c in rows]
+
+
+def walk(run, board, chat_id):
+    pages, anchor = [], None
+    while True:
+        rows, more = run(bot.fetch_page(board, chat_id, anchor))
+        pages.append(rows)
+        if not more:
+            break
+        anchor = bot.board_anchor(board, rows[-1])
+    back, anchor = [pages[-1]], bot.board_anchor(board, pages[-1][0])
+    while True:
+        rows, more = run(bot.fetch_page(board, chat_id, anchor, forward=False))
+        if not rows:
+            break
+        back.insert(0, rows)
+        if not more:
+            break
+        anchor = bot.board_anchor(board, rows[0])
+    return pages, back
+
+
+@pytest.mark.parametrize("board", ["rich", "kill"])
+@pytest.mark.parametrize("group", [None, -7])
+def test_keyset_pages_match_offset_pages(board_db, run, board, group):
+    _, cats = board_db
+    field = bot.BOARDS[board][0]
+    expected = offset_ranking(cats, board, group)
+
+    pages, back = walk(run, board, group)
+    assert [[(r["_id"], r[field]) for r in page] for page in pages] == [
+        expected[i:i + PAGE] for i in range(0, len(expected), PAGE)
+    ]
+    assert back == pages  # walking back from the last page gives the same pages
+
+
+@pytest.mark.parametrize("board", ["rich", "kill"])
+@pytest.mark.parametrize("group", [None, -7])
+def test_position_matches_offset_rank(board_db, run, board, group):
+    _, cats = board_db
+    field = bot.BOARDS[board][0]
+    collection, query, score_key, tie_key, _ = bot.board_source(board, group)
+    for position, (user_id, score) in enumerate(offset_ranking(cats, board, group)):
+        found = run(bot.get_board_position(
+            collection, query, score_key, tie_key, bot.encode_value(field, score), user_id
+        ))
+        assert found == position
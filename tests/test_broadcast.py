@@ -0,0 +1,48 @@
+from telegram.error import Forbidden, RetryAfter
+
+import catverse_bot as bot
+
+
+class FakeBot:
+    def __init__(self, error=None):
+        self.error = error
+        self.calls = 0
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.calls += 1
+        if self.error:
+            raise self.error
+        return chat_id
+
+
+def engine():
+    return bot.BroadcastEngine({}, concurrency=4, rate=1000, batch_size=10)
+
+
+def test_flood_wait_is_retried_by_the_outbox_only(monkeypatch, run):
+    monkeypatch.setattr(bot, "chat_bucket", lambda chat_id: bot.TokenBucket(1000, capacity=5))
+    fake = FakeBot(RetryAfter(0))
+
+    async def scenario():
+        monkeypatch.setattr(bot, "outbox", bot.Outbox(1000, 4, 100))
+        try:
+            return await engine()._deliver(fake, 42, "hello")
+        finally:
+            await bot.outbox.close()
+
+    assert run(scenario()) == "failed"
+    assert fake.calls == 3  # the outbox's attempts, not 3 x 3
+
+
+def test_outcomes_are_classified(monkeypatch, run):
+    monkeypatch.setattr(bot, "chat_bucket", lambda chat_id: bot.TokenBucket(1000, capacity=5))
+
+    async def deliver(fake):
+        monkeypatch.setattr(bot, "outbox", bot.Outbox(1000, 4, 100))
+        try:
+            return await engine()._deliver(fake, 42, "hello")
+        finally:
+            await bot.outbox.close()
+
+    assert run(deliver(FakeBot())) == "sent"
+    assert run(deliver(FakeBot(Forbidden("bot was blocked by the user")))) == "dead"
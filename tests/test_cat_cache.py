@@ -0,0 +1,163 @@
+import asyncio
+import time
+
+import pymongo
+import pytest
+
+import catverse_bot as bot
+from conftest import FakeUser
+
+
+class FlakyCollection:
+    """mongomock collection whose next ``bulk_write`` fails the way a real server can."""
+
+    def __init__(self, collection):
+        self._collection = collection
+        self.fail_ids = set()  # these ops get a write error, the rest are applied
+        self.lost = False      # apply everything, then lose the reply
+        self.delay = 0         # seconds the write takes (on the db thread)
+
+    def __getattr__(self, name):
+        return getattr(self._collection, name)
+
+    def bulk_write(self, requests, ordered=True):
+        time.sleep(self.delay)
+        errors = []
+        for i, op in enumerate(requests):
+            if op._filter["_id"] in self.fail_ids:
+                errors.append({"index": i, "code": 2, "errmsg": "boom", "op": op._doc})
+            else:
+                self._collection.bulk_write([op])
+        self.fail_ids = set()
+        if errors:
+            raise pymongo.errors.BulkWriteError({"writeErrors": errors, "writeConcernErrors": [], "nUpserted": 0})
+        if self.lost:
+            self.lost = False
+            raise pymongo.errors.AutoReconnect("connection closed")
+
+
+@pytest.fixture
+def flaky(db, monkeypatch):
+    collection = FlakyCollection(db["cats"])
+    monkeypatch.setattr(bot.cats, "collection", collection)
+    return collection
+
+
+@pytest.fixture
+def cache(db):
+    return bot.CatCache(bot.cats, bot.load_cat, 100, 60, bot.load_partial_cat)
+
+
+def stored_coins(db, user_id):
+    return bot.decode_cat(db["cats"].find_one({"_id": user_id}))["coins"]
+
+
+def test_flush_writes_only_changed_paths(db, cache, run):
+    async def scenario():
+        cat = await cache.get(FakeUser(1))
+        cache.inc(cat, "coins", 7)
+        cache.set(cat, "level", "🐯 Tiger")
+        assert await cache.flush() == 1
+        assert await cache.flush() == 0
+
+    run(scenario())
+    assert stored_coins(db, 1) == 507
+    assert bot.decode_cat(db["cats"].find_one({"_id": 1}))["level"] == "🐯 Tiger"
+
+
+def test_partial_bulk_write_error_retries_only_failed_ops(db, cache, flaky, run):
+    async def scenario():
+        a = await cache.get(FakeUser(1))
+        b = await cache.get(FakeUser(2))
+        cache.inc(a, "coins", 5)
+        cache.inc(b, "coins", 5)
+
+        flaky.fail_ids = {2}
+        with pytest.raises(pymongo.errors.BulkWriteError):
+            await cache.flush()
+        assert cache.stats()["dirty"] == 1
+
+        assert await cache.flush() == 1  # only b's increment is sent again
+        return a, b
+
+    a, b = run(scenario())
+    assert stored_coins(db, 1) == a["coins"] == 505
+    assert stored_coins(db, 2) == b["coins"] == 505
+
+
+def test_permanently_failing_cat_does_not_replay_others(db, cache, flaky, run):
+    async def scenario():
+        a = await cache.get(FakeUser(1))
+        b = await cache.get(FakeUser(2))
+        cache.inc(a, "coins", 5)
+        cache.inc(b, "coins", 5)
+        for _ in range(3):
+            flaky.fail_ids = {2}
+            with pytest.raises(pymongo.errors.BulkWriteError):
+                await cache.flush()
+        return a
+
+    a = run(scenario())
+    assert stored_coins(db, 1) == a["coins"] == 505
+    assert stored_coins(db, 2) == 500
+
+
+def test_unknown_outcome_reloads_instead_of_replaying(db, cache, flaky, run):
+    async def scenario():
+        cat = await cache.get(FakeUser(1))
+        cache.inc(cat, "coins", 10)
+
+        flaky.lost = True
+        with pytest.raises(pymongo.errors.AutoReconnect):
+            await cache.flush()
+        assert await cache.flush() == 0
+
+        fresh = await cache.get(FakeUser(1))
+        assert fresh is not cat
+        return fresh
+
+    fresh = run(scenario())
+    assert stored_coins(db, 1) == fresh["coins"] == 510
+
+
+def test_changes_made_after_a_lost_write_are_kept(db, cache, flaky, run):
+    async def scenario():
+        cat = await cache.get(FakeUser(1))
+        cache.inc(cat, "coins", 10)
+        flaky.lost = True
+        with pytest.raises(pymongo.errors.AutoReconnect):
+            await cache.flush()
+
+        cache.inc(cat, "coins", 1)  # still dirty, so the cat stays until this is written
+        assert await cache.flush() == 1
+        fresh = await cache.get(FakeUser(1))
+        assert fresh is not cat
+        return fresh
+
+    fresh = run(scenario())
+    assert stored_coins(db, 1) == fresh["coins"] == 511
+
+
+def test_evicted_cat_reloaded_mid_flush_keeps_unwritten_changes(db, flaky, run):
+    cache = bot.CatCache(bot.cats, bot.load_cat, 1, 60, bot.load_partial_cat)
+
+    async def scenario():
+        cat = await cache.get(FakeUser(1))
+        cache.inc(cat, "coins", 1000)
+        await cache.get(FakeUser(2))  # pushes cat 1 out of the LRU, still dirty
+
+        flaky.delay = 0.2
+        flush = asyncio.ensure_future(cache.flush())
+        await asyncio.sleep(0.05)  # bulk_write is on its way, nothing stored yet
+        assert stored_coins(db, 1) == 500
+        again = await cache.get(FakeUser(1))
+        await flush
+
+        flaky.delay = 0
+        cache.inc(again, "coins", 1)
+        await cache.flush()
+        return cat, again
+
+    cat, again = run(scenario())
+    assert again is cat
+    assert stored_coins(db, 1) == again["coins"] == 1501
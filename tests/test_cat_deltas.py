@@ -0,0 +1,89 @@
+import asyncio
+import random
+
+import bson
+import pytest
+
+import catverse_bot as bot
+from conftest import FakeUser
+
+
+class RecordingCollection:
+    """mongomock collection that keeps every update document it was sent."""
+
+    def __init__(self, collection):
+        self._collection = collection
+        self.updates = []
+
+    def __getattr__(self, name):
+        return getattr(self._collection, name)
+
+    def bulk_write(self, requests, ordered=True):
+        self.updates.extend(op._doc for op in requests)
+        return self._collection.bulk_write(requests, ordered=ordered)
+
+
+@pytest.fixture
+def recording(db, monkeypatch):
+    collection = RecordingCollection(db["cats"])
+    monkeypatch.setattr(bot.cats, "collection", collection)
+    return collection
+
+
+def new_cache():
+    return bot.CatCache(bot.cats, bot.load_cat, 100, 60, bot.load_partial_cat)
+
+
+def test_concurrent_commands_on_one_cat_lose_nothing(db, recording, run):
+    # two bot processes, each with its own cache and copy of the cat, flushing at random
+    rng = random.Random(3)
+    caches = [new_cache(), new_cache()]
+    added = {"coins": 0, "xp": 0, "dna.luck": 0, "inventory.shield": 0}
+
+    async def command(cache, cat, path, amount, flush):
+        await asyncio.sleep(rng.random() / 1000)
+        cache.inc(cat, path, amount)
+        if flush:
+            await cache.flush()
+
+    async def scenario():
+        cats = [await cache.get(FakeUser(1)) for cache in caches]
+        moves = []
+        for i in range(400):
+            path = rng.choice(list(added))
+            amount = rng.randint(1, 5)
+            added[path] += amount
+            moves.append(command(caches[i % 2], cats[i % 2], path, amount, rng.random() < 0.2))
+        await asyncio.gather(*moves)
+        caches[0].set(cats[0], "level", "🐯 Tiger")
+        caches[1].set(cats[1], "name", "Tom")
+        await asyncio.gather(*(cache.flush() for cache in caches))
+
+    run(scenario())
+    stored = bot.decode_cat(db["cats"].find_one({"_id": 1}))
+    assert stored["coins"] == 500 + added["coins"]
+    assert stored["xp"] == added["xp"]
+    assert stored["dna"]["luck"] == 1 + added["dna.luck"]
+    assert stored["inventory"]["shield"] == added["inventory.shield"]
+    assert (stored["level"], stored["name"]) == ("🐯 Tiger", "Tom")
+
+
+def test_updates_send_only_changed_paths(db, recording, run):
+    cache = new_cache()
+
+    async def scenario():
+        cat = await cache.get(FakeUser(1))
+        cache.inc(cat, "coins", 10)
+        cache.inc(cat, "coins", 5)
+        cache.inc(cat, "inventory.shield", 1)
+        cache.set(cat, "level", "🐯 Tiger")
+        await cache.flush()
+
+    run(scenario())
+    [update] = recording.updates
+    assert update == {
+        "$inc": {bot.cat_field("coins"): 15, bot.cat_field("inventory") + ".shield": 1},
+        "$set": {bot.cat_field("level"): "🐯 Tiger"},
+    }
+    whole = db["cats"].find_one({"_id": 1})
+    assert len(bson.encode(update)) * 3 < len(bson.encode({"$set": whole}))
@@ -0,0 +1,98 @@
+from datetime import datetime, timezone
+
+import bson
+import pytest
+
+import catverse_bot as bot
+
+
+def expected(cat):
+    """What a legacy cat should look like after one trip through the codec."""
+    out = dict(cat)
+    for name, kind in bot.TIMESTAMP_FIELDS.items():
+        value = out.get(name)
+        if value is None:
+            continue
+        if kind == "epoch":
+            out[name] = int(value)
+        elif kind == "date":
+            out[name] = value
+        else:
+            aware = value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+            aware = aware.replace(microsecond=0)
+            out[name] = aware.replace(tzinfo=None) if kind == "naive" else aware
+    out["inventory"] = {item: n for item, n in cat["inventory"].items() if n}
+    return out
+
+
+@pytest.mark.parametrize("short", [False, True])
+def test_cat_round_trips_through_bson(short):
+    for i in range(50):
+        cat = bot.synthetic_cat(i)
+        raw = bson.decode(bson.encode(bot.encode_cat(cat, short)))
+        assert bot.decode_cat(raw) == expected(cat)
+
+
+@pytest.mark.parametrize("short", [False, True])
+def test_cat_state_round_trip(short):
+    cat = bot.synthetic_cat(1)
+    state = bot.CatState.from_bson(bot.encode_cat(cat, short))
+    assert bot.decode_cat(state.to_bson(short)) == expected(cat)
+
+
+def test_short_keys_are_unique_and_smaller():
+    assert len(set(bot.SHORT_KEYS.values())) == len(bot.SHORT_KEYS)
+    cat = bot.synthetic_cat(2)
+    assert len(bson.encode(bot.encode_cat(cat, True))) < len(bson.encode(bot.encode_cat(cat, False)))
+
+
+@pytest.mark.parametrize("coins, stored, decoded", [
+    (0, 0, 0),
+    (1234, 1234, 1234),
+    (float("inf"), bot.COIN_CAP, float("inf")),
+    (bot.COIN_CAP, bot.COIN_CAP, float("inf")),
+    (bot.COIN_CAP * 4, bot.COIN_CAP, float("inf")),
+])
+def test_coins_are_int64_with_a_cap(coins, stored, decoded):
+    value = bot.encode_value("coins", coins)
+    assert value == stored and isinstance(value, int)
+    assert bot.decode_value("coins", bson.decode(bson.encode({"c": value}))["c"]) == decoded
+
+
+def test_coin_cap_leaves_room_for_inc():
+    assert bot.COIN_CAP + 10 ** 15 < 2 ** 63
+    assert bot.decode_value("coins", bot.COIN_CAP + 500) == float("inf")
+
+
+def test_debited_cap_still_reads_as_inf():
+    # /give, /rob and the shop $inc a negative delta onto the stored cap
+    for spent in (1, 500, 10 ** 15):
+        assert bot.decode_value("coins", bot.COIN_CAP - spent) == float("inf")
+    assert bot.encode_value("coins", bot.COIN_CAP - 500) == bot.COIN_CAP
+    assert bot.decode_value("coins", bot.COIN_INF_FLOOR - 1) == bot.COIN_INF_FLOOR - 1
+
+
+def test_timestamps():
+    aware = datetime(2026, 10, 18, 12, 30, 45, 999999, tzinfo=timezone.utc)
+    naive = aware.replace(tzinfo=None)
+
+    epoch = bot.encode_value("created", aware)
+    assert isinstance(epoch, int) and epoch == int(aware.timestamp())
+    assert bot.decode_value("created", epoch) == aware.replace(microsecond=0)
+
+    # naive values are UTC, and come back naive
+    assert bot.encode_value("last_daily", naive) == epoch
+    assert bot.decode_value("last_daily", epoch) == naive.replace(microsecond=0)
+
+    # dates are ISO strings in Python, epochs in Mongo
+    assert bot.decode_value("last_fish_date", bot.encode_value("last_fish_date", "2026-10-18")) == "2026-10-18"
+    assert bot.decode_value("last_fish_date", "2026-10-17") == "2026-10-17"  # legacy value, untouched
+
+    assert bot.decode_value("last_msg", bot.encode_value("last_msg", 1760790645.75)) == 1760790645
+    assert bot.decode_value("protected_until", bot.encode_value("protected_until", None)) is None
+
+
+def test_legacy_datetimes_still_decode():
+    stored = datetime(2025, 1, 2, 3, 4, 5)  # pre-codec docs kept BSON dates
+    assert bot.decode_value("created", stored) == stored.replace(tzinfo=timezone.utc)
+    assert bot.decode_value("last_claim", stored) == stored
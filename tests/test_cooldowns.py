@@ -0,0 +1,68 @@
+import asyncio
+import time
+from datetime import timedelta
+
+import pytest
+
+import catverse_bot as bot
+from conftest import FakeUser
+
+
+@pytest.fixture
+def cache(db, monkeypatch):
+    cache = bot.CatCache(bot.cats, bot.load_cat, 100, 60, bot.load_partial_cat)
+    monkeypatch.setattr(bot, "cat_cache", cache)
+    return cache
+
+
+def test_cooldown_expires_and_stays_bounded():
+    cooldown = bot.Cooldown(4, max_entries=1000)
+    assert cooldown.hit("a", now=0)
+    assert not cooldown.hit("a", now=3.9)
+    assert cooldown.hit("a", now=4)
+
+    for i in range(5000):
+        cooldown.hit(i, now=10)
+    assert len(cooldown) == 1000
+    cooldown.hit("b", now=20)
+    assert len(cooldown) == 1
+
+
+def test_cooldown_checks_per_second():
+    cooldown = bot.Cooldown(4, max_entries=100000)
+    checks = 300000
+    keys = [(-100, i % 20000) for i in range(checks)]  # (chat, user), 15 messages each
+    started = time.perf_counter()
+    for i, key in enumerate(keys):
+        cooldown.hit(key, now=i / 50000)  # 50k messages a second across the bot
+    rate = checks / (time.perf_counter() - started)
+    print(f"\n{rate:,.0f} cooldown checks/s, {len(cooldown)} live keys")
+    assert rate > 100000
+    assert len(cooldown) <= 4 * 50000
+
+
+def test_concurrent_claims_pay_once(db, cache, run):
+    async def scenario():
+        cat = await bot.get_cat(FakeUser(1))
+        # all of them pass the cached check; the conditional update picks one
+        return cat, await asyncio.gather(*[
+            bot.claim_timed_reward(cat, "last_daily", timedelta(hours=24), 400) for _ in range(10)
+        ])
+
+    cat, results = run(scenario())
+    assert results.count(True) == 1
+    assert cat["coins"] == 900
+    assert bot.decode_cat(db["cats"].find_one({"_id": 1}))["coins"] == 900
+
+    again = run(bot.claim_timed_reward(cat, "last_daily", timedelta(hours=24), 400))
+    assert again is False
+
+
+def test_claim_reopens_after_the_period(db, cache, run):
+    cat = run(bot.get_cat(FakeUser(1)))
+    assert run(bot.claim_timed_reward(cat, "last_claim", timedelta(hours=24), 100))
+    # another process saw the old stamp: the server still refuses
+    bot.cat_cache.apply_committed(1, set={"last_claim": None})
+    assert not run(bot.claim_timed_reward(cat, "last_claim", timedelta(hours=24), 100))
+    assert run(bot.claim_timed_reward(cat, "last_claim", timedelta(seconds=0), 100))
+    assert bot.decode_cat(db["cats"].find_one({"_id": 1}))["coins"] == 700
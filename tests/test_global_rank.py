@@ -0,0 +1,47 @@
+import random
+
+import pytest
+
+import catverse_bot as bot
+
+
+@pytest.fixture
+def population(db):
+    rng = random.Random(5)
+    cats = [
+        {"_id": i, "coins": rng.randint(0, 300), "kills": rng.randint(0, 20), "fish_total_earned": rng.randint(0, 50)}
+        for i in range(1, 1001)
+    ]
+    db["cats"].insert_many([bot.encode_cat(cat) for cat in cats])
+    return cats
+
+
+@pytest.mark.parametrize("board", sorted(bot.RANK_FIELDS))
+def test_rank_matches_a_full_sort(population, board, run):
+    field = bot.RANK_FIELDS[board]
+    sample = random.Random(board).sample(population, 20)
+
+    async def ranks():
+        return [await bot.get_global_rank(cat, board) for cat in sample]
+
+    for cat, rank in zip(sample, run(ranks())):
+        assert rank == 1 + sum(other[field] > cat[field] for other in population)
+
+
+@pytest.mark.parametrize("board", sorted(bot.RANK_FIELDS))
+def test_rank_query_is_the_indexed_hot_query(db, board, run, monkeypatch):
+    # ensure_indexes explains every HOT_QUERIES shape against the real server at startup
+    seen = []
+
+    async def count_documents(query, **kwargs):
+        seen.append(query)
+        return 0
+
+    monkeypatch.setattr(bot.cats, "count_documents", count_documents)
+    run(bot.get_global_rank({"_id": 1, "coins": 10, "kills": 1, "fish_total_earned": 3}, board))
+
+    field = bot.cat_field(bot.RANK_FIELDS[board])
+    [query] = seen
+    hot = {name: command for _, name, command in bot.HOT_QUERIES}[f"rank:{board}"]["query"]
+    assert {key: set(value) for key, value in query.items()} == {key: set(value) for key, value in hot.items()}
+    assert any(keys[0][0] == field for keys in bot.REQUIRED_INDEXES[bot.cats])
@@ -0,0 +1,67 @@
+import random
+import statistics
+import time
+from datetime import timedelta
+
+import pytest
+
+import catverse_bot as bot
+from conftest import FakeUser
+
+GROUPS = 10000
+
+
+@pytest.fixture
+def boards(db, monkeypatch):
+    monkeypatch.setattr(bot, "cat_cache", bot.CatCache(bot.cats, bot.load_cat, 100, 60, bot.load_partial_cat))
+    boards = bot.GroupBoards(bot.group_members, 60, 3600, 1000)
+    monkeypatch.setattr(bot, "group_boards", boards)
+    return boards
+
+
+def member(chat_id, user_id, coins):
+    return {"_id": bot.group_member_key(chat_id, user_id), "g": chat_id, "u": user_id, "n": f"cat{user_id}",
+            "t": 0, "c": coins, "k": 0, "f": 0}
+
+
+def test_daily_claim_reaches_group_boards(db, boards, run):
+    async def scenario():
+        cat = await bot.get_cat(FakeUser(1))
+        boards.seen(-100, cat)
+        await boards.flush()
+        assert await bot.claim_timed_reward(cat, "last_daily", timedelta(hours=24), 400)
+        await boards.flush()
+        return await boards.top(-100, "coins")
+
+    assert run(scenario()) == [{"_id": 1, "name": "Cat", "coins": 900}]
+
+
+def test_render_with_10k_groups(db, boards, run):
+    rng = random.Random(8)
+    docs = [member(-chat, user, rng.randint(0, 10 ** 6)) for chat in range(1, GROUPS + 1) for user in (chat, chat + GROUPS)]
+    big = [member(-1, user, rng.randint(0, 10 ** 6)) for user in range(3 * GROUPS, 3 * GROUPS + 40)]
+    db["group_members"].insert_many(docs + big)
+
+    async def render(chat_id):
+        started = time.perf_counter()
+        html = await bot.build_rich_board(chat_id)
+        return html, time.perf_counter() - started
+
+    async def scenario():
+        return [await render(-chat) for chat in rng.sample(range(1, GROUPS + 1), 20)], await render(-1)
+
+    sampled, (html, _) = run(scenario())
+    took = [seconds for _, seconds in sampled]
+    print(f"\ngroup /toprich over {len(docs) + len(big)} memberships in {GROUPS} groups: "
+          f"p50 {statistics.median(took) * 1000:.1f} ms, max {max(took) * 1000:.1f} ms")
+
+    expected = sorted((d for d in docs + big if d["g"] == -1), key=lambda d: (-d["c"], -d["u"]))[:10]
+    positions = [html.index(f"id={d['u']}'") for d in expected]
+    assert positions == sorted(positions)
+    assert html.count("tg://user") == 10
+    for page, _ in sampled:
+        assert page.count("tg://user") == 2
+
+    # against Mongo this read is the indexed (g, c, u) hot query ensure_indexes explains at startup
+    assert [("g", 1), ("c", -1), ("u", -1)] in bot.REQUIRED_INDEXES[bot.group_members]
+    assert {name for _, name, _ in bot.HOT_QUERIES} >= {"group:toprich"}
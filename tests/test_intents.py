@@ -0,0 +1,49 @@
+import pytest
+
+import catverse_bot as bot
+
+
+@pytest.fixture
+def engine():
+    return bot.IntentEngine(bot.INTENT_PHRASES, 0.9)
+
+
+@pytest.mark.parametrize("text", [
+    "is it time to sleep?",
+    "what is the time complexity",
+    "you are the owner",
+    "me the owner now",
+    "owner ko bolo coins de",
+    "sone ka time hai kya",
+    "mera name rahul hai",
+    "hello everyone, kal ka plan kya hai",
+    "this is it",
+])
+def test_statements_go_to_the_ai(engine, text):
+    assert engine.answer(text) is None
+
+
+@pytest.mark.parametrize("text, intent", [
+    ("who is your owner?", "owner"),
+    ("owner kaun hai bhai", "owner"),
+    ("what's your name", "name"),
+    ("hi meowstric, tumhara naam kya hai?", "name"),
+    ("what time is it", "time"),
+    ("aaj date kya hai", "time"),
+    ("hiii", "greeting"),
+    ("thank you bhai", "thanks"),
+])
+def test_questions_are_answered_locally(engine, text, intent):
+    assert engine.classify(text)[0] == intent
+    assert engine.answer(text)
+    assert engine.stats()["by_intent"][intent] == 1
+
+
+def test_prepare_ai_chat_only_skips_the_ai_for_confident_intents(monkeypatch):
+    monkeypatch.setattr(bot, "intents", bot.IntentEngine(bot.INTENT_PHRASES, 0.9))
+
+    quick, messages = bot.prepare_ai_chat(-100, "is it time to sleep?", 1)
+    assert quick is None and messages[-1]["content"] == "is it time to sleep?"
+
+    quick, messages = bot.prepare_ai_chat(-100, "who made you?", 1)
+    assert bot.OWNER_NAME in quick and messages is None
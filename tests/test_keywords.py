@@ -0,0 +1,92 @@
+import random
+import re
+import time
+
+import pytest
+
+import catverse_bot as bot
+
+# every list the old per-keyword loops scanned (filler is new and only feeds intent confidence)
+LISTS = {"abuse": bot.ABUSIVE_WORDS, **bot.INTENT_PHRASES, **bot.EMOTION_WORDS, "cat": bot.CAT_CALLS}
+OTHER_WORDS = ["kal", "milte", "this", "education", "sadak", "catalog", "dildo", "meri", "baat", "suno", "123", "🐾"]
+
+
+def loop_match(text, phrases):
+    """The old loop, one search per keyword, with whole-word boundaries."""
+    lowered = text.lower()
+    return any(
+        re.search(r"(?<!\w)" + r"\W+".join(map(re.escape, phrase.split())) + r"(?!\w)", lowered)
+        for phrase in phrases
+    )
+
+
+def corpus(size, seed=24):
+    rng = random.Random(seed)
+    keywords = [phrase for phrases in LISTS.values() for phrase in phrases]
+    texts = []
+    for _ in range(size):
+        words = rng.sample(OTHER_WORDS, rng.randint(0, 4)) + rng.sample(keywords, rng.randint(0, 3))
+        rng.shuffle(words)
+        texts.append(rng.choice([" ", ", ", "! ", " ... "]).join(words).title() if rng.random() < 0.2 else " ".join(words))
+    return texts
+
+
+def test_one_pass_finds_what_the_keyword_loops_find():
+    for text in corpus(2000):
+        found = bot.keywords.scan(text)
+        for group, phrases in LISTS.items():
+            assert (group in found) == loop_match(text, phrases), (text, group)
+
+
+@pytest.mark.parametrize("text, group", [
+    ("hiiii", "greeting"),
+    ("byeee", "goodbye"),
+    ("pyaaar hai", "love"),
+    ("meowww", "cat"),
+    ("what's your name", "name"),
+    ("MC!", "abuse"),
+])
+def test_stretched_and_punctuated_spellings_match(text, group):
+    assert group in bot.keywords.scan(text)
+
+
+@pytest.mark.parametrize("text", ["this", "education", "sadak pe", "dildo", "abc def", "sochiye"])
+def test_keywords_inside_other_words_do_not_match(text):
+    assert bot.keywords.scan(text).keys() == {"words"}
+
+
+def test_word_count_covers_every_word():
+    found = bot.keywords.scan("hi bhai, what's your name? 🐾 कैसे हो")
+    assert found["words"] == 8  # hi bhai what s your name कैसे हो
+    assert found["greeting"] == 1 and found["filler"] == 1 and found["name"] == 4
+
+
+def old_chain(text):
+    m = text.lower()
+    mood = next((mood for words, mood in [
+        (["love", "pyaar", "dil"], "love"), (["angry", "gussa", "naraz"], "angry"),
+        (["cry", "sad", "dukh"], "crying"), (["funny", "lol", "joke"], "funny"), (["hi", "hello", "hey"], "happy"),
+    ] if any(w in m for w in words)), "thinking")
+    abuse = any(re.search(rf"\b{w}\b", m) for w in bot.ABUSIVE_WORDS)
+    hints = [any(w in m for w in words) for words in LISTS.values()]
+    return mood, abuse, hints
+
+
+def new_chain(text):
+    found = bot.keywords.scan(text)
+    mood = next((mood for group, mood in bot.EMOTION_ORDER if group in found), "thinking")
+    return mood, "abuse" in found, bot.intents.pick(found)
+
+
+def test_single_pass_beats_the_old_chain():
+    texts = corpus(3000, seed=5)
+
+    def timed(chain):
+        started = time.perf_counter()
+        for text in texts:
+            chain(text)
+        return time.perf_counter() - started
+
+    old, new = min(timed(old_chain) for _ in range(3)), min(timed(new_chain) for _ in range(3))
+    print(f"\nold chain {len(texts) / old:,.0f} msg/s, single pass {len(texts) / new:,.0f} msg/s")
+    assert new < old
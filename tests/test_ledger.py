@@ -0,0 +1,84 @@
+from datetime import timedelta
+
+import pymongo
+import pytest
+
+import catverse_bot as bot
+
+
+class FlakyEvents:
+    """mongomock collection whose next ``insert_many`` stores a few docs, then loses the reply."""
+
+    def __init__(self, collection):
+        self._collection = collection
+        self.store_then_fail = None  # how many docs land before the connection drops
+
+    def __getattr__(self, name):
+        return getattr(self._collection, name)
+
+    def insert_many(self, docs, ordered=True):
+        for doc in docs:
+            doc.setdefault("_id", bot.ObjectId())
+        if self.store_then_fail is not None:
+            landed, self.store_then_fail = docs[:self.store_then_fail], None
+            if landed:
+                self._collection.insert_many(landed)
+            raise pymongo.errors.AutoReconnect("connection closed")
+        return self._collection.insert_many(docs, ordered=ordered)
+
+
+@pytest.fixture
+def ledger(db, monkeypatch):
+    events = FlakyEvents(db["economy_ledger"])
+    monkeypatch.setattr(bot.economy_ledger, "collection", events)
+    return bot.Ledger(bot.economy_ledger, bot.ledger_balances, bot.ledger_daily, 1, 10, 100, 1), events
+
+
+def test_lost_reply_stores_each_event_once_under_fresh_ids(db, ledger, run):
+    ledger, events = ledger
+    for i in range(4):
+        ledger.record(1, "fish", "coins", delta=i + 1)
+    events.store_then_fail = 2
+
+    with pytest.raises(pymongo.errors.AutoReconnect):
+        run(ledger.flush())
+    old_ids = [event["_id"] for event in ledger._buffer]
+    stored_before = {doc["_id"] for doc in db["economy_ledger"].find()}
+
+    run(ledger.flush())
+    docs = list(db["economy_ledger"].find())
+    assert sorted(doc["d"] for doc in docs) == [1, 2, 3, 4]
+    assert ledger.written == 4
+    assert not ledger._unsure
+
+    # the ones that didn't land came back behind every old id, so a checkpoint can't skip them
+    retried = [doc["_id"] for doc in docs if doc["_id"] not in stored_before]
+    assert len(retried) == 2
+    assert min(retried) > max(old_ids)
+
+
+def test_lookup_failure_keeps_the_batch_unsure(db, ledger, run, monkeypatch):
+    ledger, events = ledger
+    ledger.record(1, "fish", "coins", delta=5)
+    events.store_then_fail = 1
+    with pytest.raises(pymongo.errors.AutoReconnect):
+        run(ledger.flush())
+
+    async def down(*args, **kwargs):
+        raise pymongo.errors.AutoReconnect("still down")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(bot.economy_ledger, "find", down)
+        with pytest.raises(pymongo.errors.AutoReconnect):
+            run(ledger.flush())
+
+    run(ledger.flush())
+    assert db["economy_ledger"].count_documents({}) == 1
+    assert ledger.written == 1
+
+
+def test_events_are_stamped_in_aware_utc(ledger):
+    ledger, _ = ledger
+    ledger.record(1, "fish", "coins", delta=5)
+    stamp = ledger._buffer[-1]["t"]
+    assert stamp.tzinfo is not None and stamp.utcoffset() == timedelta(0)
@@ -0,0 +1,70 @@
+import asyncio
+import gc
+
+import catverse_bot as bot
+
+
+def busy(bucket):
+    while bucket.try_acquire():
+        pass
+    return bucket
+
+
+def test_buckets_stay_under_the_cap_when_every_chat_is_busy(monkeypatch):
+    monkeypatch.setattr(bot, "OUTBOX_MAX_BUCKETS", 3)
+    box = bot.Outbox(30, 4, 100)
+    for chat_id in (1, 2, 3):
+        busy(box._bucket(chat_id))
+    box._bucket(1)  # recently used again
+
+    busy(box._bucket(4))
+    assert list(box._buckets) == [3, 1, 4]  # 2 was quiet the longest
+
+    for chat_id in range(5, 50):
+        busy(box._bucket(chat_id))
+    assert len(box._buckets) == 3
+
+
+def test_full_buckets_go_before_busy_ones(monkeypatch):
+    monkeypatch.setattr(bot, "OUTBOX_MAX_BUCKETS", 3)
+    box = bot.Outbox(30, 4, 100)
+    busy(box._bucket(1))
+    box._bucket(2)  # idle, still full
+    busy(box._bucket(3))
+
+    box._bucket(4)
+    assert list(box._buckets) == [1, 3, 4]
+
+
+def test_cancelled_caller_does_not_break_the_sender(run):
+    errors = []
+
+    async def scenario():
+        asyncio.get_running_loop().set_exception_handler(lambda loop, context: errors.append(context))
+        box = bot.Outbox(1000, 4, 100)
+        gate = asyncio.Event()
+
+        async def slow(text):
+            await gate.wait()
+            return text
+
+        async def broken(text):
+            await gate.wait()
+            raise RuntimeError("boom")
+
+        gave_up = [box.submit(1, "a", slow), box.submit(2, "b", broken)]
+        await asyncio.sleep(0.01)  # both in flight
+        for future in gave_up:
+            future.cancel()
+        gate.set()
+        await asyncio.sleep(0.01)
+
+        after = await asyncio.wait_for(box.submit(3, "c", slow), 1)
+        await box.close()
+        gc.collect()
+        return box, after
+
+    box, after = run(scenario())
+    assert after == "c"
+    assert (box.sent, box.failed) == (2, 1)
+    assert not errors
@@ -0,0 +1,96 @@
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+
+import catverse_bot as bot
+from conftest import FakeUser
+
+
+@pytest.fixture
+def cats(db, run, monkeypatch):
+    monkeypatch.setattr(bot, "cat_cache", bot.CatCache(bot.cats, bot.load_cat, 100, 60, bot.load_partial_cat))
+
+    async def load():
+        return await bot.get_cat(FakeUser(1)), await bot.get_cat(FakeUser(2))
+
+    return run(load())
+
+
+def test_open_victim_spends_nothing(cats):
+    attacker, victim = cats
+    bot.cat_inc(attacker, "inventory.shield_breaker", 1)
+
+    assert bot.check_protection(attacker, victim, "rob") == "open"
+    assert attacker.inventory["shield_breaker"] == 1
+
+
+def test_inventory_shield_switches_on_to_block(cats):
+    attacker, victim = cats
+    bot.cat_inc(victim, "inventory.shield", 1)
+
+    assert bot.check_protection(attacker, victim, "rob") == "blocked"
+    assert victim.inventory["shield"] == 0
+    assert bot.is_protected(victim)
+
+    # already protected: the next attack is blocked without spending anything
+    bot.cat_inc(victim, "inventory.shield", 1)
+    assert bot.check_protection(attacker, victim, "rob") == "blocked"
+    assert victim.inventory["shield"] == 1
+
+
+def test_breaker_gets_past_inventory_shield_without_burning_it(cats):
+    attacker, victim = cats
+    bot.cat_inc(victim, "inventory.shield", 1)
+    bot.cat_inc(attacker, "inventory.shield_breaker", 1)
+
+    assert bot.check_protection(attacker, victim, "rob") == "broken"
+    assert attacker.inventory["shield_breaker"] == 0
+    assert victim.inventory["shield"] == 1
+    assert not bot.is_protected(victim)
+
+
+def test_breaker_ends_active_protection(cats):
+    attacker, victim = cats
+    bot.protect_for(victim, bot.SHIELD_DURATION)
+    bot.cat_inc(attacker, "inventory.shield_breaker", 1)
+
+    assert bot.check_protection(attacker, victim, "kill") == "broken"
+    assert not bot.is_protected(victim)
+
+
+def test_killed_cat_recovers_before_the_next_kill(cats):
+    _, victim = cats
+    now = datetime.now(timezone.utc)
+    bot.set_health(victim, 0, now)
+
+    assert bot.recovery_left(victim, now) == timedelta(hours=4)
+    assert bot.current_health(victim, now + timedelta(minutes=3)) == 1
+    assert bot.recovery_left(victim, now + timedelta(minutes=3))  # alive again, but not fair game
+    assert bot.recovery_left(victim, now + timedelta(hours=4)) is None
+
+
+def test_kill_refuses_a_recovering_victim(cats, run, monkeypatch):
+    attacker, victim = cats
+    replies = []
+
+    async def reply(message, text, **kwargs):
+        replies.append(text)
+
+    async def send(*args, **kwargs):
+        pass
+
+    monkeypatch.setattr(bot, "reply", reply)
+    monkeypatch.setattr(bot, "send", send)
+    update = SimpleNamespace(
+        effective_user=FakeUser(1),
+        message=SimpleNamespace(reply_to_message=SimpleNamespace(from_user=FakeUser(2))),
+    )
+
+    run(bot.kill(update, None))
+    assert victim.deaths == 1
+    bot.set_health(victim, 1, datetime.now(timezone.utc))  # ~2.4 minutes of regen later
+
+    run(bot.kill(update, None))
+    assert victim.deaths == 1
+    assert "still recovering" in replies[-1]
@@ -0,0 +1,93 @@
+import asyncio
+import random
+
+import pytest
+
+import catverse_bot as bot
+from conftest import FakeUser
+
+
+@pytest.fixture
+def cache(db, monkeypatch):
+    cache = bot.CatCache(bot.cats, bot.load_cat, 100, 60, bot.load_partial_cat)
+    monkeypatch.setattr(bot, "cat_cache", cache)
+    return cache
+
+
+def stored(db):
+    return {doc["_id"]: bot.decode_cat(doc)["coins"] for doc in db["cats"].find()}
+
+
+def test_concurrent_transfers_conserve_coins(db, cache, run):
+    rng = random.Random(11)
+
+    async def scenario():
+        cats = [await bot.get_cat(FakeUser(i)) for i in range(1, 6)]
+        for cat in cats:
+            bot.cat_inc(cat, "coins", rng.randint(0, 300))  # pending deltas, flushed by the transfers
+        start = sum(cat["coins"] for cat in cats)
+
+        moves = []
+        for _ in range(200):
+            sender, receiver = rng.sample(cats, 2)
+            moves.append(bot.transfer_coins(
+                sender, receiver, rng.randint(1, 400), rng.choice(["give", "rob"]), partial=rng.random() < 0.5,
+            ))
+        results = await asyncio.gather(*moves)
+        await cache.flush()
+        return cats, start, results
+
+    cats, start, results = run(scenario())
+    balances = stored(db)
+    assert sum(balances.values()) == start
+    assert all(coins >= 0 for coins in balances.values())
+    assert {cat["_id"]: cat["coins"] for cat in cats} == balances
+    assert any(taken for taken, _ in results) and any(not taken for taken, _ in results)
+
+
+def test_fee_is_burned_not_duplicated(db, cache, run):
+    async def scenario():
+        a = await bot.get_cat(FakeUser(1))
+        b = await bot.get_cat(FakeUser(2))
+        moved = await asyncio.gather(*[bot.transfer_coins(a, b, 100, "give", fee=0.05) for _ in range(10)])
+        await cache.flush()
+        return moved
+
+    moved = run(scenario())
+    taken = sum(t for t, _ in moved)
+    received = sum(r for _, r in moved)
+    balances = stored(db)
+    assert taken == 500 and received == 475  # a starts with 500: only five of ten fit
+    assert balances == {1: 0, 2: 975}
+
+
+def test_all_or_nothing_give_never_overdraws(db, cache, run):
+    async def scenario():
+        a = await bot.get_cat(FakeUser(1))
+        b = await bot.get_cat(FakeUser(2))
+        return await asyncio.gather(*[bot.transfer_coins(a, b, 300, "give") for _ in range(5)])
+
+    results = run(scenario())
+    assert sorted(results) == [(0, 0)] * 4 + [(300, 300)]
+    assert stored(db) == {1: 200, 2: 800}
+
+
+def test_owner_give_keeps_the_infinite_wallet(db, cache, run, monkeypatch):
+    async def scenario():
+        owner = await bot.get_cat(FakeUser(bot.OWNER_ID))
+        b = await bot.get_cat(FakeUser(2))
+        bot.cat_set(owner, "coins", float("inf"))
+        moved = [
+            await bot.transfer_coins(owner, b, 300, "give"),
+            await bot.transfer_coins(owner, b, 50, "rob", partial=True),
+        ]
+        await cache.flush()
+
+        monkeypatch.setattr(bot, "cat_cache", bot.CatCache(bot.cats, bot.load_cat, 100, 60, bot.load_partial_cat))
+        return moved, await bot.get_cat(FakeUser(bot.OWNER_ID)), await bot.get_cat(FakeUser(2))
+
+    moved, owner, b = run(scenario())
+    assert moved == [(300, 300), (50, 50)]
+    assert owner.coins == float("inf")
+    assert b.coins == 850
+    assert db["cats"].find_one({"_id": bot.OWNER_ID})[bot.cat_field("coins")] == bot.COIN_CAP